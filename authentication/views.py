@@ -398,6 +398,7 @@ from django.contrib import messages
 from django.contrib.auth import login as auth_login, logout as auth_logout
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_http_methods
+from orders.history import get_order_summary
 from .forms import UserRegistrationForm, UserLoginForm, PasswordResetForm, PasswordResetConfirmForm
 
 
@@ -598,7 +599,10 @@ def profile_view(request):
         messages.success(request, _('個人資料已更新。'))
         return redirect('auth:profile-form')
     
-    return render(request, 'authentication/profile.html', {'user': user})
+    return render(request, 'authentication/profile.html', {
+        'user': user,
+        'order_summary': get_order_summary(user),
+    })
 
 
 @require_http_methods(["GET"])
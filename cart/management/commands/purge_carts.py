@@ -0,0 +1,99 @@
+"""
+Management command to purge abandoned carts and expired sessions.
+"""
+
+import time
+from datetime import timedelta
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from cart.models import Cart
+
+
+class Command(BaseCommand):
+    help = 'Delete abandoned carts and expired sessions in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=30,
+            help='Delete carts not updated within this many days (default: 30)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Rows deleted per transaction (default: 500)',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0.0,
+            help='Seconds to pause between batches to limit load (default: 0)',
+        )
+        parser.add_argument(
+            '--include-user-carts',
+            action='store_true',
+            help='Also delete abandoned carts belonging to registered users',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show what would be deleted without making changes',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            self.stderr.write(self.style.ERROR('--batch-size must be at least 1'))
+            return
+
+        now = timezone.now()
+        cutoff = now - timedelta(days=options['days'])
+
+        # A cart is abandoned when neither it nor any of its lines changed since the cutoff
+        carts = Cart.objects.filter(updated_at__lt=cutoff).exclude(items__updated_at__gte=cutoff)
+        if not options['include_user_carts']:
+            carts = carts.filter(user__isnull=True)
+        sessions = Session.objects.filter(expire_date__lt=now)
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('DRY RUN MODE - No changes will be made'))
+            self.stdout.write(f'Would delete {carts.count()} carts and {sessions.count()} expired sessions')
+            return
+
+        self._purge('carts', carts, batch_size, options['sleep'])
+        self._purge('expired sessions', sessions, batch_size, options['sleep'])
+
+    def _purge(self, label, queryset, batch_size, pause):
+        """
+        Delete rows matching queryset in primary-key batches, one short
+        transaction per batch so no lock is held for long.
+        """
+        total = 0
+        batches = 0
+        started = time.monotonic()
+
+        while True:
+            with transaction.atomic():
+                pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+                if not pks:
+                    break
+                # Re-apply the filter so rows touched since the SELECT are kept
+                deleted, per_model = queryset.filter(pk__in=pks).delete()
+            total += per_model.get(queryset.model._meta.label, 0)
+            batches += 1
+            if pause:
+                time.sleep(pause)
+
+        elapsed = time.monotonic() - started
+        rate = total / elapsed if elapsed > 0 else 0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Deleted {total} {label} in {batches} batches '
+                f'({elapsed:.2f}s, {rate:.0f} rows/s)'
+            )
+        )
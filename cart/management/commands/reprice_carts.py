@@ -0,0 +1,50 @@
+"""
+Management command to reprice cart items to current catalog prices.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from cart.repricing import DEFAULT_CHUNK_SIZE, reprice_all_cart_items, reprice_cart_items
+
+
+class Command(BaseCommand):
+    help = 'Reprice cart items to current product/variant prices using set-based updates'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--product',
+            type=int,
+            action='append',
+            dest='product_ids',
+            help='Only reprice lines for this product ID (repeatable)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=DEFAULT_CHUNK_SIZE,
+            help=f'Cart items per chunk when repricing the whole table (default: {DEFAULT_CHUNK_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        
+        if options['product_ids']:
+            updated, flagged = reprice_cart_items(product_ids=options['product_ids'])
+        else:
+            if options['chunk_size'] < 1:
+                self.stderr.write(self.style.ERROR('--chunk-size must be at least 1'))
+                return
+            updated = flagged = 0
+            for max_id, chunk_updated, chunk_flagged in reprice_all_cart_items(options['chunk_size']):
+                updated += chunk_updated
+                flagged += chunk_flagged
+                if chunk_updated:
+                    self.stdout.write(f'Up to item {max_id or "end"}: {chunk_updated} items repriced')
+        
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Repriced {updated} cart items in {flagged} carts ({elapsed:.2f}s)'
+            )
+        )
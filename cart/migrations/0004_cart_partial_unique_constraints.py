@@ -0,0 +1,72 @@
+# Generated by Django 4.2.24 on 2026-10-19 10:32
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_carts(apps, schema_editor):
+    """
+    Collapse duplicate guest carts and duplicate cart lines so the new
+    unique constraints can be created.
+    """
+    Cart = apps.get_model('cart', 'Cart')
+    CartItem = apps.get_model('cart', 'CartItem')
+    
+    duplicate_keys = (
+        Cart.objects.filter(session_key__isnull=False)
+        .values('session_key')
+        .annotate(n=Count('id'))
+        .filter(n__gt=1)
+        .values_list('session_key', flat=True)
+    )
+    for session_key in list(duplicate_keys):
+        carts = list(Cart.objects.filter(session_key=session_key).order_by('created_at', 'id'))
+        keeper = carts[0]
+        for duplicate in carts[1:]:
+            CartItem.objects.filter(cart=duplicate).update(cart=keeper)
+            duplicate.delete()
+    
+    duplicate_lines = (
+        CartItem.objects.values('cart_id', 'product_id', 'variant_id')
+        .annotate(n=Count('id'))
+        .filter(n__gt=1)
+    )
+    for line in list(duplicate_lines):
+        items = list(
+            CartItem.objects.filter(
+                cart_id=line['cart_id'],
+                product_id=line['product_id'],
+                variant_id=line['variant_id'],
+            ).order_by('created_at', 'id')
+        )
+        keeper = items[0]
+        keeper.quantity = sum(item.quantity for item in items)
+        keeper.save(update_fields=['quantity'])
+        CartItem.objects.filter(id__in=[item.id for item in items[1:]]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0003_fix_cart_item_prices'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_carts, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='cartitem',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(condition=models.Q(('session_key__isnull', False)), fields=('session_key',), name='cart_unique_session_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(condition=models.Q(('variant__isnull', False)), fields=('cart', 'product', 'variant'), name='cart_item_unique_variant'),
+        ),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(condition=models.Q(('variant__isnull', True)), fields=('cart', 'product'), name='cart_item_unique_product'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.24 on 2026-10-19 10:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0004_cart_partial_unique_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='prices_changed_at',
+            field=models.DateTimeField(blank=True, help_text='商品價格重新計算的時間（顯示通知後清除）/ When item prices were repriced (cleared once shown)', null=True, verbose_name='價格變動時間 / Prices Changed At'),
+        ),
+    ]
@@ -3,9 +3,11 @@ Shopping cart models for Taiwan e-commerce platform.
 Supports both authenticated users and guest sessions with bilingual field labels.
 """
 
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import Q
 from django.conf import settings
 from django.core.validators import MinValueValidator
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from products.models import Product, ProductVariant
 
@@ -44,6 +46,13 @@ class Cart(models.Model):
         auto_now=True
     )
     
+    prices_changed_at = models.DateTimeField(
+        _('價格變動時間 / Prices Changed At'),
+        null=True,
+        blank=True,
+        help_text=_('商品價格重新計算的時間（顯示通知後清除）/ When item prices were repriced (cleared once shown)')
+    )
+    
     class Meta:
         verbose_name = _('購物車 / Shopping Cart')
         verbose_name_plural = _('購物車 / Shopping Carts')
@@ -52,6 +61,15 @@ class Cart(models.Model):
             models.Index(fields=['session_key']),
             models.Index(fields=['-updated_at']),
         ]
+        # One cart per guest session (user carts are already unique via OneToOneField)
+        # 每個訪客會話只能有一個購物車（使用者購物車已由 OneToOneField 保證唯一）
+        constraints = [
+            models.UniqueConstraint(
+                fields=['session_key'],
+                condition=Q(session_key__isnull=False),
+                name='cart_unique_session_key',
+            ),
+        ]
     
     def __str__(self):
         if self.user:
@@ -91,28 +109,142 @@ class Cart(models.Model):
         Merge session cart into user cart when user logs in.
         將訪客購物車合併到使用者購物車（登入時）
         
+        Runs a constant number of statements regardless of cart size: one
+        upsert per conflict target that sums quantities into this cart, then
+        deletion of the guest cart.
+        
         Args:
             session_cart: Guest cart to merge from
         """
-        for session_item in session_cart.items.all():
-            # Check if item already exists in user cart
-            # 檢查商品是否已存在於使用者購物車
-            existing_item = self.items.filter(
-                product=session_item.product,
-                variant=session_item.variant
-            ).first()
-            
-            if existing_item:
-                # Update quantity / 更新數量
-                existing_item.quantity += session_item.quantity
-                existing_item.save()
-            else:
-                # Move item to user cart / 將商品移至使用者購物車
-                session_item.cart = self
-                session_item.save()
+        CartItem.objects.merge_into(self, session_cart)
         
         # Delete session cart / 刪除訪客購物車
         session_cart.delete()
+    
+    @classmethod
+    def merge_guest_cart(cls, user, session_key):
+        """
+        Merge the guest cart for a session key into the user's cart.
+        將指定會話的訪客購物車合併至使用者購物車
+        
+        The guest cart row is locked first, so concurrent logins from the same
+        browser merge it exactly once.
+        
+        Args:
+            user: Authenticated user
+            session_key (str): Session key the guest cart was created under
+        
+        Returns:
+            Cart: User cart, or None if there was no guest cart to merge
+        """
+        with transaction.atomic():
+            session_cart = (
+                cls.objects.select_for_update()
+                .filter(session_key=session_key, user__isnull=True)
+                .first()
+            )
+            if session_cart is None:
+                return None
+            
+            user_cart, created = cls.objects.get_or_create(user=user)
+            user_cart.merge_with_session_cart(session_cart)
+            return user_cart
+
+
+class CartItemManager(models.Manager):
+    """
+    Manager for cart items with single-statement, race-free writes.
+    購物車商品管理器（單一語句、無競態的寫入）
+    """
+    
+    def add_quantity(self, cart, product, variant, quantity, limit=None):
+        """
+        Insert a cart line or increase its quantity in one upsert statement.
+        以單一 upsert 語句新增購物車商品或累加數量
+        
+        The increment only applies while the new quantity stays within the
+        current stock (and limit, if given), so concurrent requests can never
+        push a line past it.
+        
+        Args:
+            cart: Cart to add to
+            product: Product being added
+            variant: ProductVariant or None
+            quantity (int): Quantity to add
+            limit (int): Optional per-line ceiling, e.g. 1 for flash-sale products
+        
+        Returns:
+            tuple: (item_id, new_quantity), or None if a ceiling was hit
+        """
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        
+        if variant is not None:
+            stock_table, stock_id = qn(ProductVariant._meta.db_table), variant.pk
+            conflict_target = '(cart_id, product_id, variant_id) WHERE variant_id IS NOT NULL'
+        else:
+            stock_table, stock_id = qn(Product._meta.db_table), product.pk
+            conflict_target = '(cart_id, product_id) WHERE variant_id IS NULL'
+        
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        price = connection.ops.adapt_decimalfield_value(
+            CartItem.get_current_price(product, variant), 10, 2
+        )
+        
+        sql = (
+            f'INSERT INTO {table} '
+            f'(cart_id, product_id, variant_id, quantity, price_at_addition, created_at, updated_at) '
+            f'VALUES (%s, %s, %s, %s, %s, %s, %s) '
+            f'ON CONFLICT {conflict_target} DO UPDATE SET '
+            f'quantity = {table}.quantity + excluded.quantity, updated_at = excluded.updated_at '
+            f'WHERE {table}.quantity + excluded.quantity <= '
+            f'(SELECT stock FROM {stock_table} WHERE id = %s) '
+        )
+        params = [
+            cart.pk, product.pk, variant.pk if variant is not None else None,
+            quantity, price, now, now, stock_id,
+        ]
+        if limit is not None:
+            sql += f'AND {table}.quantity + excluded.quantity <= %s '
+            params.append(limit)
+        sql += 'RETURNING id, quantity'
+        
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        return tuple(row) if row else None
+    
+    def merge_into(self, target_cart, source_cart):
+        """
+        Move every line of source_cart into target_cart, summing quantities.
+        將來源購物車的所有商品合併至目標購物車（數量相加）
+        
+        Uses one INSERT ... SELECT ... ON CONFLICT statement per partial
+        unique constraint; the source lines are left for the caller to delete.
+        
+        Args:
+            target_cart: Cart receiving the lines
+            source_cart: Cart whose lines are copied
+        """
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        
+        conflict_targets = [
+            ('variant_id IS NOT NULL', '(cart_id, product_id, variant_id) WHERE variant_id IS NOT NULL'),
+            ('variant_id IS NULL', '(cart_id, product_id) WHERE variant_id IS NULL'),
+        ]
+        with connection.cursor() as cursor:
+            for condition, conflict_target in conflict_targets:
+                cursor.execute(
+                    f'INSERT INTO {table} '
+                    f'(cart_id, product_id, variant_id, quantity, price_at_addition, created_at, updated_at) '
+                    f'SELECT %s, product_id, variant_id, quantity, price_at_addition, created_at, updated_at '
+                    f'FROM {table} WHERE cart_id = %s AND {condition} '
+                    f'ON CONFLICT {conflict_target} DO UPDATE SET '
+                    f'quantity = {table}.quantity + excluded.quantity, updated_at = excluded.updated_at',
+                    [target_cart.pk, source_cart.pk]
+                )
 
 
 class CartItem(models.Model):
@@ -168,6 +300,8 @@ class CartItem(models.Model):
         auto_now=True
     )
     
+    objects = CartItemManager()
+    
     class Meta:
         verbose_name = _('購物車商品 / Cart Item')
         verbose_name_plural = _('購物車商品 / Cart Items')
@@ -176,9 +310,22 @@ class CartItem(models.Model):
             models.Index(fields=['cart', 'product']),
             models.Index(fields=['-created_at']),
         ]
-        # Ensure unique product/variant combination per cart
-        # 確保每個購物車中產品/規格組合的唯一性
-        unique_together = [['cart', 'product', 'variant']]
+        # Ensure unique product/variant combination per cart. NULL variants are
+        # distinct in a plain unique index, so lines without a variant need their
+        # own partial constraint; both serve as ON CONFLICT targets.
+        # 確保每個購物車中產品/規格組合的唯一性（無規格商品使用部分唯一索引）
+        constraints = [
+            models.UniqueConstraint(
+                fields=['cart', 'product', 'variant'],
+                condition=Q(variant__isnull=False),
+                name='cart_item_unique_variant',
+            ),
+            models.UniqueConstraint(
+                fields=['cart', 'product'],
+                condition=Q(variant__isnull=True),
+                name='cart_item_unique_product',
+            ),
+        ]
     
     def __str__(self):
         if self.variant:
@@ -192,20 +339,30 @@ class CartItem(models.Model):
         """
         # Set price if not already set / 如果尚未設定價格則自動設定
         if not self.price_at_addition:
-            if self.variant and hasattr(self.variant, 'final_price') and self.variant.final_price:
-                self.price_at_addition = self.variant.final_price
-            elif self.product:
-                # Use sale price if available, otherwise regular price
-                # 如有特價則使用特價，否則使用原價
-                if self.product.sale_price:
-                    self.price_at_addition = self.product.sale_price
-                elif self.product.price:
-                    self.price_at_addition = self.product.price
-                else:
-                    # Fallback to 0 if no price is available
-                    self.price_at_addition = 0
+            self.price_at_addition = self.get_current_price(self.product, self.variant)
         super().save(*args, **kwargs)
     
+    @staticmethod
+    def get_current_price(product, variant=None):
+        """
+        Get the current catalog price for a product/variant.
+        取得產品/規格目前的目錄價格
+        
+        Returns:
+            Decimal: Variant final price, else sale price, else regular price, else 0
+        """
+        if variant and hasattr(variant, 'final_price') and variant.final_price:
+            return variant.final_price
+        if product:
+            # Use sale price if available, otherwise regular price
+            # 如有特價則使用特價，否則使用原價
+            if product.sale_price:
+                return product.sale_price
+            if product.price:
+                return product.price
+        # Fallback to 0 if no price is available
+        return 0
+    
     def get_price(self):
         """
         Get current price (use stored price for consistency).
@@ -0,0 +1,122 @@
+"""
+Set-based repricing of cart items when catalog prices change.
+購物車商品價格批次重新計算
+
+Each pass runs one UPDATE ... FROM per line kind (with and without a
+variant). Only lines whose stored price differs from the current catalog
+price are touched. Carts that changed get Cart.prices_changed_at stamped so
+the cart page can tell the customer.
+"""
+
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from products.models import Product, ProductVariant
+from .models import Cart, CartItem
+
+DEFAULT_CHUNK_SIZE = 5000
+
+
+def _price_expressions():
+    """
+    SQL expressions mirroring CartItem.get_current_price: the variant final
+    price when non-zero, else the sale price when non-zero, else the price.
+    """
+    base = 'CASE WHEN p.sale_price IS NOT NULL AND p.sale_price <> 0 THEN p.sale_price ELSE p.price END'
+    variant = f'CASE WHEN ({base}) + v.price_difference <> 0 THEN ({base}) + v.price_difference ELSE {base} END'
+    return base, variant
+
+
+def reprice_cart_items(product_ids=None, min_id=None, max_id=None, using=None):
+    """
+    Reprice cart items to the current catalog price.
+    將購物車商品更新為目前目錄價格
+
+    Args:
+        product_ids: Limit to lines for these products (None for all)
+        min_id: Exclusive lower bound on CartItem.id (None for unbounded)
+        max_id: Inclusive upper bound on CartItem.id (None for unbounded)
+        using: Database alias (defaults to the router's write database)
+
+    Returns:
+        tuple: (items_updated, carts_flagged)
+    """
+    if product_ids is not None:
+        product_ids = list(product_ids)
+        if not product_ids:
+            return 0, 0
+
+    using = using or router.db_for_write(CartItem)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    item_table = qn(CartItem._meta.db_table)
+    product_table = qn(Product._meta.db_table)
+    variant_table = qn(ProductVariant._meta.db_table)
+    base_price, variant_price = _price_expressions()
+
+    scope = []
+    params = []
+    if product_ids is not None:
+        scope.append(f'{item_table}.product_id IN ({", ".join(["%s"] * len(product_ids))})')
+        params.extend(product_ids)
+    if min_id is not None:
+        scope.append(f'{item_table}.id > %s')
+        params.append(min_id)
+    if max_id is not None:
+        scope.append(f'{item_table}.id <= %s')
+        params.append(max_id)
+    scope_sql = ''.join(f' AND {clause}' for clause in scope)
+
+    statements = [
+        # Lines with a variant / 有規格的商品
+        f'UPDATE {item_table} SET price_at_addition = {variant_price}, updated_at = %s '
+        f'FROM {product_table} p, {variant_table} v '
+        f'WHERE {item_table}.product_id = p.id AND {item_table}.variant_id = v.id '
+        f'AND {item_table}.price_at_addition <> {variant_price}{scope_sql} '
+        f'RETURNING {item_table}.cart_id',
+        # Lines without a variant / 無規格的商品
+        f'UPDATE {item_table} SET price_at_addition = {base_price}, updated_at = %s '
+        f'FROM {product_table} p '
+        f'WHERE {item_table}.product_id = p.id AND {item_table}.variant_id IS NULL '
+        f'AND {item_table}.price_at_addition <> {base_price}{scope_sql} '
+        f'RETURNING {item_table}.cart_id',
+    ]
+
+    now = timezone.now()
+    cart_ids = set()
+    updated = 0
+    with transaction.atomic(using=using):
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql, [connection.ops.adapt_datetimefield_value(now)] + params)
+                rows = cursor.fetchall()
+                updated += len(rows)
+                cart_ids.update(row[0] for row in rows)
+        if cart_ids:
+            Cart.objects.using(using).filter(pk__in=cart_ids).update(prices_changed_at=now)
+
+    return updated, len(cart_ids)
+
+
+def reprice_all_cart_items(chunk_size=DEFAULT_CHUNK_SIZE, using=None):
+    """
+    Reprice the whole cart item table in id-range chunks.
+    以 ID 區間分批重新計算所有購物車商品價格
+
+    Each chunk commits on its own so locks are held only briefly.
+
+    Yields:
+        tuple: (max_id, items_updated, carts_flagged) per chunk
+    """
+    using = using or router.db_for_write(CartItem)
+    items = CartItem.objects.using(using).order_by('id')
+    last_id = 0
+    while True:
+        boundary = items.filter(id__gt=last_id).values_list('id', flat=True)[chunk_size - 1:chunk_size]
+        boundary = list(boundary)
+        max_id = boundary[0] if boundary else None
+        updated, flagged = reprice_cart_items(min_id=last_id, max_id=max_id, using=using)
+        yield (max_id, updated, flagged)
+        if max_id is None:
+            break
+        last_id = max_id
@@ -0,0 +1,79 @@
+"""
+Signal handlers for the cart app.
+"""
+
+from decimal import Decimal
+
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+
+from products.models import Product, ProductVariant
+from .models import Cart
+from .repricing import reprice_cart_items
+
+# Catalog fields that feed CartItem.get_current_price
+PRICE_FIELDS = {
+    Product: ('price', 'sale_price'),
+    ProductVariant: ('price_difference',),
+}
+
+# Session data key holding the session key a guest cart was created under.
+# login() rotates the session key but keeps session data, so this is how the
+# guest cart is found again after authentication.
+GUEST_CART_SESSION_KEY = 'cart_session_key'
+
+
+@receiver(user_logged_in)
+def merge_guest_cart_on_login(sender, request, user, **kwargs):
+    """
+    Merge the visitor's guest cart into their user cart on login.
+    登入時將訪客購物車合併到使用者購物車
+    """
+    if request is None or not hasattr(request, 'session'):
+        return
+    
+    session_key = request.session.pop(GUEST_CART_SESSION_KEY, None)
+    if session_key:
+        Cart.merge_guest_cart(user, session_key)
+
+
+def _normalize_prices(values):
+    return tuple(Decimal(str(value)) if value is not None else None for value in values)
+
+
+@receiver(pre_save, sender=Product)
+@receiver(pre_save, sender=ProductVariant)
+def remember_catalog_prices(sender, instance, update_fields=None, **kwargs):
+    """
+    Load the stored prices before a product/variant save so a change can be detected.
+    儲存前記錄原價格以偵測價格變動
+    """
+    fields = PRICE_FIELDS[sender]
+    instance._previous_prices = None
+    if instance.pk is None:
+        return
+    if update_fields is not None and not set(fields) & set(update_fields):
+        return
+    instance._previous_prices = (
+        sender.objects.filter(pk=instance.pk).values_list(*fields).first()
+    )
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductVariant)
+def reprice_carts_on_price_change(sender, instance, created, **kwargs):
+    """
+    Reprice affected cart items after the saving transaction commits.
+    價格變動提交後重新計算相關購物車商品價格
+    """
+    previous = getattr(instance, '_previous_prices', None)
+    if created or previous is None:
+        return
+    current = tuple(getattr(instance, field) for field in PRICE_FIELDS[sender])
+    if _normalize_prices(previous) == _normalize_prices(current):
+        return
+    
+    product_id = instance.pk if sender is Product else instance.product_id
+    transaction.on_commit(lambda: reprice_cart_items(product_ids=[product_id]))
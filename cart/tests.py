@@ -1,3 +1,251 @@
+"""
+Tests for shopping cart models and views.
+"""
+
+import json
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from products.models import Category, Product, ProductVariant
+from .models import Cart, CartItem
+from .repricing import reprice_all_cart_items, reprice_cart_items
+
+
+class CartTestMixin:
+    """Shared fixtures for cart tests."""
+
+    def create_product(self, sku='ANGUS-001', stock=10, price='1200.00', **kwargs):
+        category, _ = Category.objects.get_or_create(name='牛肉', slug='beef')
+        return Product.objects.create(
+            name=kwargs.pop('name', '安格斯牛排'),
+            slug=sku.lower(),
+            sku=sku,
+            category=category,
+            description='測試商品',
+            price=Decimal(price),
+            stock=stock,
+            status='active',
+            **kwargs
+        )
+
+
+class CartItemUpsertTest(CartTestMixin, TestCase):
+    """Test single-statement cart item upserts."""
+
+    def setUp(self):
+        self.product = self.create_product(stock=5)
+        self.cart = Cart.objects.create(session_key='guest-session')
+
+    def test_add_quantity_inserts_new_line(self):
+        item_id, quantity = CartItem.objects.add_quantity(self.cart, self.product, None, 2)
+        item = CartItem.objects.get(id=item_id)
+        self.assertEqual(quantity, 2)
+        self.assertEqual(item.price_at_addition, Decimal('1200.00'))
+
+    def test_add_quantity_increments_existing_line(self):
+        first_id, _ = CartItem.objects.add_quantity(self.cart, self.product, None, 2)
+        second_id, quantity = CartItem.objects.add_quantity(self.cart, self.product, None, 3)
+        self.assertEqual(first_id, second_id)
+        self.assertEqual(quantity, 5)
+        self.assertEqual(self.cart.items.count(), 1)
+
+    def test_add_quantity_enforces_stock_ceiling(self):
+        CartItem.objects.add_quantity(self.cart, self.product, None, 4)
+        self.assertIsNone(CartItem.objects.add_quantity(self.cart, self.product, None, 2))
+        self.assertEqual(self.cart.items.get().quantity, 4)
+
+    def test_variant_lines_are_separate(self):
+        variant = ProductVariant.objects.create(
+            product=self.product, name='500g', sku='ANGUS-001-500', stock=3
+        )
+        CartItem.objects.add_quantity(self.cart, self.product, None, 1)
+        item_id, quantity = CartItem.objects.add_quantity(self.cart, self.product, variant, 3)
+        self.assertEqual(quantity, 3)
+        self.assertEqual(self.cart.items.count(), 2)
+        self.assertIsNone(CartItem.objects.add_quantity(self.cart, self.product, variant, 1))
+
+    def test_duplicate_lines_without_variant_rejected(self):
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            CartItem.objects.create(cart=self.cart, product=self.product, quantity=1)
+
+    def test_duplicate_session_carts_rejected(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Cart.objects.create(session_key='guest-session')
+
+
+class AddToCartViewTest(CartTestMixin, TestCase):
+    """Test the add-to-cart AJAX endpoint."""
+
+    def setUp(self):
+        self.product = self.create_product(stock=3)
+        self.url = reverse('cart:add_to_cart')
+
+    def post(self, quantity):
+        return self.client.post(
+            self.url,
+            data=json.dumps({'product_id': self.product.id, 'quantity': quantity}),
+            content_type='application/json'
+        )
+
+    def test_repeated_adds_accumulate(self):
+        self.post(1)
+        response = self.post(2)
+        data = response.json()
+        self.assertTrue(data['success'])
+        self.assertEqual(data['cart_count'], 3)
+        self.assertEqual(Cart.objects.count(), 1)
+
+    def test_add_beyond_stock_rejected(self):
+        self.post(2)
+        response = self.post(2)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(CartItem.objects.get().quantity, 2)
+
+    def test_non_positive_quantity_rejected(self):
+        response = self.post(0)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CartItem.objects.exists())
+
+
+class CartMergeTest(CartTestMixin, TestCase):
+    """Test set-based guest-to-user cart merging."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='buyer@example.com', password='testpass123', is_active=True
+        )
+        self.steak = self.create_product(sku='ANGUS-001', stock=20)
+        self.ribs = self.create_product(sku='ANGUS-002', stock=20, name='安格斯牛小排')
+
+    def test_merge_sums_quantities_and_deletes_guest_cart(self):
+        user_cart = Cart.objects.create(user=self.user)
+        guest_cart = Cart.objects.create(session_key='guest-session')
+        CartItem.objects.add_quantity(user_cart, self.steak, None, 1)
+        CartItem.objects.add_quantity(guest_cart, self.steak, None, 2)
+        CartItem.objects.add_quantity(guest_cart, self.ribs, None, 4)
+
+        with self.assertNumQueries(4):
+            user_cart.merge_with_session_cart(guest_cart)
+
+        quantities = dict(user_cart.items.values_list('product__sku', 'quantity'))
+        self.assertEqual(quantities, {'ANGUS-001': 3, 'ANGUS-002': 4})
+        self.assertFalse(Cart.objects.filter(session_key='guest-session').exists())
+
+    def test_merge_guest_cart_is_noop_once_merged(self):
+        guest_cart = Cart.objects.create(session_key='guest-session')
+        CartItem.objects.add_quantity(guest_cart, self.steak, None, 2)
+
+        self.assertIsNotNone(Cart.merge_guest_cart(self.user, 'guest-session'))
+        self.assertIsNone(Cart.merge_guest_cart(self.user, 'guest-session'))
+        self.assertEqual(self.user.cart.items.get().quantity, 2)
+
+    def test_guest_cart_merged_on_login(self):
+        self.client.post(
+            reverse('cart:add_to_cart'),
+            data=json.dumps({'product_id': self.steak.id, 'quantity': 2}),
+            content_type='application/json'
+        )
+        self.client.force_login(self.user)
+
+        self.assertEqual(Cart.objects.count(), 1)
+        self.assertEqual(Cart.objects.get(user=self.user).items.get().quantity, 2)
+
+
+class PurgeCartsCommandTest(CartTestMixin, TestCase):
+    """Test the purge_carts management command."""
+
+    def setUp(self):
+        self.product = self.create_product()
+        old = timezone.now() - timedelta(days=45)
+        self.stale = Cart.objects.create(session_key='stale-session')
+        self.fresh = Cart.objects.create(session_key='fresh-session')
+        self.touched = Cart.objects.create(session_key='touched-session')
+        CartItem.objects.add_quantity(self.stale, self.product, None, 1)
+        CartItem.objects.add_quantity(self.touched, self.product, None, 1)
+        Cart.objects.filter(pk__in=[self.stale.pk, self.touched.pk]).update(updated_at=old)
+        CartItem.objects.filter(cart=self.stale).update(updated_at=old)
+        Session.objects.create(session_key='expired', session_data='', expire_date=old)
+        Session.objects.create(
+            session_key='live', session_data='', expire_date=timezone.now() + timedelta(days=1)
+        )
+
+    def test_purges_only_abandoned_carts_and_expired_sessions(self):
+        out = StringIO()
+        call_command('purge_carts', '--days=30', '--batch-size=1', stdout=out)
+
+        self.assertEqual(
+            set(Cart.objects.values_list('session_key', flat=True)),
+            {'fresh-session', 'touched-session'}
+        )
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['live'])
+        self.assertIn('Deleted 1 carts', out.getvalue())
+        self.assertIn('rows/s', out.getvalue())
+
+    def test_dry_run_deletes_nothing(self):
+        call_command('purge_carts', '--dry-run', stdout=StringIO())
+        self.assertEqual(Cart.objects.count(), 3)
+        self.assertEqual(Session.objects.count(), 2)
+
+
+class CartRepricingTest(CartTestMixin, TestCase):
+    """Test set-based cart repricing."""
+
+    def setUp(self):
+        self.product = self.create_product(price='1000.00')
+        self.variant = ProductVariant.objects.create(
+            product=self.product, name='1kg', sku='ANGUS-001-1KG', price_difference=Decimal('500.00'), stock=5
+        )
+        self.cart = Cart.objects.create(session_key='guest-session')
+        self.other_cart = Cart.objects.create(session_key='other-session')
+        CartItem.objects.add_quantity(self.cart, self.product, None, 1)
+        CartItem.objects.add_quantity(self.cart, self.product, self.variant, 1)
+
+    def prices(self):
+        return dict(self.cart.items.values_list('variant_id', 'price_at_addition'))
+
+    def test_reprice_updates_changed_lines_and_flags_cart(self):
+        Product.objects.filter(pk=self.product.pk).update(sale_price=Decimal('800.00'))
+
+        updated, flagged = reprice_cart_items(product_ids=[self.product.pk])
+
+        self.assertEqual((updated, flagged), (2, 1))
+        self.assertEqual(self.prices(), {None: Decimal('800.00'), self.variant.pk: Decimal('1300.00')})
+        self.cart.refresh_from_db()
+        self.other_cart.refresh_from_db()
+        self.assertIsNotNone(self.cart.prices_changed_at)
+        self.assertIsNone(self.other_cart.prices_changed_at)
+
+    def test_reprice_skips_unchanged_lines(self):
+        self.assertEqual(reprice_cart_items(), (0, 0))
+
+    def test_reprice_all_in_chunks(self):
+        Product.objects.filter(pk=self.product.pk).update(price=Decimal('900.00'))
+        chunks = list(reprice_all_cart_items(chunk_size=1))
+        self.assertEqual(sum(chunk[1] for chunk in chunks), 2)
+        self.assertEqual(self.prices(), {None: Decimal('900.00'), self.variant.pk: Decimal('1400.00')})
+
+    def test_price_change_on_save_triggers_reprice(self):
+        self.product.price = Decimal('1100.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.assertEqual(self.prices()[None], Decimal('1100.00'))
 
-# Create your tests here.
+    def test_cart_page_shows_notice_once(self):
+        session = self.client.session
+        session.save()
+        Cart.objects.filter(pk=self.cart.pk).update(
+            session_key=session.session_key, prices_changed_at=timezone.now()
+        )
+        response = self.client.get(reverse('cart:cart'))
+        self.assertEqual(len(list(response.context['messages'])), 1)
+        self.cart.refresh_from_db()
+        self.assertIsNone(self.cart.prices_changed_at)
@@ -2,28 +2,23 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.utils.decorators import method_decorator
 from django.utils.translation import gettext as _
 from django.db.models import Sum, F
 from products.models import Product, ProductVariant
+from products.flash_sale import ADMITTED, LIMIT_REACHED, WAITING, claim_token, get_running_sale
+from orders.shipping import quote_cart
 from .models import Cart, CartItem
+from .signals import GUEST_CART_SESSION_KEY
 import json
 
 
 def get_or_create_cart(request):
     """Get or create cart for user or guest session"""
     if request.user.is_authenticated:
-        # For authenticated users, try to get existing cart, handle duplicates
-        try:
-            cart = Cart.objects.get(user=request.user)
-        except Cart.DoesNotExist:
-            cart = Cart.objects.create(user=request.user)
-        except Cart.MultipleObjectsReturned:
-            # Handle duplicate carts - keep the first one, delete others
-            carts = Cart.objects.filter(user=request.user).order_by('created_at')
-            cart = carts.first()
-            # Delete duplicates
-            carts.exclude(id=cart.id).delete()
+        # Cart.user is unique, so concurrent creates resolve to the same row
+        cart, created = Cart.objects.get_or_create(user=request.user)
     else:
         # Use session for guest users
         if not request.session.session_key:
@@ -31,20 +26,12 @@ def get_or_create_cart(request):
         
         session_key = request.session.session_key
         
-        try:
-            cart = Cart.objects.get(session_key=session_key)
-        except Cart.DoesNotExist:
-            cart = Cart.objects.create(session_key=session_key)
-        except Cart.MultipleObjectsReturned:
-            # Handle duplicate session carts
-            carts = Cart.objects.filter(session_key=session_key).order_by('created_at')
-            cart = carts.first()
-            # Merge items from duplicate carts and delete duplicates
-            for duplicate_cart in carts.exclude(id=cart.id):
-                for item in duplicate_cart.items.all():
-                    item.cart = cart
-                    item.save()
-                duplicate_cart.delete()
+        # session_key carries a partial unique constraint, so get_or_create is race-free
+        cart, created = Cart.objects.get_or_create(session_key=session_key)
+        
+        # Remember the guest cart so it can be merged after login rotates the key
+        if request.session.get(GUEST_CART_SESSION_KEY) != session_key:
+            request.session[GUEST_CART_SESSION_KEY] = session_key
     
     return cart
 
@@ -72,6 +59,12 @@ def add_to_cart(request):
                 'message': _('商品ID不能為空')
             }, status=400)
         
+        if quantity < 1:
+            return JsonResponse({
+                'success': False,
+                'message': _('數量必須大於 0')
+            }, status=400)
+        
         # Validate product
         try:
             product = get_object_or_404(Product, id=product_id, status='active')
@@ -85,7 +78,7 @@ def add_to_cart(request):
         variant = None
         if variant_id:
             variant = get_object_or_404(ProductVariant, id=variant_id, product=product)
-            if not variant.is_available:
+            if not (variant.is_active and variant.is_in_stock):
                 return JsonResponse({
                     'success': False,
                     'message': _('此規格目前缺貨')
@@ -102,24 +95,28 @@ def add_to_cart(request):
         # Get or create cart
         cart = get_or_create_cart(request)
         
-        # Get or create cart item
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            variant=variant,
-            defaults={'quantity': quantity}
-        )
+        # Flash-sale products need a purchase token before they reach the cart
+        sale = get_running_sale(product.id)
+        if sale:
+            response = admit_flash_sale_buyer(request, sale, cart, quantity)
+            if response:
+                return response
         
-        if not created:
-            # Update existing cart item
-            new_quantity = cart_item.quantity + quantity
-            if new_quantity > available_stock:
+        # Insert or increment the cart item in a single upsert; the database
+        # rejects increments that would exceed the current stock, or one unit
+        # for flash-sale products
+        row = CartItem.objects.add_quantity(cart, product, variant, quantity, limit=1 if sale else None)
+        if row is None:
+            if sale:
                 return JsonResponse({
                     'success': False,
-                    'message': _('購物車數量已達庫存上限')
+                    'message': _('限時搶購商品每人限購 1 件')
                 }, status=400)
-            cart_item.quantity = new_quantity
-            cart_item.save()
+            return JsonResponse({
+                'success': False,
+                'message': _('購物車數量已達庫存上限')
+            }, status=400)
+        item_id, item_quantity = row
         
         # Calculate cart totals
         cart_total = cart.get_total()
@@ -130,7 +127,8 @@ def add_to_cart(request):
             'message': _('已加入購物車'),
             'cart_count': cart_count,
             'cart_total': float(cart_total),
-            'item_id': cart_item.id
+            'item_id': item_id,
+            'item_quantity': item_quantity
         })
         
     except Product.DoesNotExist:
@@ -151,6 +149,46 @@ def add_to_cart(request):
         }, status=400)
 
 
+def admit_flash_sale_buyer(request, sale, cart, quantity):
+    """
+    Run flash-sale admission for add_to_cart.
+    Returns an error JsonResponse, or None if the buyer holds a token.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({
+            'success': False,
+            'message': _('限時搶購商品請先登入')
+        }, status=401)
+    
+    if quantity > 1 or cart.items.filter(product_id=sale.product_id).exists():
+        return JsonResponse({
+            'success': False,
+            'message': _('限時搶購商品每人限購 1 件')
+        }, status=400)
+    
+    admission = claim_token(sale, request.user)
+    if admission.status == ADMITTED:
+        return None
+    if admission.status == WAITING:
+        response = JsonResponse({
+            'success': False,
+            'waiting': True,
+            'retry_after': admission.retry_after,
+            'message': _('排隊中，請稍後再試')
+        }, status=429)
+        response['Retry-After'] = str(admission.retry_after)
+        return response
+    if admission.status == LIMIT_REACHED:
+        return JsonResponse({
+            'success': False,
+            'message': _('限時搶購商品每人限購 1 件')
+        }, status=400)
+    return JsonResponse({
+        'success': False,
+        'message': _('限時搶購商品已售完')
+    }, status=400)
+
+
 @require_POST
 def update_cart_item(request, item_id):
     """Update cart item quantity"""
@@ -167,6 +205,12 @@ def update_cart_item(request, item_id):
         cart = get_or_create_cart(request)
         cart_item = get_object_or_404(CartItem, id=item_id, cart=cart)
         
+        if quantity > 1 and get_running_sale(cart_item.product_id):
+            return JsonResponse({
+                'success': False,
+                'message': _('限時搶購商品每人限購 1 件')
+            }, status=400)
+        
         # Check stock
         available_stock = cart_item.variant.stock if cart_item.variant else cart_item.product.stock
         if quantity > available_stock:
@@ -229,25 +273,29 @@ def remove_from_cart(request, item_id):
 def cart_view(request):
     """Display shopping cart"""
     cart = get_or_create_cart(request)
-    cart_items = cart.items.select_related('product', 'variant').order_by('-created_at')
+    cart_items = list(cart.items.select_related('product', 'variant').order_by('-created_at'))
     
-    # Calculate totals
-    subtotal = cart.get_subtotal()
-    total = cart.get_total()
-    item_count = cart_items.aggregate(total=Sum('quantity'))['total'] or 0
+    # Tell the customer once when catalog price changes were applied to the cart
+    if cart.prices_changed_at:
+        messages.warning(request, _('部分商品價格已變動，購物車已更新為最新價格 / Some prices have changed and your cart has been updated'))
+        Cart.objects.filter(pk=cart.pk).update(prices_changed_at=None)
     
-    # Shipping fee calculation (example: free shipping over NT$1000)
-    shipping_fee = 0 if subtotal >= 1000 else 60
+    # Calculate totals; the cart shows the default (home delivery) rate
+    subtotal, quotes = quote_cart(cart_items)
+    item_count = sum(item.quantity for item in cart_items)
+    quote = quotes.get('home_delivery')
+    shipping_fee = quote.fee if quote and quote.fee is not None else 0
     
     context = {
         'cart': cart,
         'cart_items': cart_items,
         'subtotal': subtotal,
         'shipping_fee': shipping_fee,
-        'total': total + shipping_fee,
+        'shipping_quotes': quotes,
+        'total': subtotal + shipping_fee,
         'item_count': item_count,
-        'free_shipping_threshold': 1000,
-        'shipping_remaining': max(0, 1000 - subtotal) if subtotal < 1000 else 0,
+        'free_shipping_threshold': (quote.free_shipping_threshold if quote else None) or 0,
+        'shipping_remaining': quote.remaining if quote else 0,
     }
     return render(request, 'cart/cart.html', context)
 
@@ -11,6 +11,8 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "eshop.settings")
+# Use production settings if RAILWAY_ENVIRONMENT is set, otherwise development
+default_settings = "eshop.settings.production" if os.environ.get('RAILWAY_ENVIRONMENT') else "eshop.settings.development"
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", default_settings)
 
 application = get_asgi_application()
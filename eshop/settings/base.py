@@ -144,6 +144,58 @@ ECPAY_HASH_IV = config('ECPAY_HASH_IV', default='')
 ECPAY_SANDBOX = config('ECPAY_SANDBOX', default=True, cast=bool)
 SITE_URL = config('SITE_URL', default='http://localhost:8000')
 
+# ECPay server-to-server calls - pooled connections, timeouts, retries and circuit breaker
+ECPAY_API_HOST = config('ECPAY_API_HOST', default='')  # Overrides the sandbox/production host, e.g. http://127.0.0.1:8001 for ecpay_simulator
+ECPAY_CONNECT_TIMEOUT = config('ECPAY_CONNECT_TIMEOUT', default=3.05, cast=float)
+ECPAY_READ_TIMEOUT = config('ECPAY_READ_TIMEOUT', default=20, cast=float)
+ECPAY_MAX_RETRIES = config('ECPAY_MAX_RETRIES', default=2, cast=int)
+ECPAY_RETRY_BACKOFF = config('ECPAY_RETRY_BACKOFF', default=0.5, cast=float)
+ECPAY_CIRCUIT_FAILURES = config('ECPAY_CIRCUIT_FAILURES', default=5, cast=int)
+ECPAY_CIRCUIT_RESET_SECONDS = config('ECPAY_CIRCUIT_RESET_SECONDS', default=30, cast=int)
+ECPAY_POOL_SIZE = config('ECPAY_POOL_SIZE', default=10, cast=int)
+
+# ATM/CVS/BARCODE payment codes - validity asked of ECPay, and how long after it unpaid payments expire
+ECPAY_ATM_EXPIRE_DAYS = config('ECPAY_ATM_EXPIRE_DAYS', default=3, cast=int)  # 1-60
+ECPAY_CVS_EXPIRE_MINUTES = config('ECPAY_CVS_EXPIRE_MINUTES', default=10080, cast=int)
+ECPAY_BARCODE_EXPIRE_DAYS = config('ECPAY_BARCODE_EXPIRE_DAYS', default=7, cast=int)  # 1-30
+PAYMENT_EXPIRY_GRACE_MINUTES = config('PAYMENT_EXPIRY_GRACE_MINUTES', default=30, cast=int)  # Late bank notifications
+
+# Payment Logs - request/response/info rows are buffered and written in bulk (retention: ARCHIVE_RETENTION_MONTHS)
+PAYMENT_LOG_BUFFER_SIZE = config('PAYMENT_LOG_BUFFER_SIZE', default=50, cast=int)
+PAYMENT_LOG_FLUSH_SECONDS = config('PAYMENT_LOG_FLUSH_SECONDS', default=5, cast=float)
+
+# Stock Reservation - how long checkout holds stock while awaiting payment (ATM/CVS/BARCODE: until the payment deadline)
+STOCK_RESERVATION_TTL_MINUTES = config('STOCK_RESERVATION_TTL_MINUTES', default=30, cast=int)
+
+# Idempotency Keys - how long checkout/payment retries replay the first response
+IDEMPOTENCY_KEY_TTL_HOURS = config('IDEMPOTENCY_KEY_TTL_HOURS', default=24, cast=int)
+
+# Order Numbers - sequence values each worker leases from the per-day counter
+ORDER_NUMBER_BLOCK_SIZE = config('ORDER_NUMBER_BLOCK_SIZE', default=20, cast=int)
+
+# Sales Rollups - orders are rolled up once their last change is this old
+SALES_ROLLUP_LAG_SECONDS = config('SALES_ROLLUP_LAG_SECONDS', default=120, cast=int)
+
+# Shipping Rates - how long a worker uses its compiled rate table before reloading
+SHIPPING_RATES_TTL_SECONDS = config('SHIPPING_RATES_TTL_SECONDS', default=300, cast=int)
+
+# Pickup Stores - how long a worker uses its store locator index before reloading
+PICKUP_STORE_INDEX_TTL_SECONDS = config('PICKUP_STORE_INDEX_TTL_SECONDS', default=600, cast=int)
+
+# Payment status events - server-sent events for the payment status page (held open under ASGI only)
+PAYMENT_EVENTS_TIMEOUT = config('PAYMENT_EVENTS_TIMEOUT', default=55, cast=int)  # Seconds a stream stays open
+PAYMENT_EVENTS_HEARTBEAT = config('PAYMENT_EVENTS_HEARTBEAT', default=15, cast=int)
+PAYMENT_EVENTS_POLL_SECONDS = config('PAYMENT_EVENTS_POLL_SECONDS', default=2, cast=float)  # Without PostgreSQL LISTEN
+PAYMENT_EVENTS_RETRY_MS = config('PAYMENT_EVENTS_RETRY_MS', default=15000, cast=int)  # Browser reconnect delay
+
+# Archiving - months kept live per model, overriding orders.archiving defaults
+ARCHIVE_RETENTION_MONTHS = {
+    'payments.PaymentLog': config('ARCHIVE_PAYMENT_LOG_MONTHS', default=12, cast=int),
+    'authentication.LoginAttempt': config('ARCHIVE_LOGIN_ATTEMPT_MONTHS', default=6, cast=int),
+    'orders.Order': config('ARCHIVE_ORDER_MONTHS', default=36, cast=int),
+}
+ARCHIVE_EXPORT_DIR = config('ARCHIVE_EXPORT_DIR', default=str(BASE_DIR / 'archive'))  # Detached partitions as gzip files; empty to skip
+
 # REST Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
@@ -2,19 +2,24 @@
 Orders admin interface - English Version.
 Follows Django best practices and EShop coding standards.
 """
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.utils.translation import gettext_lazy as _
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.safestring import mark_safe
-from .models import Order, OrderItem, ShippingAddress
+from .models import (
+    DailySalesRollup, Order, OrderEvent, OrderItem, PickupStore, ShippingAddress, ShippingRate,
+    StockReservation,
+)
+from .reports import get_sales_dashboard
+from .state_machine import transition_orders
 
 
 class OrderItemInline(admin.TabularInline):
     """Inline admin for order items."""
     model = OrderItem
     extra = 0
-    readonly_fields = ('product', 'variant', 'quantity', 'price_at_purchase', 'subtotal_display')
+    readonly_fields = ('product', 'variant', 'product_name', 'variant_name', 'quantity', 'price_at_purchase', 'subtotal_display')
     can_delete = False
     verbose_name = "Order Item"
     verbose_name_plural = "Order Items"
@@ -25,6 +30,20 @@ class OrderItemInline(admin.TabularInline):
     subtotal_display.short_description = 'Subtotal'
 
 
+class OrderEventInline(admin.TabularInline):
+    """Read-only inline for the order's status history."""
+    model = OrderEvent
+    extra = 0
+    fields = ('created_at', 'field', 'from_value', 'to_value', 'actor', 'note')
+    readonly_fields = fields
+    can_delete = False
+    verbose_name = "Status Change"
+    verbose_name_plural = "Status History"
+    
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     """Admin interface for orders."""
@@ -63,7 +82,7 @@ class OrderAdmin(admin.ModelAdmin):
     )
     date_hierarchy = 'created_at'
     
-    inlines = [OrderItemInline]
+    inlines = [OrderItemInline, OrderEventInline]
     
     fieldsets = (
         ('Order Information', {
@@ -98,6 +117,9 @@ class OrderAdmin(admin.ModelAdmin):
                 'shipping_city',
                 'shipping_district',
                 'shipping_address',
+                'pickup_store_id',
+                'pickup_store_name',
+                'pickup_store_address',
             )
         }),
         ('Notes', {
@@ -245,7 +267,7 @@ class OrderAdmin(admin.ModelAdmin):
         
         for item in items:
             html += '<tr style="border-bottom: 1px solid #e5e7eb;">'
-            html += f'<td style="padding: 8px;">{item.product.name_en}</td>'
+            html += f'<td style="padding: 8px;">{item.product_name_en or item.product_name}</td>'
             html += f'<td style="padding: 8px; text-align: right;">× {item.quantity}</td>'
             html += f'<td style="padding: 8px; text-align: right;">NT$ {item.price_at_purchase:,}</td>'
             html += f'<td style="padding: 8px; text-align: right; font-weight: bold;">NT$ {item.get_subtotal():,}</td>'
@@ -256,40 +278,34 @@ class OrderAdmin(admin.ModelAdmin):
     items_summary.short_description = 'Order Details'
     
     # Bulk actions
+    def _transition(self, request, queryset, to_status, label):
+        """Apply a state-machine transition and report skipped orders."""
+        changed, skipped = transition_orders(
+            queryset, to_status, actor=request.user, note='Admin bulk action'
+        )
+        message = f'{changed} orders {label}'
+        if skipped:
+            message += f'; {skipped} skipped (status does not allow this change)'
+        self.message_user(request, message, messages.WARNING if skipped else messages.SUCCESS)
+    
     def mark_as_processing(self, request, queryset):
         """Set orders to processing status."""
-        updated = queryset.update(status='processing')
-        self.message_user(
-            request,
-            f'{updated} orders marked as processing'
-        )
+        self._transition(request, queryset, 'processing', 'marked as processing')
     mark_as_processing.short_description = 'Mark as Processing'
     
     def mark_as_shipped(self, request, queryset):
         """Set orders to shipped status."""
-        updated = queryset.update(status='shipped')
-        self.message_user(
-            request,
-            f'{updated} orders marked as shipped'
-        )
+        self._transition(request, queryset, 'shipped', 'marked as shipped')
     mark_as_shipped.short_description = 'Mark as Shipped'
     
     def mark_as_delivered(self, request, queryset):
         """Set orders to delivered status."""
-        updated = queryset.update(status='delivered')
-        self.message_user(
-            request,
-            f'{updated} orders marked as delivered'
-        )
+        self._transition(request, queryset, 'delivered', 'marked as delivered')
     mark_as_delivered.short_description = 'Mark as Delivered'
     
     def mark_as_cancelled(self, request, queryset):
         """Set orders to cancelled status."""
-        updated = queryset.update(status='cancelled')
-        self.message_user(
-            request,
-            f'{updated} orders cancelled'
-        )
+        self._transition(request, queryset, 'cancelled', 'cancelled')
     mark_as_cancelled.short_description = 'Cancel Orders'
 
 
@@ -413,4 +429,101 @@ class ShippingAddressAdmin(admin.ModelAdmin):
     def address_display(self, obj):
         """Display full Taiwan address."""
         return f"{obj.postal_code} {obj.city}{obj.district}{obj.address}"
-    address_display.short_description = 'Full Address'
\ No newline at end of file
+    address_display.short_description = 'Full Address'
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    """Admin interface for stock reservations."""
+    
+    list_display = (
+        'order_display',
+        'product',
+        'variant',
+        'quantity',
+        'status',
+        'expires_at',
+        'created_at'
+    )
+    list_filter = ('status', 'expires_at')
+    search_fields = ('order__order_number', 'product__name', 'product__sku')
+    readonly_fields = ('order', 'product', 'variant', 'quantity', 'status', 'expires_at', 'created_at', 'updated_at')
+    
+    def order_display(self, obj):
+        """Display order number."""
+        return f"#{obj.order.order_number}"
+    order_display.short_description = 'Order'
+
+
+@admin.register(DailySalesRollup)
+class DailySalesRollupAdmin(admin.ModelAdmin):
+    """Sales dashboard built from the daily rollups (run rollup_sales to refresh)."""
+    
+    change_list_template = 'admin/orders/dailysalesrollup/change_list.html'
+    list_display = (
+        'day',
+        'category',
+        'payment_method',
+        'shipping_method',
+        'order_count',
+        'quantity',
+        'revenue_display'
+    )
+    list_filter = ('payment_method', 'shipping_method', 'category')
+    date_hierarchy = 'day'
+    list_select_related = ('category',)
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def revenue_display(self, obj):
+        """Display revenue."""
+        return f'NT$ {obj.revenue:,}'
+    revenue_display.short_description = 'Revenue'
+    
+    def changelist_view(self, request, extra_context=None):
+        """Add chart data for the filtered rollup rows."""
+        response = super().changelist_view(request, extra_context=extra_context)
+        try:
+            changelist = response.context_data['cl']
+        except (AttributeError, KeyError):
+            # Redirect or error page
+            return response
+        response.context_data['dashboard'] = get_sales_dashboard(changelist.queryset)
+        return response
+
+
+@admin.register(ShippingRate)
+class ShippingRateAdmin(admin.ModelAdmin):
+    """Admin interface for shipping rate bands."""
+    
+    list_display = (
+        'shipping_method',
+        'max_weight',
+        'fee',
+        'free_shipping_threshold',
+        'is_active',
+        'updated_at'
+    )
+    list_editable = ('fee', 'free_shipping_threshold', 'is_active')
+    list_filter = ('shipping_method', 'is_active')
+
+
+@admin.register(PickupStore)
+class PickupStoreAdmin(admin.ModelAdmin):
+    """Admin interface for pickup stores (bulk updates via import_pickup_stores)."""
+    
+    list_display = (
+        'store_id',
+        'chain',
+        'name',
+        'city',
+        'district',
+        'address',
+        'is_active'
+    )
+    list_filter = ('chain', 'is_active', 'city')
+    search_fields = ('store_id', 'name', 'address')
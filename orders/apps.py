@@ -6,3 +6,6 @@ class OrdersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'orders'
     verbose_name = _('訂單管理')
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,404 @@
+"""
+Archiving for tables that grow with time.
+依時間成長資料表的歸檔
+
+Covers orders_order, payments_paymentlog and authentication_loginattempt.
+
+On PostgreSQL the two log tables can be converted once (archive_tables
+--convert) into monthly range partitions on their timestamp column. After
+that, each run creates the partitions for the coming months and detaches
+partitions past retention. Detaching (and optionally dropping) a month is a
+catalog change, so it takes the same time whatever the month holds. With
+ARCHIVE_EXPORT_DIR set, each detached partition is also written to a gzip
+JSON Lines file before it is dropped.
+
+Tables that are not partitioned, including every table on other backends,
+are archived by moving old rows in batches into a <table>_archive copy.
+Rows that reference a moved row (an order's items, payment, payment logs,
+events...) are found with Django's deletion collector and moved together,
+so no foreign key is left dangling.
+
+orders_order itself is never partitioned. On PostgreSQL a foreign key can
+only point at a partitioned table through a unique key that includes the
+partition column, and order items, payments, events, reservations and
+shipping addresses all reference orders by id alone.
+
+Models are used unchanged either way. Queries for recent data read the
+live table or its current partitions.
+"""
+
+import gzip
+import json
+import logging
+import os
+import re
+from collections import namedtuple
+from datetime import date, datetime
+
+from django.apps import apps
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, router, transaction
+from django.db.models.deletion import Collector
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+ArchiveSpec = namedtuple('ArchiveSpec', 'label date_field partitionable filters')
+
+ARCHIVE_SPECS = (
+    ArchiveSpec('payments.PaymentLog', 'created_at', True, {}),
+    ArchiveSpec('authentication.LoginAttempt', 'attempted_at', True, {}),
+    # Only finished orders; open ones stay live however old they are
+    ArchiveSpec('orders.Order', 'created_at', False, {'status__in': ('delivered', 'cancelled', 'refunded')}),
+)
+
+# Months of data kept live per model; override with ARCHIVE_RETENTION_MONTHS
+DEFAULT_RETENTION_MONTHS = {
+    'payments.PaymentLog': 12,
+    'authentication.LoginAttempt': 6,
+    'orders.Order': 36,
+}
+
+# Partitions created ahead of the current month
+MONTHS_AHEAD = 3
+
+PARTITION_RE = re.compile(r'_p(\d{4})(\d{2})$')
+
+
+class ArchivingError(Exception):
+    """Raised when a table cannot be partitioned or archived."""
+
+
+def get_retention_months(label):
+    """Return how many months of a model's rows stay live."""
+    overrides = getattr(settings, 'ARCHIVE_RETENTION_MONTHS', {}) or {}
+    return max(1, overrides.get(label, DEFAULT_RETENTION_MONTHS[label]))
+
+
+def add_months(day, months):
+    """Return the first day of the month months after day's month."""
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_start(day):
+    """Return the aware local midnight starting day's month."""
+    return timezone.make_aware(datetime(day.year, day.month, 1))
+
+
+def archive_cutoff(label, now=None):
+    """Return the start of the oldest month that stays live."""
+    today = timezone.localdate(now or timezone.now())
+    return month_start(add_months(today, -(get_retention_months(label) - 1)))
+
+
+def _connection_for(model):
+    return connections[router.db_for_write(model)]
+
+
+# PostgreSQL partitions
+
+def is_partitioned(model):
+    """Return True if the model's table is a PostgreSQL partitioned table."""
+    connection = _connection_for(model)
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))',
+            [model._meta.db_table],
+        )
+        return cursor.fetchone()[0]
+
+
+def partition_name(table, month):
+    return f'{table}_p{month:%Y%m}'
+
+
+def list_partitions(model):
+    """Return {month: partition table} for a partitioned model."""
+    connection = _connection_for(model)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = to_regclass(%s)',
+            [model._meta.db_table],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = {}
+    for name in names:
+        match = PARTITION_RE.search(name)
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def _create_partition(cursor, connection, table, month, parent=None):
+    """Create one month's partition (DDL cannot take bound parameters)."""
+    qn = connection.ops.quote_name
+    start = month_start(month).isoformat(sep=' ')
+    end = month_start(add_months(month, 1)).isoformat(sep=' ')
+    cursor.execute(
+        f'CREATE TABLE IF NOT EXISTS {qn(partition_name(table, month))} PARTITION OF {qn(parent or table)} '
+        f"FOR VALUES FROM ('{start}') TO ('{end}')"
+    )
+
+
+def ensure_partitions(model, months_ahead=MONTHS_AHEAD, now=None):
+    """
+    Create partitions from the current month to months_ahead months out.
+    建立未來月份的分割區
+
+    Returns:
+        int: Number of partitions created
+    """
+    connection = _connection_for(model)
+    table = model._meta.db_table
+    existing = list_partitions(model)
+    this_month = timezone.localdate(now or timezone.now()).replace(day=1)
+    missing = [
+        add_months(this_month, i) for i in range(months_ahead + 1)
+        if add_months(this_month, i) not in existing
+    ]
+    with connection.cursor() as cursor:
+        for month in missing:
+            _create_partition(cursor, connection, table, month)
+    return len(missing)
+
+
+def export_table(connection, table, directory, batch_size=5000):
+    """
+    Write every row of a table to <directory>/<table>.jsonl.gz.
+    將資料表匯出為壓縮檔
+
+    The file is synced to disk before returning, so the table can be
+    dropped afterwards. An existing file is never overwritten.
+
+    Returns:
+        tuple: (rows written, file path)
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{table}.jsonl.gz')
+    total = 0
+    with open(path, 'xb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as archive, \
+            connection.cursor() as cursor:
+        cursor.execute(f'SELECT * FROM {connection.ops.quote_name(table)}')
+        columns = [column[0] for column in cursor.description]
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                line = json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder, ensure_ascii=False)
+                archive.write(line.encode('utf-8') + b'\n')
+            total += len(rows)
+        archive.close()
+        raw.flush()
+        os.fsync(raw.fileno())
+    return total, path
+
+
+def detach_old_partitions(model, cutoff, drop=False, export_dir=None):
+    """
+    Detach (and optionally drop) partitions that end before cutoff.
+    卸離（或刪除）超過保留期限的分割區
+
+    A detached partition stays behind as a standalone table named after its
+    month. Neither step reads the partition's rows; exporting to export_dir
+    (see export_table) does, once per partition.
+
+    Returns:
+        list: Names of the partitions detached
+    """
+    connection = _connection_for(model)
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    cutoff_month = timezone.localdate(cutoff).replace(day=1)
+    old = [name for month, name in sorted(list_partitions(model).items()) if month < cutoff_month]
+    with connection.cursor() as cursor:
+        for name in old:
+            cursor.execute(f'ALTER TABLE {qn(table)} DETACH PARTITION {qn(name)}')
+            if export_dir:
+                export_table(connection, name, export_dir)
+            if drop:
+                cursor.execute(f'DROP TABLE {qn(name)}')
+    return old
+
+
+def convert_to_partitions(model, date_field, months_ahead=MONTHS_AHEAD):
+    """
+    Rebuild a table as monthly range partitions on date_field (PostgreSQL).
+    將資料表轉換為每月分割區
+
+    Copies every row, so the table is locked for the duration; run it in a
+    maintenance window. The primary key becomes (id, date_field), which
+    PostgreSQL requires, so the table must not be the target of any foreign
+    key. Indexes and outgoing foreign keys are recreated under their
+    original names so later migrations still find them.
+    """
+    connection = _connection_for(model)
+    if connection.vendor != 'postgresql':
+        raise ArchivingError('Partitioning requires PostgreSQL')
+    if is_partitioned(model):
+        return False
+
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    staging = f'{table}_partitioned'
+    pk = model._meta.pk.column
+    column = model._meta.get_field(date_field).column
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT COUNT(*) FROM pg_constraint WHERE contype = 'f' AND confrelid = to_regclass(%s)",
+            [table],
+        )
+        if cursor.fetchone()[0]:
+            raise ArchivingError(f'{table} is referenced by foreign keys and cannot be partitioned')
+
+        cursor.execute(
+            'SELECT pg_get_indexdef(indexrelid) FROM pg_index '
+            'WHERE indrelid = to_regclass(%s) AND NOT indisprimary',
+            [table],
+        )
+        index_defs = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+            [table],
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(f'SELECT MIN({qn(column)}) FROM {qn(table)}')
+        oldest = cursor.fetchone()[0]
+
+        cursor.execute(
+            f'CREATE TABLE {qn(staging)} (LIKE {qn(table)} INCLUDING DEFAULTS '
+            f'INCLUDING CONSTRAINTS INCLUDING IDENTITY) PARTITION BY RANGE ({qn(column)})'
+        )
+        cursor.execute(
+            f'ALTER TABLE {qn(staging)} ADD CONSTRAINT {qn(staging + "_pkey")} '
+            f'PRIMARY KEY ({qn(pk)}, {qn(column)})'
+        )
+
+        this_month = timezone.localdate().replace(day=1)
+        month = timezone.localdate(oldest).replace(day=1) if oldest else this_month
+        while month <= add_months(this_month, months_ahead):
+            _create_partition(cursor, connection, table, month, parent=staging)
+            month = add_months(month, 1)
+        # Safety net for rows outside the created months; kept empty by ensure_partitions
+        cursor.execute(f'CREATE TABLE {qn(table + "_default")} PARTITION OF {qn(staging)} DEFAULT')
+
+        cursor.execute(f'INSERT INTO {qn(staging)} OVERRIDING SYSTEM VALUE SELECT * FROM {qn(table)}')
+        cursor.execute(f'DROP TABLE {qn(table)}')
+        cursor.execute(f'ALTER TABLE {qn(staging)} RENAME TO {qn(table)}')
+        cursor.execute(f'ALTER TABLE {qn(table)} RENAME CONSTRAINT {qn(staging + "_pkey")} TO {qn(table + "_pkey")}')
+        for definition in index_defs:
+            cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}')
+        cursor.execute(
+            f'SELECT setval(pg_get_serial_sequence(%s, %s), COALESCE(MAX({qn(pk)}), 0) + 1, false) '
+            f'FROM {qn(table)}',
+            [table, pk],
+        )
+    logger.info(f'Converted {table} to monthly partitions')
+    return True
+
+
+# Row archiving
+
+def _ensure_archive_table(connection, model):
+    """Create <table>_archive, or add columns the live table gained since."""
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    archive = f'{table}_archive'
+    with connection.cursor() as cursor:
+        if archive not in connection.introspection.table_names(cursor):
+            cursor.execute(f'CREATE TABLE {qn(archive)} AS SELECT * FROM {qn(table)} WHERE 1 = 0')
+            return archive
+        existing = {col.name for col in connection.introspection.get_table_description(cursor, archive)}
+        for field in model._meta.concrete_fields:
+            if field.column not in existing:
+                cursor.execute(
+                    f'ALTER TABLE {qn(archive)} ADD COLUMN {qn(field.column)} {field.db_type(connection)}'
+                )
+    return archive
+
+
+def _copy_to_archive(connection, queryset):
+    """Copy queryset's rows into the model's archive table with one INSERT ... SELECT."""
+    model = queryset.model
+    qn = connection.ops.quote_name
+    archive = _ensure_archive_table(connection, model)
+    columns = ', '.join(qn(field.column) for field in model._meta.concrete_fields)
+    subquery, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {qn(archive)} ({columns}) SELECT {columns} FROM {qn(model._meta.db_table)} '
+            f'WHERE {qn(model._meta.pk.column)} IN ({subquery})',
+            params,
+        )
+        return cursor.rowcount
+
+
+def archive_rows(model, cutoff, filters=None, date_field='created_at', batch_size=500):
+    """
+    Move one batch of rows older than cutoff, and the rows that depend on them, to archive tables.
+    將一批過期資料與其關聯資料移至歸檔表
+
+    Returns:
+        int: Number of model rows archived in this batch
+    """
+    alias = router.db_for_write(model)
+    connection = connections[alias]
+    ids = list(
+        model._base_manager.using(alias)
+        .filter(**{f'{date_field}__lt': cutoff}, **(filters or {}))
+        .order_by(date_field)
+        .values_list('pk', flat=True)[:batch_size]
+    )
+    if not ids:
+        return 0
+
+    with transaction.atomic(using=alias):
+        collector = Collector(using=alias)
+        collector.collect(model._base_manager.using(alias).filter(pk__in=ids))
+        for related_model, instances in collector.data.items():
+            _copy_to_archive(
+                connection,
+                related_model._base_manager.using(alias).filter(pk__in=[obj.pk for obj in instances]),
+            )
+        for queryset in collector.fast_deletes:
+            _copy_to_archive(connection, queryset)
+        collector.delete()
+    return len(ids)
+
+
+def archive_model(spec, batch_size=500, drop=False, export_dir=None, now=None):
+    """
+    Archive one model's old data the way its table allows.
+    依資料表型態歸檔單一模型
+
+    Returns:
+        dict: {'partitions_created', 'partitions_detached', 'rows_archived'}
+    """
+    model = apps.get_model(spec.label)
+    cutoff = archive_cutoff(spec.label, now=now)
+    result = {'partitions_created': 0, 'partitions_detached': [], 'rows_archived': 0}
+
+    if spec.partitionable and is_partitioned(model):
+        result['partitions_created'] = ensure_partitions(model, now=now)
+        result['partitions_detached'] = detach_old_partitions(
+            model, cutoff, drop=drop, export_dir=export_dir
+        )
+        return result
+
+    while True:
+        archived = archive_rows(
+            model, cutoff, filters=spec.filters, date_field=spec.date_field, batch_size=batch_size
+        )
+        result['rows_archived'] += archived
+        if archived < batch_size:
+            break
+    return result
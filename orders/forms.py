@@ -5,7 +5,8 @@ Forms for order processing and checkout.
 from django import forms
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import RegexValidator
-from .models import Order
+from .models import Order, PickupStore
+from .postal_codes import get_index
 
 
 class CheckoutForm(forms.Form):
@@ -44,7 +45,7 @@ class CheckoutForm(forms.Form):
         max_length=10,
         validators=[
             RegexValidator(
-                regex=r'^\d{3,5}$',
+                regex=r'^\d{3}(\d{2,3})?$',
                 message=_('請輸入有效的郵遞區號 / Please enter a valid postal code')
             )
         ],
@@ -91,6 +92,14 @@ class CheckoutForm(forms.Form):
         })
     )
     
+    # Chosen pickup store for convenience-store shipping
+    pickup_store_id = forms.CharField(
+        label=_('取貨門市 / Pickup Store'),
+        max_length=20,
+        required=False,
+        widget=forms.HiddenInput()
+    )
+    
     # Payment Method (will be handled in payment system)
     payment_method = forms.ChoiceField(
         label=_('付款方式 / Payment Method'),
@@ -165,4 +174,32 @@ class CheckoutForm(forms.Form):
         if shipping_method == 'home_delivery' and not address:
             raise forms.ValidationError(_('宅配需要提供詳細地址 / Home delivery requires detailed address'))
         
+        # Convenience-store pickup needs a store of that chain, once the
+        # chain's store list has been imported
+        store_id = cleaned_data.get('pickup_store_id')
+        cleaned_data['pickup_store'] = None
+        if shipping_method and shipping_method != 'home_delivery':
+            stores = PickupStore.objects.filter(chain=shipping_method, is_active=True)
+            if store_id:
+                cleaned_data['pickup_store'] = stores.filter(store_id=store_id).first()
+                if cleaned_data['pickup_store'] is None:
+                    self.add_error('pickup_store_id', _('查無此門市 / Unknown pickup store'))
+            elif stores.exists():
+                self.add_error('pickup_store_id', _('請選擇取貨門市 / Please choose a pickup store'))
+        
+        # Check city, district and postal code against the offline index
+        postal_code = cleaned_data.get('postal_code')
+        city = cleaned_data.get('city')
+        district = cleaned_data.get('district')
+        if postal_code and city and district:
+            match = get_index().lookup(city, district)
+            if match is None:
+                self.add_error('district', _('查無此縣市區域 / Unknown city and district'))
+            elif postal_code[:3] != match.postal_code:
+                self.add_error('postal_code', _('郵遞區號與縣市區域不符 / Postal code does not match the city and district'))
+            else:
+                # Store the official spelling (臺北市, not 台北市)
+                cleaned_data['city'] = match.city
+                cleaned_data['district'] = match.district
+        
         return cleaned_data
\ No newline at end of file
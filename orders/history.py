@@ -0,0 +1,108 @@
+"""
+Order history and per-user order summaries.
+訂單歷史與使用者訂單統計
+
+The history list pages with a keyset cursor on (created_at, id), walking
+the (user, -created_at) index, so page 50 costs the same as page 1. Item
+count and first-item thumbnail are annotated in the same query.
+
+OrderSummary rows are kept up to date by the order signals, so the profile
+page reads one row by primary key; rebuild_order_summary recomputes one
+from scratch.
+"""
+
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.db.models import Count, DecimalField, IntegerField, Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import Order, OrderItem, OrderSummary
+
+PAGE_SIZE = 10
+
+# Payment statuses whose order total counts towards lifetime spend
+SPEND_STATUSES = ('paid',)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def encode_cursor(order):
+    """Encode an order's position as an opaque cursor string."""
+    micros = (order.created_at - EPOCH) // timedelta(microseconds=1)
+    return f"{micros}-{order.pk}"
+
+
+def decode_cursor(cursor):
+    """Return (created_at, id) for a cursor, or None if it is malformed."""
+    try:
+        micros, pk = (int(part) for part in cursor.split('-', 1))
+        return EPOCH + timedelta(microseconds=micros), pk
+    except (AttributeError, TypeError, ValueError, OverflowError, OSError):
+        return None
+
+
+def get_order_page(user, cursor=None, page_size=PAGE_SIZE):
+    """
+    Return one page of a user's orders, newest first.
+    取得使用者訂單歷史的一頁
+
+    Returns:
+        tuple: (orders, next_cursor); next_cursor is None on the last page
+    """
+    items = OrderItem.objects.filter(order=OuterRef('pk'))
+    first_item = items.order_by('id')
+    orders = (
+        Order.objects.filter(user=user)
+        .annotate(
+            item_count=Coalesce(
+                Subquery(
+                    items.values('order').annotate(total=Sum('quantity')).values('total'),
+                    output_field=IntegerField(),
+                ),
+                0,
+            ),
+            first_item_name=Subquery(first_item.values('product_name')[:1]),
+            first_item_image=Subquery(first_item.values('product_image')[:1]),
+        )
+        .order_by('-created_at', '-id')
+    )
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        created_at, pk = position
+        orders = orders.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+    page = list(orders[:page_size + 1])
+    next_cursor = encode_cursor(page[page_size - 1]) if len(page) > page_size else None
+    return page[:page_size], next_cursor
+
+
+def rebuild_order_summary(user_id):
+    """
+    Recompute a user's summary from their orders.
+    重新計算使用者訂單統計
+    """
+    totals = Order.objects.filter(user_id=user_id).aggregate(
+        order_count=Count('id'),
+        lifetime_spend=Coalesce(
+            Sum('total_amount', filter=Q(payment_status__in=SPEND_STATUSES)),
+            Value(Decimal('0')),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        ),
+        last_order_at=Max('created_at'),
+    )
+    summary, _ = OrderSummary.objects.update_or_create(user_id=user_id, defaults=totals)
+    return summary
+
+
+def get_order_summary(user):
+    """
+    Return a user's summary as a dict.
+    取得使用者訂單統計
+    """
+    row = OrderSummary.objects.filter(user_id=user.pk).first() or rebuild_order_summary(user.pk)
+    return {
+        'order_count': row.order_count,
+        'lifetime_spend': row.lifetime_spend,
+        'last_order_at': row.last_order_at,
+    }
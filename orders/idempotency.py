@@ -0,0 +1,201 @@
+"""
+Idempotency keys for checkout and payment creation.
+結帳與建立付款的冪等金鑰
+
+Clients send a key with a POST, either as an Idempotency-Key header or, for
+HTML forms, an idempotency_key field. The first request with a key claims a
+row under a unique constraint and stores its response when it finishes.
+Retries with the same key replay that response without running the view
+again. A retry that arrives while the first request is still running waits
+briefly for it to finish.
+"""
+
+import hashlib
+import json
+import logging
+import time
+import uuid
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+FORM_FIELD = 'idempotency_key'
+MAX_KEY_LENGTH = 100
+
+# How long a retry waits for the original request before giving up with 409
+WAIT_SECONDS = 5
+POLL_INTERVAL = 0.2
+
+# Fields that differ between identical submissions
+IGNORED_FIELDS = {'csrfmiddlewaretoken', FORM_FIELD}
+
+
+def new_key():
+    """Return a fresh key for rendering into a form."""
+    return uuid.uuid4().hex
+
+
+def get_key_ttl():
+    """Return how long stored responses are replayed."""
+    return timedelta(hours=getattr(settings, 'IDEMPOTENCY_KEY_TTL_HOURS', 24))
+
+
+def get_request_key(request):
+    """Return the idempotency key sent with a request, or None."""
+    key = request.META.get(HEADER)
+    if not key:
+        data = getattr(request, 'data', None)
+        if data is None:
+            data = request.POST
+        key = data.get(FORM_FIELD) if hasattr(data, 'get') else None
+    if not key:
+        return None
+    return str(key).strip()[:MAX_KEY_LENGTH] or None
+
+
+def request_fingerprint(request):
+    """Hash the method, path and payload so a reused key with a different request is caught."""
+    data = getattr(request, 'data', None)
+    if data is None:
+        data = request.POST
+    if hasattr(data, 'lists'):
+        payload = sorted((k, v) for k, v in data.lists() if k not in IGNORED_FIELDS)
+    elif isinstance(data, dict):
+        payload = sorted((k, v) for k, v in data.items() if k not in IGNORED_FIELDS)
+    else:
+        payload = data
+    raw = json.dumps([request.method, request.path, payload], cls=DjangoJSONEncoder, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _claim(user, scope, key, fingerprint):
+    """
+    Insert the key row, replacing an expired one.
+    Returns (record, created).
+    """
+    now = timezone.now()
+    IdempotencyKey.objects.filter(user=user, scope=scope, key=key, expires_at__lte=now).delete()
+    try:
+        with transaction.atomic():
+            record = IdempotencyKey.objects.create(
+                user=user, scope=scope, key=key, request_fingerprint=fingerprint,
+                expires_at=now + get_key_ttl(),
+            )
+        return record, True
+    except IntegrityError:
+        return IdempotencyKey.objects.get(user=user, scope=scope, key=key), False
+
+
+def _store(record, response):
+    """Store a finished response on its key row."""
+    if hasattr(response, 'data') and not getattr(response, 'is_rendered', True):
+        # DRF Response not yet rendered; keep its data as JSON
+        body = json.dumps(response.data, cls=DjangoJSONEncoder)
+        content_type = 'application/json'
+    else:
+        body = response.content.decode(response.charset or 'utf-8')
+        content_type = response.get('Content-Type', '')
+    IdempotencyKey.objects.filter(pk=record.pk).update(
+        status_code=response.status_code,
+        content_type=content_type[:100],
+        location=response.get('Location', '')[:500],
+        body=body,
+    )
+
+
+def _replay(record):
+    """Rebuild the stored response."""
+    response = HttpResponse(record.body, status=record.status_code, content_type=record.content_type or None)
+    if record.location:
+        response['Location'] = record.location
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _wait_for(record):
+    """Poll until the original request stores its response, or time runs out."""
+    deadline = time.monotonic() + WAIT_SECONDS
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        record = IdempotencyKey.objects.filter(pk=record.pk).first()
+        if record is None or record.is_complete:
+            return record
+    return None
+
+
+def idempotent(scope):
+    """
+    Make a POST view idempotent per user and key.
+    讓 POST 視圖依使用者與金鑰具備冪等性
+
+    Requests without a key, non-POST requests and anonymous users pass
+    straight through. Server errors are not stored, so the client can retry.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            key = get_request_key(request) if request.method == 'POST' else None
+            if not key or not request.user.is_authenticated:
+                return view_func(request, *args, **kwargs)
+
+            fingerprint = request_fingerprint(request)
+            record, created = _claim(request.user, scope, key, fingerprint)
+            if not created:
+                if record.request_fingerprint != fingerprint:
+                    return JsonResponse({
+                        'success': False,
+                        'error': 'Idempotency key was already used for a different request',
+                    }, status=422)
+                if not record.is_complete:
+                    record = _wait_for(record)
+                    if record is None or not record.is_complete:
+                        response = JsonResponse({
+                            'success': False,
+                            'error': 'A request with this idempotency key is still in progress',
+                        }, status=409)
+                        response['Retry-After'] = '1'
+                        return response
+                return _replay(record)
+
+            try:
+                response = view_func(request, *args, **kwargs)
+            except Exception:
+                record.delete()
+                raise
+
+            if response.status_code >= 500:
+                record.delete()
+            else:
+                _store(record, response)
+            return response
+        return wrapper
+    return decorator
+
+
+def purge_expired_keys(batch_size=1000, now=None):
+    """
+    Delete one batch of expired keys.
+    刪除一批過期的冪等金鑰
+
+    Returns:
+        int: Number of keys deleted
+    """
+    now = now or timezone.now()
+    ids = list(
+        IdempotencyKey.objects.filter(expires_at__lte=now)
+        .values_list('pk', flat=True)[:batch_size]
+    )
+    if not ids:
+        return 0
+    deleted, _ = IdempotencyKey.objects.filter(pk__in=ids).delete()
+    return deleted
@@ -0,0 +1,206 @@
+"""
+Stock reservation for Taiwan e-commerce platform.
+Holds stock for orders between checkout and payment using conditional
+decrements, so concurrent checkouts across workers can never oversell.
+"""
+
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from products.models import Product, ProductVariant
+from .models import StockReservation
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientStockError(Exception):
+    """Raised when a conditional stock decrement finds too little stock."""
+
+    def __init__(self, product_id, variant_id=None):
+        self.product_id = product_id
+        self.variant_id = variant_id
+        super().__init__(_('庫存不足 / Insufficient stock'))
+
+
+def get_reservation_ttl():
+    """Return how long unpaid stock holds last."""
+    return timedelta(minutes=getattr(settings, 'STOCK_RESERVATION_TTL_MINUTES', 30))
+
+
+def _decrement_stock(product_id, variant_id, quantity):
+    """
+    Take stock with a single conditional UPDATE (stock = stock - n WHERE stock >= n).
+    Returns True if the stock was taken.
+    """
+    if variant_id:
+        queryset = ProductVariant.objects.filter(pk=variant_id)
+    else:
+        queryset = Product.objects.filter(pk=product_id)
+    return queryset.filter(stock__gte=quantity).update(stock=F('stock') - quantity) == 1
+
+
+def _restore_stock(totals):
+    """Give stock back, one UPDATE per distinct product/variant."""
+    for (product_id, variant_id), quantity in totals.items():
+        if variant_id:
+            ProductVariant.objects.filter(pk=variant_id).update(stock=F('stock') + quantity)
+        else:
+            Product.objects.filter(pk=product_id).update(stock=F('stock') + quantity)
+
+
+def reserve_stock(order, lines, ttl=None):
+    """
+    Hold stock for an order.
+    為訂單保留庫存
+
+    Must run inside the transaction that creates the order, so a failure
+    rolls back every decrement taken so far.
+
+    Args:
+        order: Order the stock is held for
+        lines: Iterable of (product_id, variant_id, quantity)
+        ttl: Hold duration (defaults to STOCK_RESERVATION_TTL_MINUTES)
+
+    Raises:
+        InsufficientStockError: If any line cannot be covered
+    """
+    totals = defaultdict(int)
+    for product_id, variant_id, quantity in lines:
+        totals[(product_id, variant_id)] += quantity
+
+    # Lock rows in a stable order so concurrent checkouts cannot deadlock
+    keys = sorted(totals, key=lambda key: (key[0], key[1] or 0))
+    for product_id, variant_id in keys:
+        if not _decrement_stock(product_id, variant_id, totals[(product_id, variant_id)]):
+            raise InsufficientStockError(product_id, variant_id)
+
+    expires_at = timezone.now() + (ttl or get_reservation_ttl())
+    StockReservation.objects.bulk_create([
+        StockReservation(
+            order=order,
+            product_id=product_id,
+            variant_id=variant_id,
+            quantity=totals[(product_id, variant_id)],
+            expires_at=expires_at,
+        )
+        for product_id, variant_id in keys
+    ])
+
+
+def extend_reservations(order, expires_at):
+    """
+    Keep an order's holds until expires_at.
+    延長訂單庫存保留期限
+
+    ATM, CVS and BARCODE payment codes stay payable for days, far longer
+    than STOCK_RESERVATION_TTL_MINUTES, so their orders' holds are
+    stretched to the payment deadline. Holds already released are left
+    to commit_reservations.
+
+    Returns:
+        int: Number of holds extended
+    """
+    return StockReservation.objects.filter(
+        order=order, status='held', expires_at__lt=expires_at
+    ).update(expires_at=expires_at, updated_at=timezone.now())
+
+
+def commit_reservations(order):
+    """
+    Make an order's holds permanent once it is paid.
+    訂單付款後確認庫存保留
+
+    Holds that already expired and were released take their stock again;
+    if that stock is gone the shortfall is logged for manual handling.
+    """
+    with transaction.atomic():
+        StockReservation.objects.filter(order=order, status='held').update(
+            status='committed', updated_at=timezone.now()
+        )
+
+        released = list(
+            StockReservation.objects.select_for_update()
+            .filter(order=order, status='released')
+        )
+        for reservation in released:
+            if not _decrement_stock(reservation.product_id, reservation.variant_id, reservation.quantity):
+                logger.error(
+                    f"Paid order {order.order_number} oversold: product {reservation.product_id} "
+                    f"variant {reservation.variant_id} x {reservation.quantity}"
+                )
+        if released:
+            StockReservation.objects.filter(pk__in=[r.pk for r in released]).update(
+                status='committed', updated_at=timezone.now()
+            )
+
+
+def _release(queryset, skip_locked=False):
+    """Release held reservations in queryset and restore their stock."""
+    with transaction.atomic():
+        reservations = list(
+            queryset.filter(status='held')
+            .select_for_update(skip_locked=skip_locked)
+            .values_list('pk', 'product_id', 'variant_id', 'quantity')
+        )
+        if not reservations:
+            return 0
+
+        totals = defaultdict(int)
+        for pk, product_id, variant_id, quantity in reservations:
+            totals[(product_id, variant_id)] += quantity
+        _restore_stock(totals)
+
+        StockReservation.objects.filter(pk__in=[r[0] for r in reservations]).update(
+            status='released', updated_at=timezone.now()
+        )
+        return len(reservations)
+
+
+def release_reservations(order):
+    """
+    Release an order's holds after its payment fails or it is cancelled.
+    付款失敗或取消時釋放訂單庫存
+
+    Returns:
+        int: Number of reservations released
+    """
+    return _release(StockReservation.objects.filter(order=order))
+
+
+def release_reservations_for_orders(order_ids):
+    """
+    Release the holds of several orders at once (bulk cancellation).
+    批次釋放多筆訂單的庫存保留
+
+    Returns:
+        int: Number of reservations released
+    """
+    return _release(StockReservation.objects.filter(order_id__in=list(order_ids)))
+
+
+def release_expired_reservations(batch_size=500, now=None):
+    """
+    Release one batch of expired holds.
+    釋放一批已過期的庫存保留
+
+    Rows locked by another worker are skipped, so several sweepers can run
+    side by side.
+
+    Returns:
+        int: Number of reservations released in this batch
+    """
+    now = now or timezone.now()
+    expired = StockReservation.objects.filter(
+        status='held', expires_at__lt=now
+    ).order_by('expires_at')[:batch_size]
+    return _release(
+        StockReservation.objects.filter(pk__in=list(expired.values_list('pk', flat=True))),
+        skip_locked=True,
+    )
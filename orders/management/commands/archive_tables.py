@@ -0,0 +1,70 @@
+"""
+Management command to partition and archive the tables that grow with time.
+"""
+
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from orders.archiving import ARCHIVE_SPECS, ArchivingError, archive_model, convert_to_partitions
+
+
+class Command(BaseCommand):
+    help = 'Create upcoming partitions and archive orders, payment logs and login attempts past retention'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--convert',
+            action='store_true',
+            help='PostgreSQL only: first rebuild the log tables as monthly partitions (locks them)',
+        )
+        parser.add_argument(
+            '--drop',
+            action='store_true',
+            help='Drop detached partitions instead of keeping them as archive tables',
+        )
+        parser.add_argument(
+            '--export-dir',
+            default=None,
+            help='Write detached partitions to gzip JSON Lines files here first '
+                 '(default: ARCHIVE_EXPORT_DIR; empty to skip)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Rows moved per transaction on unpartitioned tables (default: 500)',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            self.stderr.write(self.style.ERROR('--batch-size must be at least 1'))
+            return
+        
+        export_dir = options['export_dir']
+        if export_dir is None:
+            export_dir = getattr(settings, 'ARCHIVE_EXPORT_DIR', '')
+        
+        started = time.monotonic()
+        for spec in ARCHIVE_SPECS:
+            if options['convert'] and spec.partitionable:
+                try:
+                    if convert_to_partitions(apps.get_model(spec.label), spec.date_field):
+                        self.stdout.write(f'{spec.label}: converted to monthly partitions')
+                except ArchivingError as e:
+                    self.stderr.write(self.style.ERROR(f'{spec.label}: {e}'))
+            
+            result = archive_model(
+                spec, batch_size=batch_size, drop=options['drop'], export_dir=export_dir or None
+            )
+            detached = result['partitions_detached']
+            self.stdout.write(
+                f"{spec.label}: {result['partitions_created']} partitions created, "
+                f"{len(detached)} {'dropped' if options['drop'] else 'detached'}, "
+                f"{result['rows_archived']} rows archived"
+            )
+        
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'Archiving finished ({elapsed:.2f}s)'))
@@ -0,0 +1,102 @@
+"""
+Management command to import convenience-store pickup locations from CSV.
+
+The CSV needs a header row with store_id, name, address, latitude and
+longitude columns, plus optional city and district. A chain column is
+required unless --chain is given.
+"""
+
+import csv
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from orders.models import PickupStore
+from orders.pickup_stores import invalidate_store_index
+
+UPDATE_FIELDS = ['name', 'address', 'city', 'district', 'latitude', 'longitude', 'is_active', 'updated_at']
+
+
+class Command(BaseCommand):
+    help = 'Import or update convenience-store pickup locations from a CSV file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', help='Path to the store list (UTF-8 CSV)')
+        parser.add_argument(
+            '--chain',
+            choices=[value for value, label in PickupStore.CHAIN_CHOICES],
+            help='Chain for every row (when the file has no chain column)',
+        )
+        parser.add_argument(
+            '--deactivate-missing',
+            action='store_true',
+            help='Mark stores of the imported chains that are not in the file as closed',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows written per statement (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        chains = {value for value, label in PickupStore.CHAIN_CHOICES}
+        now = timezone.now()
+        stores = {}
+        skipped = 0
+
+        try:
+            with open(options['csv_file'], encoding='utf-8-sig', newline='') as f:
+                for line, row in enumerate(csv.DictReader(f), start=2):
+                    chain = options['chain'] or (row.get('chain') or '').strip()
+                    try:
+                        if chain not in chains:
+                            raise ValueError(f'unknown chain {chain!r}')
+                        store = PickupStore(
+                            chain=chain,
+                            store_id=row['store_id'].strip(),
+                            name=row['name'].strip(),
+                            address=row['address'].strip(),
+                            city=(row.get('city') or '').strip(),
+                            district=(row.get('district') or '').strip(),
+                            latitude=Decimal(row['latitude'].strip()),
+                            longitude=Decimal(row['longitude'].strip()),
+                            is_active=True,
+                            updated_at=now,
+                        )
+                        if not store.store_id or not store.name:
+                            raise ValueError('store_id and name are required')
+                    except (KeyError, AttributeError, ValueError, InvalidOperation) as e:
+                        skipped += 1
+                        self.stderr.write(f'Line {line} skipped: {e}')
+                        continue
+                    stores[(store.chain, store.store_id)] = store
+        except OSError as e:
+            raise CommandError(f'Cannot read {options["csv_file"]}: {e}')
+
+        with transaction.atomic():
+            PickupStore.objects.bulk_create(
+                list(stores.values()),
+                batch_size=options['batch_size'],
+                update_conflicts=True,
+                unique_fields=['chain', 'store_id'],
+                update_fields=UPDATE_FIELDS,
+            )
+            closed = 0
+            if options['deactivate_missing']:
+                for chain in {key[0] for key in stores}:
+                    seen = [store_id for c, store_id in stores if c == chain]
+                    closed += (
+                        PickupStore.objects.filter(chain=chain, is_active=True)
+                        .exclude(store_id__in=seen)
+                        .update(is_active=False, updated_at=now)
+                    )
+
+        invalidate_store_index()
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {len(stores)} stores, closed {closed}, skipped {skipped} rows ({elapsed:.2f}s)'
+        ))
@@ -0,0 +1,39 @@
+"""
+Management command to delete expired idempotency keys.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from orders.idempotency import purge_expired_keys
+
+
+class Command(BaseCommand):
+    help = 'Delete expired idempotency keys in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Keys deleted per statement (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            self.stderr.write(self.style.ERROR('--batch-size must be at least 1'))
+            return
+        
+        started = time.monotonic()
+        total = 0
+        while True:
+            deleted = purge_expired_keys(batch_size=batch_size)
+            total += deleted
+            if deleted < batch_size:
+                break
+        
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            self.style.SUCCESS(f'Deleted {total} expired idempotency keys ({elapsed:.2f}s)')
+        )
@@ -0,0 +1,34 @@
+"""
+Management command to update the daily sales rollups.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from orders.reports import rebuild_day, update_sales_rollups
+from orders.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Roll up orders changed since the last run into daily sales rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Rebuild every day with orders, ignoring the watermark',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if options['rebuild']:
+            days = list(Order.objects.dates('created_at', 'day'))
+            rows = sum(rebuild_day(day) for day in days)
+            days = len(days)
+        else:
+            days, rows = update_sales_rollups()
+        
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt {days} days, {rows} rollup rows ({elapsed:.2f}s)')
+        )
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.24 on 2026-10-19 10:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+        ('orders', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(verbose_name='數量 / Quantity')),
+                ('status', models.CharField(choices=[('held', '保留中 / Held'), ('committed', '已確認 / Committed'), ('released', '已釋放 / Released')], default='held', max_length=20, verbose_name='狀態 / Status')),
+                ('expires_at', models.DateTimeField(help_text='未付款時釋放庫存的時間 / When the hold is released if unpaid', verbose_name='到期時間 / Expires At')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='建立時間 / Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新時間 / Updated At')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_reservations', to='orders.order', verbose_name='訂單 / Order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='products.product', verbose_name='商品 / Product')),
+                ('variant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='products.productvariant', verbose_name='規格 / Variant')),
+            ],
+            options={
+                'verbose_name': '庫存保留 / Stock Reservation',
+                'verbose_name_plural': '庫存保留 / Stock Reservations',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['status', 'expires_at'], name='orders_stoc_status_e8aa04_idx'), models.Index(fields=['order', 'status'], name='orders_stoc_order_i_a4ab61_idx')],
+            },
+        ),
+    ]
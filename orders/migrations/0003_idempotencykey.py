@@ -0,0 +1,41 @@
+# Generated by Django 4.2.24 on 2026-10-19 10:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('orders', '0002_stockreservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(help_text='使用此金鑰的端點 / Endpoint the key was used on', max_length=50, verbose_name='範圍 / Scope')),
+                ('key', models.CharField(max_length=100, verbose_name='金鑰 / Key')),
+                ('request_fingerprint', models.CharField(max_length=64, verbose_name='請求指紋 / Request Fingerprint')),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='回應狀態碼 / Response Status')),
+                ('content_type', models.CharField(blank=True, default='', max_length=100, verbose_name='內容類型 / Content Type')),
+                ('location', models.CharField(blank=True, default='', max_length=500, verbose_name='重新導向網址 / Redirect Location')),
+                ('body', models.TextField(blank=True, default='', verbose_name='回應內容 / Response Body')),
+                ('expires_at', models.DateTimeField(verbose_name='到期時間 / Expires At')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='建立時間 / Created At')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='idempotency_keys', to=settings.AUTH_USER_MODEL, verbose_name='使用者 / User')),
+            ],
+            options={
+                'verbose_name': '冪等金鑰 / Idempotency Key',
+                'verbose_name_plural': '冪等金鑰 / Idempotency Keys',
+                'indexes': [models.Index(fields=['expires_at'], name='orders_idem_expires_681ecb_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='idempotencykey',
+            constraint=models.UniqueConstraint(fields=('user', 'scope', 'key'), name='idempotency_key_unique_per_user_scope'),
+        ),
+    ]
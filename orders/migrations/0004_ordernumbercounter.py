@@ -0,0 +1,24 @@
+# Generated by Django 4.2.24 on 2026-10-19 10:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderNumberCounter',
+            fields=[
+                ('day', models.DateField(primary_key=True, serialize=False, verbose_name='日期 / Day')),
+                ('next_value', models.PositiveBigIntegerField(default=1, verbose_name='下一個序號 / Next Value')),
+            ],
+            options={
+                'verbose_name': '訂單編號計數器 / Order Number Counter',
+                'verbose_name_plural': '訂單編號計數器 / Order Number Counters',
+            },
+        ),
+    ]
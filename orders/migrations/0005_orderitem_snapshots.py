@@ -0,0 +1,67 @@
+# Generated by Django 4.2.24 on 2026-10-19 10:46
+
+from django.db import migrations, models
+
+
+def backfill_snapshots(apps, schema_editor):
+    """
+    Fill the new snapshot fields on existing lines from the catalog as it
+    is now; lines whose product was deleted keep empty values.
+    """
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    ProductImage = apps.get_model('products', 'ProductImage')
+    
+    items = (
+        OrderItem.objects.filter(product__isnull=False)
+        .select_related('product', 'variant')
+        .order_by('id')
+    )
+    images = {}
+    batch = []
+    for item in items.iterator(chunk_size=1000):
+        if item.product_id not in images:
+            images[item.product_id] = (
+                ProductImage.objects.filter(product_id=item.product_id)
+                .order_by('-is_primary', 'display_order', 'created_at')
+                .values_list('image', flat=True)
+                .first()
+            )
+        image = images[item.product_id]
+        item.product_name_en = item.product.name_en
+        item.variant_name = item.variant.name if item.variant else ''
+        item.product_image = image or ''
+        if not item.product_name:
+            item.product_name = item.product.name
+        batch.append(item)
+        if len(batch) >= 1000:
+            OrderItem.objects.bulk_update(batch, ['product_name', 'product_name_en', 'variant_name', 'product_image'])
+            batch = []
+    if batch:
+        OrderItem.objects.bulk_update(batch, ['product_name', 'product_name_en', 'variant_name', 'product_image'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_ordernumbercounter'),
+        ('products', '0002_flashsale'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_image',
+            field=models.ImageField(blank=True, default='', max_length=255, upload_to='products/', verbose_name='商品圖片 / Product Image'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_name_en',
+            field=models.CharField(blank=True, default='', max_length=300, verbose_name='商品名稱（英文）/ Product Name (English)'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='variant_name',
+            field=models.CharField(blank=True, default='', max_length=200, verbose_name='規格名稱 / Variant Name'),
+        ),
+        migrations.RunPython(backfill_snapshots, migrations.RunPython.noop),
+    ]
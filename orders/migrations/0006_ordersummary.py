@@ -0,0 +1,30 @@
+# Generated by Django 4.2.24 on 2026-10-19 10:49
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0001_initial'),
+        ('orders', '0005_orderitem_snapshots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderSummary',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='order_summary', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='使用者 / User')),
+                ('order_count', models.PositiveIntegerField(default=0, verbose_name='訂單數 / Order Count')),
+                ('lifetime_spend', models.DecimalField(decimal_places=2, default=0, help_text='已付款訂單總額（新台幣）/ Total of paid orders (NT$)', max_digits=12, verbose_name='累計消費 / Lifetime Spend')),
+                ('last_order_at', models.DateTimeField(blank=True, null=True, verbose_name='最近訂單時間 / Last Order At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新時間 / Updated At')),
+            ],
+            options={
+                'verbose_name': '訂單統計 / Order Summary',
+                'verbose_name_plural': '訂單統計 / Order Summaries',
+            },
+        ),
+    ]
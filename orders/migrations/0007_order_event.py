@@ -0,0 +1,35 @@
+# Generated by Django 4.2.24 on 2026-10-19 10:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('orders', '0006_ordersummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(choices=[('status', '訂單狀態 / Order Status'), ('payment_status', '付款狀態 / Payment Status')], default='status', max_length=20, verbose_name='欄位 / Field')),
+                ('from_value', models.CharField(blank=True, default='', max_length=20, verbose_name='原狀態 / From')),
+                ('to_value', models.CharField(max_length=20, verbose_name='新狀態 / To')),
+                ('note', models.CharField(blank=True, default='', max_length=255, verbose_name='備註 / Note')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='建立時間 / Created At')),
+                ('actor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='操作者 / Actor')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='orders.order', verbose_name='訂單 / Order')),
+            ],
+            options={
+                'verbose_name': '訂單事件 / Order Event',
+                'verbose_name_plural': '訂單事件 / Order Events',
+                'ordering': ['created_at', 'id'],
+                'indexes': [models.Index(fields=['order', 'created_at'], name='orders_orde_order_i_4c5f76_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.2.24 on 2026-10-19 10:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_flashsale'),
+        ('orders', '0007_order_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='日期 / Day')),
+                ('payment_method', models.CharField(blank=True, choices=[('credit_card', '信用卡 / Credit Card'), ('atm', 'ATM 轉帳 / ATM Transfer'), ('cvs_code', '超商代碼 / CVS Code'), ('line_pay', 'LINE Pay'), ('apple_pay', 'Apple Pay'), ('google_pay', 'Google Pay')], max_length=20, verbose_name='付款方式 / Payment Method')),
+                ('shipping_method', models.CharField(blank=True, choices=[('home_delivery', '宅配 / Home Delivery'), ('seven_eleven', '7-11 取貨 / 7-11 Pickup'), ('family_mart', '全家取貨 / FamilyMart Pickup'), ('hi_life', '萊爾富取貨 / Hi-Life Pickup'), ('ok_mart', 'OK超商取貨 / OK Mart Pickup')], max_length=20, verbose_name='配送方式 / Shipping Method')),
+                ('order_count', models.PositiveIntegerField(default=0, verbose_name='訂單數 / Orders')),
+                ('quantity', models.PositiveIntegerField(default=0, verbose_name='售出數量 / Units Sold')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, help_text='商品小計合計，不含運費與折扣（新台幣）/ Item subtotals excluding shipping and discounts (NT$)', max_digits=14, verbose_name='商品營收 / Item Revenue')),
+            ],
+            options={
+                'verbose_name': '每日銷售統計 / Daily Sales Rollup',
+                'verbose_name_plural': '每日銷售統計 / Daily Sales Rollups',
+                'ordering': ['-day'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False, verbose_name='名稱 / Name')),
+                ('value', models.DateTimeField(verbose_name='處理至 / Processed Up To')),
+            ],
+            options={
+                'verbose_name': '統計進度 / Rollup Watermark',
+                'verbose_name_plural': '統計進度 / Rollup Watermarks',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['updated_at'], name='orders_orde_updated_94e16c_idx'),
+        ),
+        migrations.AddField(
+            model_name='dailysalesrollup',
+            name='category',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='products.category', verbose_name='分類 / Category'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailysalesrollup',
+            constraint=models.UniqueConstraint(fields=('day', 'category', 'payment_method', 'shipping_method'), name='unique_daily_sales_rollup'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.24 on 2026-10-19 11:00
+
+import django.core.validators
+from decimal import Decimal
+
+from django.db import migrations, models
+
+# Starting price list: NT$60, free over NT$1,500 (the fee checkout charged
+# before); convenience-store pickup carries parcels up to 5 kg
+INITIAL_RATES = (
+    ('home_delivery', 10000, Decimal('60'), Decimal('1500')),
+    ('home_delivery', 20000, Decimal('120'), Decimal('3000')),
+    ('home_delivery', None, Decimal('200'), None),
+    ('seven_eleven', 5000, Decimal('60'), Decimal('1500')),
+    ('family_mart', 5000, Decimal('60'), Decimal('1500')),
+    ('hi_life', 5000, Decimal('60'), Decimal('1500')),
+    ('ok_mart', 5000, Decimal('60'), Decimal('1500')),
+)
+
+
+def seed_rates(apps, schema_editor):
+    ShippingRate = apps.get_model('orders', 'ShippingRate')
+    ShippingRate.objects.bulk_create([
+        ShippingRate(shipping_method=method, max_weight=max_weight, fee=fee, free_shipping_threshold=threshold)
+        for method, max_weight, fee, threshold in INITIAL_RATES
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0008_daily_sales_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShippingRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shipping_method', models.CharField(choices=[('home_delivery', '宅配 / Home Delivery'), ('seven_eleven', '7-11 取貨 / 7-11 Pickup'), ('family_mart', '全家取貨 / FamilyMart Pickup'), ('hi_life', '萊爾富取貨 / Hi-Life Pickup'), ('ok_mart', 'OK超商取貨 / OK Mart Pickup')], max_length=20, verbose_name='配送方式 / Shipping Method')),
+                ('max_weight', models.PositiveIntegerField(blank=True, help_text='此級距可承運的總重量上限，留空表示不限 / Heaviest parcel in this band; blank for no limit', null=True, verbose_name='重量上限（公克）/ Max Weight (grams)')),
+                ('fee', models.DecimalField(decimal_places=2, help_text='新台幣 / NT$', max_digits=8, validators=[django.core.validators.MinValueValidator(0)], verbose_name='運費 / Fee')),
+                ('free_shipping_threshold', models.DecimalField(blank=True, decimal_places=2, help_text='商品小計達此金額免運費，留空表示不適用 / Subtotal that ships free; blank for never', max_digits=10, null=True, verbose_name='免運門檻 / Free Shipping Threshold')),
+                ('is_active', models.BooleanField(default=True, verbose_name='啟用 / Active')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新時間 / Updated At')),
+            ],
+            options={
+                'verbose_name': '運費規則 / Shipping Rate',
+                'verbose_name_plural': '運費規則 / Shipping Rates',
+                'ordering': ['shipping_method', 'max_weight'],
+            },
+        ),
+        migrations.RunPython(seed_rates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.24 on 2026-10-19 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0009_shippingrate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PickupStore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chain', models.CharField(choices=[('seven_eleven', '7-11 取貨 / 7-11 Pickup'), ('family_mart', '全家取貨 / FamilyMart Pickup'), ('hi_life', '萊爾富取貨 / Hi-Life Pickup'), ('ok_mart', 'OK超商取貨 / OK Mart Pickup')], max_length=20, verbose_name='超商 / Chain')),
+                ('store_id', models.CharField(max_length=20, verbose_name='門市代號 / Store ID')),
+                ('name', models.CharField(max_length=100, verbose_name='門市名稱 / Store Name')),
+                ('address', models.CharField(max_length=255, verbose_name='地址 / Address')),
+                ('city', models.CharField(blank=True, default='', max_length=20, verbose_name='縣市 / City')),
+                ('district', models.CharField(blank=True, default='', max_length=20, verbose_name='區域 / District')),
+                ('latitude', models.DecimalField(decimal_places=6, max_digits=9, verbose_name='緯度 / Latitude')),
+                ('longitude', models.DecimalField(decimal_places=6, max_digits=9, verbose_name='經度 / Longitude')),
+                ('is_active', models.BooleanField(default=True, verbose_name='營業中 / Active')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新時間 / Updated At')),
+            ],
+            options={
+                'verbose_name': '取貨門市 / Pickup Store',
+                'verbose_name_plural': '取貨門市 / Pickup Stores',
+                'ordering': ['chain', 'store_id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='pickup_store_address',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='取貨門市地址 / Pickup Store Address'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='pickup_store_id',
+            field=models.CharField(blank=True, default='', max_length=20, verbose_name='取貨門市代號 / Pickup Store ID'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='pickup_store_name',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='取貨門市 / Pickup Store'),
+        ),
+        migrations.AddConstraint(
+            model_name='pickupstore',
+            constraint=models.UniqueConstraint(fields=('chain', 'store_id'), name='unique_pickup_store'),
+        ),
+    ]
@@ -3,10 +3,10 @@ Order models for Taiwan e-commerce platform.
 Handles orders, order items, and shipping addresses with Taiwan-specific features.
 """
 from django.db import models
+from django.core.validators import MinValueValidator
 from django.contrib.auth import get_user_model
 from django.utils.translation import gettext_lazy as _
 from products.models import Product, ProductVariant
-import uuid
 
 User = get_user_model()
 
@@ -156,6 +156,28 @@ class Order(models.Model):
         default=''
     )
     
+    # Convenience-store pickup (copied from PickupStore at checkout)
+    pickup_store_id = models.CharField(
+        _('取貨門市代號 / Pickup Store ID'),
+        max_length=20,
+        blank=True,
+        default=''
+    )
+    
+    pickup_store_name = models.CharField(
+        _('取貨門市 / Pickup Store'),
+        max_length=100,
+        blank=True,
+        default=''
+    )
+    
+    pickup_store_address = models.CharField(
+        _('取貨門市地址 / Pickup Store Address'),
+        max_length=255,
+        blank=True,
+        default=''
+    )
+    
     # Order Amounts (in NT$)
     subtotal = models.DecimalField(
         _('商品小計 / Subtotal'),
@@ -209,6 +231,7 @@ class Order(models.Model):
             models.Index(fields=['order_number']),
             models.Index(fields=['user', '-created_at']),
             models.Index(fields=['status']),
+            models.Index(fields=['updated_at']),
         ]
     
     def __str__(self):
@@ -217,11 +240,13 @@ class Order(models.Model):
     def save(self, *args, **kwargs):
         """Generate order number if not exists."""
         if not self.order_number:
-            # Format: ES-YYYYMMDD-XXXXX (ES = EShop)
-            from django.utils import timezone
-            timestamp = timezone.now().strftime('%Y%m%d')
-            random_suffix = str(uuid.uuid4().hex)[:5].upper()
-            self.order_number = f"ES-{timestamp}-{random_suffix}"
+            # Format: ES-YYYYMMDD-NNNNNNC (ES = EShop, C = check digit)
+            from .numbering import next_order_number
+            self.order_number = next_order_number()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'updated_at' not in update_fields:
+            # Partial saves still bump updated_at; sales rollups rely on it
+            kwargs['update_fields'] = [*update_fields, 'updated_at']
         super().save(*args, **kwargs)
     
     def get_full_address(self):
@@ -266,6 +291,13 @@ class OrderItem(models.Model):
         default=''
     )
     
+    product_name_en = models.CharField(
+        _('商品名稱（英文）/ Product Name (English)'),
+        max_length=300,
+        blank=True,
+        default=''
+    )
+    
     product_sku = models.CharField(
         _('商品編號 / SKU'),
         max_length=100,
@@ -273,6 +305,22 @@ class OrderItem(models.Model):
         default=''
     )
     
+    variant_name = models.CharField(
+        _('規格名稱 / Variant Name'),
+        max_length=200,
+        blank=True,
+        default=''
+    )
+    
+    # Path of the product thumbnail at purchase; the file itself is not copied
+    product_image = models.ImageField(
+        _('商品圖片 / Product Image'),
+        upload_to='products/',
+        max_length=255,
+        blank=True,
+        default=''
+    )
+    
     # Quantity and pricing
     quantity = models.PositiveIntegerField(
         _('數量 / Quantity'),
@@ -306,6 +354,18 @@ class OrderItem(models.Model):
     def __str__(self):
         return f"{self.product_name or self.product.name if self.product else 'Unknown'} x {self.quantity}"
     
+    @staticmethod
+    def snapshot_image(product):
+        """
+        Return the image name to snapshot for a product.
+        Reads the prefetched images (primary first, else the first by display order).
+        """
+        images = list(product.images.all())
+        for image in images:
+            if image.is_primary:
+                return image.image.name
+        return images[0].image.name if images else ''
+    
     def get_subtotal(self):
         """Calculate line item subtotal."""
         return self.price_at_purchase * self.quantity
@@ -390,3 +450,533 @@ class ShippingAddress(models.Model):
         if not self.address:
             return _('未提供地址 / No address provided')
         return f"{self.postal_code} {self.city}{self.district}{self.address}"
+
+
+class StockReservation(models.Model):
+    """
+    Stock held for an order between checkout and payment.
+    Stock is decremented when the hold is taken and restored if it is released.
+    """
+    
+    STATUS_CHOICES = [
+        ('held', _('保留中 / Held')),
+        ('committed', _('已確認 / Committed')),
+        ('released', _('已釋放 / Released')),
+    ]
+    
+    order = models.ForeignKey(
+        Order,
+        on_delete=models.CASCADE,
+        related_name='stock_reservations',
+        verbose_name=_('訂單 / Order')
+    )
+    
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        verbose_name=_('商品 / Product')
+    )
+    
+    variant = models.ForeignKey(
+        ProductVariant,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        verbose_name=_('規格 / Variant')
+    )
+    
+    quantity = models.PositiveIntegerField(
+        _('數量 / Quantity')
+    )
+    
+    status = models.CharField(
+        _('狀態 / Status'),
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='held'
+    )
+    
+    expires_at = models.DateTimeField(
+        _('到期時間 / Expires At'),
+        help_text=_('未付款時釋放庫存的時間 / When the hold is released if unpaid')
+    )
+    
+    # Timestamps
+    created_at = models.DateTimeField(
+        _('建立時間 / Created At'),
+        auto_now_add=True
+    )
+    
+    updated_at = models.DateTimeField(
+        _('更新時間 / Updated At'),
+        auto_now=True
+    )
+    
+    class Meta:
+        verbose_name = _('庫存保留 / Stock Reservation')
+        verbose_name_plural = _('庫存保留 / Stock Reservations')
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'expires_at']),
+            models.Index(fields=['order', 'status']),
+        ]
+    
+    def __str__(self):
+        return f"{self.order.order_number} - {self.product_id} x {self.quantity} ({self.status})"
+
+
+class IdempotencyKey(models.Model):
+    """
+    Stored result of a POST made with an idempotency key.
+    Retries with the same key replay the stored response instead of
+    creating another order or payment.
+    """
+    
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='idempotency_keys',
+        verbose_name=_('使用者 / User')
+    )
+    
+    scope = models.CharField(
+        _('範圍 / Scope'),
+        max_length=50,
+        help_text=_('使用此金鑰的端點 / Endpoint the key was used on')
+    )
+    
+    key = models.CharField(
+        _('金鑰 / Key'),
+        max_length=100
+    )
+    
+    request_fingerprint = models.CharField(
+        _('請求指紋 / Request Fingerprint'),
+        max_length=64
+    )
+    
+    # Stored response; status_code stays null while the first request runs
+    status_code = models.PositiveSmallIntegerField(
+        _('回應狀態碼 / Response Status'),
+        null=True,
+        blank=True
+    )
+    
+    content_type = models.CharField(
+        _('內容類型 / Content Type'),
+        max_length=100,
+        blank=True,
+        default=''
+    )
+    
+    location = models.CharField(
+        _('重新導向網址 / Redirect Location'),
+        max_length=500,
+        blank=True,
+        default=''
+    )
+    
+    body = models.TextField(
+        _('回應內容 / Response Body'),
+        blank=True,
+        default=''
+    )
+    
+    expires_at = models.DateTimeField(
+        _('到期時間 / Expires At')
+    )
+    
+    created_at = models.DateTimeField(
+        _('建立時間 / Created At'),
+        auto_now_add=True
+    )
+    
+    class Meta:
+        verbose_name = _('冪等金鑰 / Idempotency Key')
+        verbose_name_plural = _('冪等金鑰 / Idempotency Keys')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'scope', 'key'],
+                name='idempotency_key_unique_per_user_scope',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.scope}:{self.key}"
+    
+    @property
+    def is_complete(self):
+        """Check if the original request has finished and stored its response."""
+        return self.status_code is not None
+
+
+class OrderNumberCounter(models.Model):
+    """
+    Per-day counter behind order numbers.
+    Workers lease blocks of numbers from it, so the row is touched once per
+    block rather than once per order.
+    """
+    
+    day = models.DateField(
+        _('日期 / Day'),
+        primary_key=True
+    )
+    
+    next_value = models.PositiveBigIntegerField(
+        _('下一個序號 / Next Value'),
+        default=1
+    )
+    
+    class Meta:
+        verbose_name = _('訂單編號計數器 / Order Number Counter')
+        verbose_name_plural = _('訂單編號計數器 / Order Number Counters')
+    
+    def __str__(self):
+        return f"{self.day:%Y%m%d} -> {self.next_value}"
+
+
+class OrderSummary(models.Model):
+    """
+    Per-user order totals for the profile page.
+    Maintained incrementally as orders are placed and paid.
+    """
+    
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='order_summary',
+        verbose_name=_('使用者 / User')
+    )
+    
+    order_count = models.PositiveIntegerField(
+        _('訂單數 / Order Count'),
+        default=0
+    )
+    
+    lifetime_spend = models.DecimalField(
+        _('累計消費 / Lifetime Spend'),
+        max_digits=12,
+        decimal_places=2,
+        default=0,
+        help_text=_('已付款訂單總額（新台幣）/ Total of paid orders (NT$)')
+    )
+    
+    last_order_at = models.DateTimeField(
+        _('最近訂單時間 / Last Order At'),
+        null=True,
+        blank=True
+    )
+    
+    updated_at = models.DateTimeField(
+        _('更新時間 / Updated At'),
+        auto_now=True
+    )
+    
+    class Meta:
+        verbose_name = _('訂單統計 / Order Summary')
+        verbose_name_plural = _('訂單統計 / Order Summaries')
+    
+    def __str__(self):
+        return f"{self.user_id}: {self.order_count} orders, NT${self.lifetime_spend}"
+
+
+class OrderEvent(models.Model):
+    """
+    Append-only log of order and payment status changes.
+    """
+    
+    FIELD_CHOICES = [
+        ('status', _('訂單狀態 / Order Status')),
+        ('payment_status', _('付款狀態 / Payment Status')),
+    ]
+    
+    order = models.ForeignKey(
+        Order,
+        on_delete=models.CASCADE,
+        related_name='events',
+        verbose_name=_('訂單 / Order')
+    )
+    
+    field = models.CharField(
+        _('欄位 / Field'),
+        max_length=20,
+        choices=FIELD_CHOICES,
+        default='status'
+    )
+    
+    from_value = models.CharField(
+        _('原狀態 / From'),
+        max_length=20,
+        blank=True,
+        default=''
+    )
+    
+    to_value = models.CharField(
+        _('新狀態 / To'),
+        max_length=20
+    )
+    
+    actor = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name=_('操作者 / Actor')
+    )
+    
+    note = models.CharField(
+        _('備註 / Note'),
+        max_length=255,
+        blank=True,
+        default=''
+    )
+    
+    created_at = models.DateTimeField(
+        _('建立時間 / Created At'),
+        auto_now_add=True
+    )
+    
+    class Meta:
+        verbose_name = _('訂單事件 / Order Event')
+        verbose_name_plural = _('訂單事件 / Order Events')
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['order', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.order_id} {self.field}: {self.from_value or '-'} -> {self.to_value}"
+    
+    def save(self, *args, **kwargs):
+        """Events are append-only."""
+        if self.pk is not None:
+            raise ValueError('Order events are append-only')
+        super().save(*args, **kwargs)
+
+
+class DailySalesRollup(models.Model):
+    """
+    Paid sales per day, category, payment method and shipping method.
+    Rebuilt per day by the rollup_sales command for the sales dashboard.
+    """
+    
+    day = models.DateField(_('日期 / Day'))
+    
+    category = models.ForeignKey(
+        'products.Category',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name=_('分類 / Category')
+    )
+    
+    payment_method = models.CharField(
+        _('付款方式 / Payment Method'),
+        max_length=20,
+        choices=Order.PAYMENT_METHOD_CHOICES,
+        blank=True
+    )
+    
+    shipping_method = models.CharField(
+        _('配送方式 / Shipping Method'),
+        max_length=20,
+        choices=Order.SHIPPING_METHOD_CHOICES,
+        blank=True
+    )
+    
+    order_count = models.PositiveIntegerField(
+        _('訂單數 / Orders'),
+        default=0
+    )
+    
+    quantity = models.PositiveIntegerField(
+        _('售出數量 / Units Sold'),
+        default=0
+    )
+    
+    revenue = models.DecimalField(
+        _('商品營收 / Item Revenue'),
+        max_digits=14,
+        decimal_places=2,
+        default=0,
+        help_text=_('商品小計合計，不含運費與折扣（新台幣）/ Item subtotals excluding shipping and discounts (NT$)')
+    )
+    
+    class Meta:
+        verbose_name = _('每日銷售統計 / Daily Sales Rollup')
+        verbose_name_plural = _('每日銷售統計 / Daily Sales Rollups')
+        ordering = ['-day']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'category', 'payment_method', 'shipping_method'],
+                name='unique_daily_sales_rollup',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.day} {self.category_id} {self.payment_method}/{self.shipping_method}: NT${self.revenue}"
+
+
+class RollupWatermark(models.Model):
+    """
+    How far a rollup job has processed Order.updated_at.
+    """
+    
+    name = models.CharField(
+        _('名稱 / Name'),
+        max_length=50,
+        primary_key=True
+    )
+    
+    value = models.DateTimeField(
+        _('處理至 / Processed Up To')
+    )
+    
+    class Meta:
+        verbose_name = _('統計進度 / Rollup Watermark')
+        verbose_name_plural = _('統計進度 / Rollup Watermarks')
+    
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+
+class ShippingRate(models.Model):
+    """
+    One weight band of a shipping method's price list.
+    Read by orders.shipping, which compiles the active rows into a lookup table.
+    """
+    
+    shipping_method = models.CharField(
+        _('配送方式 / Shipping Method'),
+        max_length=20,
+        choices=Order.SHIPPING_METHOD_CHOICES
+    )
+    
+    max_weight = models.PositiveIntegerField(
+        _('重量上限（公克）/ Max Weight (grams)'),
+        null=True,
+        blank=True,
+        help_text=_('此級距可承運的總重量上限，留空表示不限 / Heaviest parcel in this band; blank for no limit')
+    )
+    
+    fee = models.DecimalField(
+        _('運費 / Fee'),
+        max_digits=8,
+        decimal_places=2,
+        validators=[MinValueValidator(0)],
+        help_text=_('新台幣 / NT$')
+    )
+    
+    free_shipping_threshold = models.DecimalField(
+        _('免運門檻 / Free Shipping Threshold'),
+        max_digits=10,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        help_text=_('商品小計達此金額免運費，留空表示不適用 / Subtotal that ships free; blank for never')
+    )
+    
+    is_active = models.BooleanField(
+        _('啟用 / Active'),
+        default=True
+    )
+    
+    updated_at = models.DateTimeField(
+        _('更新時間 / Updated At'),
+        auto_now=True
+    )
+    
+    class Meta:
+        verbose_name = _('運費規則 / Shipping Rate')
+        verbose_name_plural = _('運費規則 / Shipping Rates')
+        ordering = ['shipping_method', 'max_weight']
+    
+    def __str__(self):
+        limit = f"≤{self.max_weight}g" if self.max_weight is not None else 'any weight'
+        return f"{self.get_shipping_method_display()} {limit}: NT${self.fee}"
+
+
+class PickupStore(models.Model):
+    """
+    Convenience store that accepts pickup parcels, imported from a chain's store list.
+    Searched through the in-memory index in orders.pickup_stores.
+    """
+    
+    CHAIN_CHOICES = [
+        (value, label) for value, label in Order.SHIPPING_METHOD_CHOICES
+        if value != 'home_delivery'
+    ]
+    
+    chain = models.CharField(
+        _('超商 / Chain'),
+        max_length=20,
+        choices=CHAIN_CHOICES
+    )
+    
+    store_id = models.CharField(
+        _('門市代號 / Store ID'),
+        max_length=20
+    )
+    
+    name = models.CharField(
+        _('門市名稱 / Store Name'),
+        max_length=100
+    )
+    
+    address = models.CharField(
+        _('地址 / Address'),
+        max_length=255
+    )
+    
+    city = models.CharField(
+        _('縣市 / City'),
+        max_length=20,
+        blank=True,
+        default=''
+    )
+    
+    district = models.CharField(
+        _('區域 / District'),
+        max_length=20,
+        blank=True,
+        default=''
+    )
+    
+    latitude = models.DecimalField(
+        _('緯度 / Latitude'),
+        max_digits=9,
+        decimal_places=6
+    )
+    
+    longitude = models.DecimalField(
+        _('經度 / Longitude'),
+        max_digits=9,
+        decimal_places=6
+    )
+    
+    is_active = models.BooleanField(
+        _('營業中 / Active'),
+        default=True
+    )
+    
+    updated_at = models.DateTimeField(
+        _('更新時間 / Updated At'),
+        auto_now=True
+    )
+    
+    class Meta:
+        verbose_name = _('取貨門市 / Pickup Store')
+        verbose_name_plural = _('取貨門市 / Pickup Stores')
+        ordering = ['chain', 'store_id']
+        constraints = [
+            models.UniqueConstraint(fields=['chain', 'store_id'], name='unique_pickup_store'),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_chain_display()} {self.name} ({self.store_id})"
@@ -0,0 +1,134 @@
+"""
+Order number generation for Taiwan e-commerce platform.
+訂單編號產生器
+
+Order numbers look like ES-20261019-0001232: the Taiwan-local date, a
+per-day sequence padded to six digits (here 123), and a trailing Luhn check
+digit (here 2).
+
+The sequence comes from OrderNumberCounter. Each worker leases a block of
+ORDER_NUMBER_BLOCK_SIZE values with a single upsert and hands them out from
+memory, so numbers never collide and the counter row is written once per
+block. Numbers are increasing within a worker. Blocks leased by different
+workers interleave, and numbers left in a block when a worker exits are
+skipped.
+"""
+
+import re
+import threading
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, connections, router
+from django.utils import timezone
+
+from .models import OrderNumberCounter
+
+PREFIX = 'ES'
+SEQUENCE_DIGITS = 6
+
+ORDER_NUMBER_RE = re.compile(r'^%s-(\d{8})-(\d{%d,})(\d)$' % (PREFIX, SEQUENCE_DIGITS))
+
+_lock = threading.Lock()
+_block = {'day': None, 'next': 0, 'end': -1}
+
+
+def get_block_size():
+    """Return how many numbers a worker leases at a time."""
+    return max(1, getattr(settings, 'ORDER_NUMBER_BLOCK_SIZE', 20))
+
+
+def luhn_check_digit(digits):
+    """Return the Luhn check digit for a string of digits."""
+    total = 0
+    for i, char in enumerate(reversed(digits)):
+        n = int(char)
+        if i % 2 == 0:
+            n *= 2
+            if n > 9:
+                n -= 9
+        total += n
+    return str((10 - total % 10) % 10)
+
+
+def format_order_number(day, sequence):
+    """Build an order number from a date and sequence value."""
+    body = f"{day:%Y%m%d}{sequence:0{SEQUENCE_DIGITS}d}"
+    return f"{PREFIX}-{body[:8]}-{body[8:]}{luhn_check_digit(body)}"
+
+
+def is_valid_order_number(order_number):
+    """Check an order number's format and check digit (catches typos)."""
+    match = ORDER_NUMBER_RE.match(order_number or '')
+    if not match:
+        return False
+    date_part, sequence, check = match.groups()
+    return luhn_check_digit(date_part + sequence) == check
+
+
+def _upsert(connection, day, size):
+    """Run the counter upsert on connection and return the new next_value."""
+    table = connection.ops.quote_name(OrderNumberCounter._meta.db_table)
+    sql = (
+        f'INSERT INTO {table} (day, next_value) VALUES (%s, %s) '
+        f'ON CONFLICT (day) DO UPDATE SET next_value = {table}.next_value + %s '
+        f'RETURNING next_value'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [connection.ops.adapt_datefield_value(day), size + 1, size])
+        return cursor.fetchone()[0]
+
+
+def lease_block(day, size, using=None):
+    """
+    Reserve the next size sequence values for a day.
+    預留當日接下來的訂單序號區段
+
+    Inside a transaction on PostgreSQL the lease goes through a separate
+    autocommit connection, opened for the lease and closed after it, so it
+    survives a rollback of the order and the rest of the block stays safe
+    to use. A connection lost to a database restart or idle timeout is
+    reopened and the lease retried once.
+
+    Returns:
+        tuple: (first, last) sequence values, inclusive
+    """
+    alias = using or router.db_for_write(OrderNumberCounter)
+    connection = connections[alias]
+    side = connection.in_atomic_block and connection.vendor == 'postgresql'
+    for attempt in range(2):
+        lease_connection = connections.create_connection(alias) if side else connection
+        try:
+            next_value = _upsert(lease_connection, day, size)
+            break
+        except (OperationalError, InterfaceError):
+            # The caller's connection can only be reopened outside a transaction
+            if attempt or (not side and connection.in_atomic_block):
+                raise
+            if not side:
+                connection.close()
+        finally:
+            if side:
+                lease_connection.close()
+    return next_value - size, next_value - 1
+
+
+def next_order_number(using=None):
+    """
+    Return a new, never-reused order number.
+    取得新的訂單編號
+    """
+    day = timezone.localdate()
+    alias = using or router.db_for_write(OrderNumberCounter)
+    connection = connections[alias]
+    with _lock:
+        if _block['day'] != day or _block['next'] > _block['end']:
+            if connection.in_atomic_block and connection.vendor != 'postgresql':
+                # The lease would roll back with the caller's transaction, so
+                # another worker could lease the same values; take one only
+                first, last = lease_block(day, 1, using=alias)
+                return format_order_number(day, first)
+            first, last = lease_block(day, get_block_size(), using=alias)
+            _block.update(day=day, next=first, end=last)
+        sequence = _block['next']
+        _block['next'] += 1
+    return format_order_number(day, sequence)
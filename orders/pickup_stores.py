@@ -0,0 +1,195 @@
+"""
+Convenience-store pickup locator.
+超商取貨門市搜尋
+
+Active PickupStore rows (imported with import_pickup_stores) are loaded
+once per worker into two indexes:
+
+- a per-chain spatial grid of CELL_DEGREES squares. A nearest-store query
+  walks rings of cells outward from the point and stops once no unvisited
+  cell can hold anything closer than the stores already found;
+- an n-gram index (single characters and bigrams) over store name and
+  address. A text query intersects the posting lists of its bigrams and
+  then confirms the substring.
+
+A district query searches from the average position of the stores in that
+district. The index is rebuilt after PICKUP_STORE_INDEX_TTL_SECONDS, or
+straight away in the process that ran an import.
+"""
+
+import math
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+
+from .models import PickupStore
+from .postal_codes import normalize
+
+Store = namedtuple('Store', 'chain store_id name address city district latitude longitude')
+
+CELL_DEGREES = 0.02
+# Narrowest cell side in km across Taiwan's latitudes (longitude shrinks northward)
+CELL_KM = 111.32 * CELL_DEGREES * math.cos(math.radians(26.5))
+EARTH_RADIUS_KM = 6371.0
+
+DEFAULT_LIMIT = 10
+MAX_DISTANCE_KM = 30
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points."""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def _cell(latitude, longitude):
+    return math.floor(latitude / CELL_DEGREES), math.floor(longitude / CELL_DEGREES)
+
+
+def _search_text(text):
+    return normalize(text).lower()
+
+
+def _grams(text):
+    """Single characters and bigrams of a normalized string."""
+    return set(text) | {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class StoreIndex:
+    """Spatial grid and n-gram index over pickup stores."""
+
+    def __init__(self, stores):
+        self.stores = list(stores)
+        self.by_id = {(s.chain, s.store_id): s for s in self.stores}
+        self.texts = [_search_text(s.name + s.address) for s in self.stores]
+        self.grid = {}
+        self.postings = {}
+        district_points = {}
+        for i, store in enumerate(self.stores):
+            cells = self.grid.setdefault(store.chain, {})
+            cells.setdefault(_cell(store.latitude, store.longitude), []).append(i)
+            for gram in _grams(self.texts[i]):
+                self.postings.setdefault(gram, []).append(i)
+            key = (normalize(store.city), normalize(store.district))
+            district_points.setdefault(key, []).append((store.latitude, store.longitude))
+        self.district_centers = {
+            key: (sum(p[0] for p in points) / len(points), sum(p[1] for p in points) / len(points))
+            for key, points in district_points.items()
+        }
+
+    def get(self, chain, store_id):
+        return self.by_id.get((chain, store_id))
+
+    def nearest(self, chain, latitude, longitude, limit=DEFAULT_LIMIT, max_km=MAX_DISTANCE_KM):
+        """
+        Return up to limit (store, km) pairs of one chain, closest first.
+        """
+        cells = self.grid.get(chain)
+        if not cells or limit < 1:
+            return []
+        cx, cy = _cell(latitude, longitude)
+        found = []
+        max_ring = math.ceil(max_km / CELL_KM) + 1
+        for ring in range(max_ring + 1):
+            for x in range(cx - ring, cx + ring + 1):
+                # Only the ring's border cells; the inside was visited already
+                step = 1 if abs(x - cx) == ring else 2 * ring
+                for y in range(cy - ring, cy + ring + 1, max(step, 1)):
+                    for i in cells.get((x, y), ()):
+                        store = self.stores[i]
+                        km = distance_km(latitude, longitude, store.latitude, store.longitude)
+                        if km <= max_km:
+                            found.append((km, i))
+            found.sort()
+            del found[limit:]
+            # Cells beyond this ring are at least ring cell widths away
+            if len(found) == limit and found[-1][0] <= ring * CELL_KM:
+                break
+        return [(self.stores[i], km) for km, i in found]
+
+    def near_district(self, chain, city, district, limit=DEFAULT_LIMIT):
+        """Return the stores of a chain nearest a district's centre."""
+        center = self.district_centers.get((normalize(city), normalize(district)))
+        if center is None:
+            return []
+        return self.nearest(chain, center[0], center[1], limit=limit)
+
+    def search(self, query, chain=None, limit=DEFAULT_LIMIT):
+        """Return up to limit stores whose name or address contains query."""
+        query = _search_text(query)
+        if not query:
+            return []
+        grams = [query] if len(query) == 1 else [query[i:i + 2] for i in range(len(query) - 1)]
+        lists = sorted((self.postings.get(gram, []) for gram in grams), key=len)
+        candidates = set(lists[0])
+        for postings in lists[1:]:
+            candidates.intersection_update(postings)
+            if not candidates:
+                return []
+        results = []
+        for i in sorted(candidates):
+            store = self.stores[i]
+            if (chain is None or store.chain == chain) and query in self.texts[i]:
+                results.append(store)
+                if len(results) == limit:
+                    break
+        return results
+
+
+_lock = threading.Lock()
+_state = {'index': None, 'loaded_at': 0.0}
+
+
+def get_index_ttl():
+    """Return how long a worker uses its store index before reloading."""
+    return getattr(settings, 'PICKUP_STORE_INDEX_TTL_SECONDS', 600)
+
+
+def load_store_index():
+    """Build a StoreIndex from the active PickupStore rows."""
+    rows = PickupStore.objects.filter(is_active=True).values_list(
+        'chain', 'store_id', 'name', 'address', 'city', 'district', 'latitude', 'longitude'
+    )
+    return StoreIndex(
+        Store(chain, store_id, name, address, city, district, float(lat), float(lng))
+        for chain, store_id, name, address, city, district, lat, lng in rows.iterator(chunk_size=2000)
+    )
+
+
+def get_store_index():
+    """Return this worker's store index, loading it on first use or when stale."""
+    with _lock:
+        index = _state['index']
+        if index is None or time.monotonic() - _state['loaded_at'] > get_index_ttl():
+            index = load_store_index()
+            _state.update(index=index, loaded_at=time.monotonic())
+        return index
+
+
+def invalidate_store_index():
+    """Drop the index so the next search reloads it."""
+    with _lock:
+        _state['index'] = None
+
+
+def serialize_store(store, km=None):
+    """Return a store as a JSON-ready dict."""
+    data = {
+        'chain': store.chain,
+        'store_id': store.store_id,
+        'name': store.name,
+        'address': store.address,
+        'city': store.city,
+        'district': store.district,
+        'latitude': store.latitude,
+        'longitude': store.longitude,
+    }
+    if km is not None:
+        data['distance_km'] = round(km, 2)
+    return data
@@ -0,0 +1,114 @@
+"""
+Offline Taiwan postal code index for checkout autofill and validation.
+臺灣郵遞區號離線索引
+
+The bundled data/tw_postal_codes.csv lists every 3-digit postal code with
+its city and district. Longer 3+2 and 3+3 codes start with that 3-digit
+district code, so they are checked by their first three digits. The file
+is loaded once per worker into:
+
+- a dict from (city, district) to postal code, for O(1) validation;
+- sorted arrays of postal codes and of city + district names, searched
+  with bisect for prefix autocomplete.
+
+City and district names are normalized before lookup, so 台北市 matches
+臺北市 and spaces are ignored.
+"""
+
+import csv
+import os
+import threading
+from bisect import bisect_left
+from collections import namedtuple
+
+DATA_FILE = os.path.join(os.path.dirname(__file__), 'data', 'tw_postal_codes.csv')
+
+District = namedtuple('District', 'postal_code city district')
+
+DEFAULT_LIMIT = 10
+
+
+def normalize(name):
+    """Normalize a city or district name for lookup."""
+    return ''.join((name or '').split()).replace('台', '臺')
+
+
+class PostalCodeIndex:
+    """Compact lookup structures over the postal code table."""
+
+    def __init__(self, rows):
+        self.districts = sorted(District(*row) for row in rows)
+        self.by_name = {
+            (normalize(d.city), normalize(d.district)): d for d in self.districts
+        }
+        # Parallel sorted arrays: search keys and positions in self.districts
+        self.codes = [d.postal_code for d in self.districts]
+        # Full names and district names alone, so 中正 finds 臺北市中正區 and 基隆市中正區
+        names = sorted(
+            [(normalize(d.city + d.district), i) for i, d in enumerate(self.districts)]
+            + [(normalize(d.district), i) for i, d in enumerate(self.districts)]
+        )
+        self.name_keys = [key for key, _i in names]
+        self.name_rows = [i for _key, i in names]
+
+    def lookup(self, city, district):
+        """Return the District for a city and district, or None."""
+        return self.by_name.get((normalize(city), normalize(district)))
+
+    def districts_for_code(self, postal_code):
+        """Return the districts a postal code (3, 5 or 6 digits) belongs to."""
+        prefix = (postal_code or '')[:3]
+        if len(prefix) < 3:
+            return []
+        start = bisect_left(self.codes, prefix)
+        matches = []
+        while start < len(self.codes) and self.codes[start] == prefix:
+            matches.append(self.districts[start])
+            start += 1
+        return matches
+
+    def is_valid(self, postal_code, city, district):
+        """Return True if postal_code belongs to city and district."""
+        match = self.lookup(city, district)
+        return match is not None and (postal_code or '')[:3] == match.postal_code
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """
+        Autocomplete a postal code prefix or a city/district name prefix.
+        Returns up to limit Districts in table order.
+        """
+        query = normalize(query)
+        if not query:
+            return []
+        if query.isdigit():
+            prefix = query[:3]
+            start = bisect_left(self.codes, prefix)
+            end = bisect_left(self.codes, prefix + '\uffff', lo=start)
+            return self.districts[start:min(end, start + limit)]
+
+        start = bisect_left(self.name_keys, query)
+        end = bisect_left(self.name_keys, query + '\uffff', lo=start)
+        rows = sorted(set(self.name_rows[start:end]))[:limit]
+        return [self.districts[i] for i in rows]
+
+
+_lock = threading.Lock()
+_index = None
+
+
+def load_index(path=DATA_FILE):
+    """Read the bundled postal code file into a PostalCodeIndex."""
+    with open(path, encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        next(reader)  # header
+        return PostalCodeIndex(reader)
+
+
+def get_index():
+    """Return this worker's postal code index, loading it on first use."""
+    global _index
+    if _index is None:
+        with _lock:
+            if _index is None:
+                _index = load_index()
+    return _index
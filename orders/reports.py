@@ -0,0 +1,172 @@
+"""
+Daily sales rollups for the admin sales dashboard.
+每日銷售統計
+
+DailySalesRollup holds paid item revenue per local day, category, payment
+method and shipping method. rollup_sales reads only the orders whose
+updated_at moved past the stored watermark, and rebuilds each day those
+orders were placed on, so a refund or cancellation corrects the day it
+belongs to. The dashboard queries the rollups, never the order tables.
+"""
+
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Max, Sum
+from django.utils import timezone
+
+from .history import SPEND_STATUSES
+from .models import DailySalesRollup, Order, OrderItem, RollupWatermark
+
+WATERMARK_NAME = 'daily_sales'
+
+# Order statuses that take an order out of sales even if it was paid
+EXCLUDED_STATUSES = ('cancelled', 'refunded')
+
+# Days shown in the dashboard's revenue-by-day chart
+DASHBOARD_DAYS = 31
+
+
+def get_rollup_lag():
+    """
+    Return how far behind now the watermark stays.
+
+    Orders are only rolled up once their updated_at is this old, so a
+    transaction that stamped updated_at but had not committed yet when the
+    job ran is still picked up next time.
+    """
+    return timedelta(seconds=getattr(settings, 'SALES_ROLLUP_LAG_SECONDS', 120))
+
+
+def _day_bounds(day):
+    """Return the aware [start, end) range of a local calendar day."""
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+
+
+def sales_orders():
+    """Return the orders that count as sales."""
+    return Order.objects.filter(payment_status__in=SPEND_STATUSES).exclude(status__in=EXCLUDED_STATUSES)
+
+
+def rebuild_day(day):
+    """
+    Replace one day's rollup rows with freshly aggregated ones.
+    重新計算單日銷售統計
+
+    Returns:
+        int: Number of rollup rows written
+    """
+    start, end = _day_bounds(day)
+    subtotal = ExpressionWrapper(
+        F('price_at_purchase') * F('quantity'),
+        output_field=DecimalField(max_digits=14, decimal_places=2),
+    )
+    rows = (
+        OrderItem.objects.filter(
+            order__in=sales_orders().filter(created_at__gte=start, created_at__lt=end)
+        )
+        .values('product__category', 'order__payment_method', 'order__shipping_method')
+        .annotate(
+            order_count=Count('order', distinct=True),
+            units=Sum('quantity'),
+            revenue=Sum(subtotal),
+        )
+        .order_by()
+    )
+    rollups = [
+        DailySalesRollup(
+            day=day,
+            category_id=row['product__category'],
+            payment_method=row['order__payment_method'],
+            shipping_method=row['order__shipping_method'],
+            order_count=row['order_count'],
+            quantity=row['units'] or 0,
+            revenue=row['revenue'] or 0,
+        )
+        for row in rows
+    ]
+    with transaction.atomic():
+        DailySalesRollup.objects.filter(day=day).delete()
+        DailySalesRollup.objects.bulk_create(rollups)
+    return len(rollups)
+
+
+def update_sales_rollups(now=None):
+    """
+    Roll up every order changed since the last run.
+    依上次進度增量更新銷售統計
+
+    Returns:
+        tuple: (days rebuilt, rollup rows written)
+    """
+    cutoff = (now or timezone.now()) - get_rollup_lag()
+    watermark = RollupWatermark.objects.filter(name=WATERMARK_NAME).first()
+
+    changed = Order.objects.filter(updated_at__lte=cutoff)
+    if watermark is not None:
+        if watermark.value >= cutoff:
+            return 0, 0
+        changed = changed.filter(updated_at__gt=watermark.value)
+
+    # Distinct local days, in one query
+    days = list(changed.dates('created_at', 'day'))
+    rows = sum(rebuild_day(day) for day in days)
+
+    RollupWatermark.objects.update_or_create(name=WATERMARK_NAME, defaults={'value': cutoff})
+    return len(days), rows
+
+
+def get_sales_dashboard(queryset):
+    """
+    Aggregate rollup rows for the dashboard charts.
+    彙整銷售儀表板圖表資料
+
+    Args:
+        queryset: DailySalesRollup rows to chart (e.g. the filtered changelist)
+
+    Returns:
+        dict: Totals plus by_day, by_category, by_payment and by_shipping lists,
+        each row carrying a share (0-100) of the largest value for bar widths
+    """
+    queryset = queryset.order_by()
+    totals = queryset.aggregate(revenue=Sum('revenue'), quantity=Sum('quantity'), last_day=Max('day'))
+
+    last_day = totals['last_day']
+    by_day = []
+    if last_day is not None:
+        by_day = list(
+            queryset.filter(day__gt=last_day - timedelta(days=DASHBOARD_DAYS))
+            .values('day').annotate(total=Sum('revenue')).order_by('day')
+        )
+
+    by_category = list(
+        queryset.values('category__name')
+        .annotate(total=Sum('revenue'), orders=Sum('order_count'))
+        .order_by('-total')
+    )
+    payment_labels = dict(Order.PAYMENT_METHOD_CHOICES)
+    by_payment = [
+        dict(row, label=payment_labels.get(row['payment_method'], row['payment_method']))
+        for row in queryset.values('payment_method').annotate(total=Sum('revenue')).order_by('-total')
+    ]
+    shipping_labels = dict(Order.SHIPPING_METHOD_CHOICES)
+    by_shipping = [
+        dict(row, label=shipping_labels.get(row['shipping_method'], row['shipping_method']))
+        for row in queryset.values('shipping_method').annotate(total=Sum('revenue')).order_by('-total')
+    ]
+
+    for rows in (by_day, by_category, by_payment, by_shipping):
+        peak = max((row['total'] or 0 for row in rows), default=0)
+        for row in rows:
+            row['share'] = round(100 * (row['total'] or 0) / peak, 1) if peak else 0
+
+    return {
+        'revenue': totals['revenue'] or 0,
+        'quantity': totals['quantity'] or 0,
+        'by_day': by_day,
+        'by_category': by_category,
+        'by_payment': by_payment,
+        'by_shipping': by_shipping,
+    }
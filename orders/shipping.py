@@ -0,0 +1,165 @@
+"""
+Shipping fee engine for Taiwan e-commerce platform.
+運費計算引擎
+
+Prices come from the ShippingRate table: per shipping method, a list of
+weight bands, each with a fee and an optional free-shipping threshold. The
+active rows are compiled once per process into sorted band bounds per method
+and looked up with bisect. A cart is priced for every method from a single
+pass over its lines (subtotal and total weight).
+
+The compiled table is rebuilt when a rate is saved or deleted in this
+process, and at least every SHIPPING_RATES_TTL_SECONDS so changes made
+elsewhere are picked up. Product.weight is in grams; products without a
+weight count as weightless.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from collections import namedtuple
+from decimal import Decimal
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+
+from .models import Order, ShippingRate
+
+# A method's price for one cart; fee is None when the method cannot carry it
+Quote = namedtuple('Quote', 'method label fee free_shipping_threshold remaining')
+
+# Used only if the ShippingRate table has no active rows at all:
+# (method, max weight in grams or None, fee, free shipping threshold or None)
+DEFAULT_RATES = (
+    ('home_delivery', 10000, Decimal('60'), Decimal('1500')),
+    ('home_delivery', 20000, Decimal('120'), Decimal('3000')),
+    ('home_delivery', None, Decimal('200'), None),
+    ('seven_eleven', 5000, Decimal('60'), Decimal('1500')),
+    ('family_mart', 5000, Decimal('60'), Decimal('1500')),
+    ('hi_life', 5000, Decimal('60'), Decimal('1500')),
+    ('ok_mart', 5000, Decimal('60'), Decimal('1500')),
+)
+
+UNLIMITED = float('inf')
+
+
+class ShippingUnavailableError(Exception):
+    """Raised when a shipping method cannot carry a cart."""
+
+    def __init__(self, method):
+        self.method = method
+        super().__init__(
+            _('此配送方式無法寄送購物車內容（可能超過重量限制）/ This shipping method cannot carry your cart (it may be over the weight limit)')
+        )
+
+
+class RateTable:
+    """Shipping rates compiled for fast lookup."""
+
+    def __init__(self, rates):
+        bands = {}
+        for method, max_weight, fee, threshold in rates:
+            bands.setdefault(method, []).append(
+                (UNLIMITED if max_weight is None else max_weight, Decimal(fee), threshold)
+            )
+        self.methods = {}
+        for method, rows in bands.items():
+            rows.sort(key=lambda row: row[0])
+            self.methods[method] = ([row[0] for row in rows], [row[1:] for row in rows])
+        labels = dict(Order.SHIPPING_METHOD_CHOICES)
+        # Quote methods in the order customers see them
+        self.order = [method for method in labels if method in self.methods]
+        self.labels = labels
+
+    def quote(self, method, subtotal, weight):
+        """Price one method for a cart's subtotal and weight (grams)."""
+        label = self.labels.get(method, method)
+        if method not in self.methods:
+            return Quote(method, label, None, None, 0)
+        bounds, bands = self.methods[method]
+        index = bisect_left(bounds, weight)
+        if index == len(bounds):
+            return Quote(method, label, None, None, 0)
+        fee, threshold = bands[index]
+        if threshold is not None and subtotal >= threshold:
+            return Quote(method, label, Decimal('0'), threshold, 0)
+        remaining = threshold - subtotal if threshold is not None else 0
+        return Quote(method, label, fee, threshold, remaining)
+
+    def quote_all(self, subtotal, weight):
+        """Price every method; returns {method: Quote} in display order."""
+        return {method: self.quote(method, subtotal, weight) for method in self.order}
+
+
+_lock = threading.Lock()
+_state = {'table': None, 'loaded_at': 0.0}
+
+
+def get_rates_ttl():
+    """Return how long a compiled rate table is used before reloading."""
+    return getattr(settings, 'SHIPPING_RATES_TTL_SECONDS', 300)
+
+
+def load_rate_table():
+    """Compile the active ShippingRate rows (or DEFAULT_RATES if there are none)."""
+    rates = list(
+        ShippingRate.objects.filter(is_active=True)
+        .values_list('shipping_method', 'max_weight', 'fee', 'free_shipping_threshold')
+    )
+    return RateTable(rates or DEFAULT_RATES)
+
+
+def get_rate_table():
+    """Return the compiled rate table, loading it on first use or when stale."""
+    with _lock:
+        table = _state['table']
+        if table is None or time.monotonic() - _state['loaded_at'] > get_rates_ttl():
+            table = load_rate_table()
+            _state.update(table=table, loaded_at=time.monotonic())
+        return table
+
+
+def invalidate_rate_table():
+    """Drop the compiled table so the next quote reloads it."""
+    with _lock:
+        _state['table'] = None
+
+
+def cart_totals(cart_items):
+    """
+    Return (subtotal, weight in grams) for cart lines in one pass.
+    Lines need their product loaded (select_related) to avoid a query each.
+    """
+    subtotal = Decimal('0')
+    weight = Decimal('0')
+    for item in cart_items:
+        subtotal += item.get_total_price()
+        weight += (item.product.weight or 0) * item.quantity
+    return subtotal, weight
+
+
+def quote_cart(cart_items):
+    """
+    Quote every shipping method for a cart.
+    計算購物車各配送方式的運費
+
+    Returns:
+        tuple: (subtotal, {method: Quote})
+    """
+    subtotal, weight = cart_totals(cart_items)
+    return subtotal, get_rate_table().quote_all(subtotal, weight)
+
+
+def get_shipping_fee(cart_items, method):
+    """
+    Return (subtotal, fee) for shipping a cart with method.
+    取得指定配送方式的運費
+
+    Raises:
+        ShippingUnavailableError: If the method cannot carry the cart
+    """
+    subtotal, weight = cart_totals(cart_items)
+    quote = get_rate_table().quote(method, subtotal, weight)
+    if quote.fee is None:
+        raise ShippingUnavailableError(method)
+    return subtotal, quote.fee
@@ -0,0 +1,118 @@
+"""
+Signal handlers for the orders app.
+"""
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .history import SPEND_STATUSES, rebuild_order_summary
+from .models import Order, OrderEvent, OrderSummary, PickupStore, ShippingRate
+from .pickup_stores import invalidate_store_index
+from .shipping import invalidate_rate_table
+
+# Fields whose changes are written to the OrderEvent log
+TRACKED_FIELDS = ('status', 'payment_status')
+
+
+@receiver(pre_save, sender=Order)
+def remember_statuses(sender, instance, update_fields=None, **kwargs):
+    """
+    Load the stored statuses before an order save so a change can be detected.
+    儲存前記錄原訂單與付款狀態以偵測變動
+    """
+    instance._previous_status = None
+    instance._previous_payment_status = None
+    if instance.pk is None:
+        return
+    fields = [
+        field for field in TRACKED_FIELDS
+        if update_fields is None or field in update_fields
+    ]
+    if not fields:
+        return
+    previous = sender.objects.filter(pk=instance.pk).values(*fields).first() or {}
+    instance._previous_status = previous.get('status')
+    instance._previous_payment_status = previous.get('payment_status')
+
+
+@receiver(post_save, sender=Order)
+def log_status_changes(sender, instance, created, **kwargs):
+    """
+    Append an OrderEvent for each status change made through save().
+    記錄透過 save() 進行的狀態變更
+    """
+    if created:
+        events = [OrderEvent(order=instance, field='status', to_value=instance.status)]
+    else:
+        events = [
+            OrderEvent(
+                order=instance, field=field, from_value=previous,
+                to_value=getattr(instance, field),
+            )
+            for field, previous in (
+                ('status', getattr(instance, '_previous_status', None)),
+                ('payment_status', getattr(instance, '_previous_payment_status', None)),
+            )
+            if previous is not None and previous != getattr(instance, field)
+        ]
+    if events:
+        OrderEvent.objects.bulk_create(events)
+
+
+@receiver(post_save, sender=Order)
+def update_order_summary(sender, instance, created, **kwargs):
+    """
+    Keep the owner's OrderSummary in step with new and newly paid orders.
+    新訂單或付款狀態變動時更新使用者訂單統計
+    """
+    if instance.user_id is None:
+        return
+    
+    changes = {}
+    if created:
+        changes['order_count'] = F('order_count') + 1
+        # SQLite's MAX() returns NULL if any argument is NULL
+        changes['last_order_at'] = Greatest(
+            Coalesce(F('last_order_at'), instance.created_at), instance.created_at
+        )
+    
+    previous = getattr(instance, '_previous_payment_status', None)
+    was_counted = previous in SPEND_STATUSES
+    is_counted = instance.payment_status in SPEND_STATUSES
+    if not created and previous is not None and was_counted != is_counted:
+        delta = instance.total_amount if is_counted else -instance.total_amount
+        changes['lifetime_spend'] = F('lifetime_spend') + delta
+    elif created and is_counted:
+        changes['lifetime_spend'] = F('lifetime_spend') + instance.total_amount
+    
+    if not changes:
+        return
+    
+    user_id = instance.user_id
+    if not OrderSummary.objects.filter(user_id=user_id).update(**changes):
+        # No summary yet (new customer, or orders placed before summaries
+        # existed); build it from scratch, which already includes this order
+        rebuild_order_summary(user_id)
+
+
+@receiver(post_save, sender=ShippingRate)
+@receiver(post_delete, sender=ShippingRate)
+def reload_shipping_rates(sender, **kwargs):
+    """
+    Recompile the shipping rate table after a rate changes.
+    運費規則變動後重新載入
+    """
+    transaction.on_commit(invalidate_rate_table)
+
+
+@receiver(post_save, sender=PickupStore)
+@receiver(post_delete, sender=PickupStore)
+def reload_pickup_stores(sender, **kwargs):
+    """
+    Rebuild the pickup store index after a store is edited.
+    門市資料變動後重建索引
+    """
+    transaction.on_commit(invalidate_store_index)
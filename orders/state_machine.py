@@ -0,0 +1,128 @@
+"""
+Order state machine for Taiwan e-commerce platform.
+訂單狀態機
+
+Defines which status changes are allowed and applies them in bulk. Each
+transition runs one conditional UPDATE per source status
+(... WHERE status = <source>), so an order that moved on concurrently is
+skipped instead of overwritten, and every change is written to the
+append-only OrderEvent log.
+
+Only changes made through transition_orders are checked against
+TRANSITIONS. Changes made through Order.save() (admin edit form, payment
+callbacks) and payment status changes are not checked; the signal
+handlers in orders/signals.py log them.
+"""
+
+from django.db import connections, router, transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from .models import Order, OrderEvent
+
+# Allowed order status transitions: source -> targets
+TRANSITIONS = {
+    'pending': ('processing', 'cancelled'),
+    'processing': ('shipped', 'cancelled'),
+    'shipped': ('delivered',),
+    'delivered': ('refunded',),
+    'cancelled': (),
+    'refunded': (),
+}
+
+
+class InvalidTransitionError(Exception):
+    """Raised when an order cannot move to the requested status."""
+
+    def __init__(self, from_status, to_status):
+        self.from_status = from_status
+        self.to_status = to_status
+        super().__init__(
+            _('不允許的狀態變更 / Invalid status transition: %(from)s -> %(to)s')
+            % {'from': from_status, 'to': to_status}
+        )
+
+
+def sources_for(to_status):
+    """Return the statuses an order may move to to_status from."""
+    return [source for source, targets in TRANSITIONS.items() if to_status in targets]
+
+
+def _update_returning(queryset, source, to_status, now):
+    """
+    Move orders in queryset that are still in source to to_status.
+    Returns the ids that changed, using a single UPDATE ... RETURNING.
+    """
+    alias = router.db_for_write(Order)
+    connection = connections[alias]
+    table = connection.ops.quote_name(Order._meta.db_table)
+    subquery, params = queryset.order_by().values('pk').query.sql_with_params()
+    sql = (
+        f'UPDATE {table} SET status = %s, updated_at = %s '
+        f'WHERE status = %s AND id IN ({subquery}) RETURNING id'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [to_status, connection.ops.adapt_datetimefield_value(now), source, *params])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def transition_orders(queryset, to_status, actor=None, note=''):
+    """
+    Move every order in queryset that is allowed to reach to_status.
+    批次變更訂單狀態
+
+    Orders whose current status does not allow the change are left alone
+    and counted as skipped. Cancelling releases the orders' stock holds.
+
+    Args:
+        queryset: Orders to change
+        to_status: Target status
+        actor: User making the change (optional)
+        note: Short note stored on each event
+
+    Returns:
+        tuple: (changed, skipped) order counts
+    """
+    if to_status not in TRANSITIONS:
+        raise ValueError(f'Unknown order status: {to_status}')
+
+    total = queryset.count()
+    now = timezone.now()
+    changed = []
+    events = []
+    with transaction.atomic():
+        for source in sources_for(to_status):
+            ids = _update_returning(queryset, source, to_status, now)
+            changed.extend(ids)
+            events.extend(
+                OrderEvent(
+                    order_id=order_id, field='status', from_value=source, to_value=to_status,
+                    actor=actor, note=note[:255],
+                )
+                for order_id in ids
+            )
+        OrderEvent.objects.bulk_create(events)
+
+        if to_status == 'cancelled' and changed:
+            from .inventory import release_reservations_for_orders
+            release_reservations_for_orders(changed)
+
+    return len(changed), total - len(changed)
+
+
+def transition_order(order, to_status, actor=None, note=''):
+    """
+    Move a single order to to_status.
+    變更單筆訂單狀態
+
+    Raises:
+        InvalidTransitionError: If the order's stored status does not allow it
+    """
+    changed, _skipped = transition_orders(
+        Order.objects.filter(pk=order.pk), to_status, actor=actor, note=note
+    )
+    if not changed:
+        current = Order.objects.filter(pk=order.pk).values_list('status', flat=True).first()
+        raise InvalidTransitionError(current, to_status)
+    order.status = to_status
+    return order
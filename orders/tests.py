@@ -1,3 +1,717 @@
-from django.test import TestCase
+"""
+Tests for order creation, checkout and inventory.
+"""
 
-# Create your tests here.
+import gzip
+import json
+import os
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import skipUnless
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from cart.models import Cart, CartItem
+from products.models import Category, Product, ProductImage, ProductVariant
+from .inventory import (
+    InsufficientStockError, commit_reservations, release_expired_reservations,
+    release_reservations, reserve_stock,
+)
+from .archiving import ARCHIVE_SPECS, archive_model, export_table
+from .forms import CheckoutForm
+from .history import get_order_page, get_order_summary
+from .idempotency import purge_expired_keys
+from .numbering import format_order_number, is_valid_order_number, lease_block, next_order_number
+from .pickup_stores import get_store_index, invalidate_store_index
+from .postal_codes import get_index
+from .models import (
+    DailySalesRollup, IdempotencyKey, Order, OrderEvent, OrderItem, OrderSummary, PickupStore,
+    ShippingRate, StockReservation,
+)
+from .reports import update_sales_rollups
+from .shipping import ShippingUnavailableError, get_rate_table, invalidate_rate_table, quote_cart
+from .state_machine import InvalidTransitionError, transition_order, transition_orders
+from .views import create_order_from_cart
+
+
+class OrderTestMixin:
+    """Shared fixtures for order tests."""
+
+    def create_user(self, email='buyer@example.com'):
+        return get_user_model().objects.create_user(
+            email=email, password='testpass123', is_active=True
+        )
+
+    def create_product(self, sku='ANGUS-001', stock=10, price='1200.00', **kwargs):
+        category, _ = Category.objects.get_or_create(name='牛肉', slug='beef')
+        return Product.objects.create(
+            name=kwargs.pop('name', f'安格斯 {sku}'),
+            slug=sku.lower(),
+            sku=sku,
+            category=category,
+            description='測試商品',
+            price=Decimal(price),
+            stock=stock,
+            status='active',
+            **kwargs
+        )
+
+    def checkout_data(self, **overrides):
+        data = {
+            'recipient_name': '王小明',
+            'recipient_phone': '0912-345-678',
+            'postal_code': '100',
+            'city': '台北市',
+            'district': '中正區',
+            'address': '重慶南路一段122號',
+            'shipping_method': 'home_delivery',
+            'payment_method': 'credit_card',
+        }
+        data.update(overrides)
+        return data
+
+
+class StockReservationTest(OrderTestMixin, TestCase):
+    """Test conditional stock decrements and reservation lifecycle."""
+
+    def setUp(self):
+        self.user = self.create_user()
+        self.product = self.create_product(stock=5)
+        self.variant = ProductVariant.objects.create(
+            product=self.product, name='1kg', sku='ANGUS-001-1KG', stock=2
+        )
+        self.order = Order.objects.create(user=self.user)
+
+    def stock(self):
+        self.product.refresh_from_db()
+        self.variant.refresh_from_db()
+        return self.product.stock, self.variant.stock
+
+    def test_reserve_decrements_product_and_variant_stock(self):
+        reserve_stock(self.order, [(self.product.pk, None, 3), (self.product.pk, self.variant.pk, 2)])
+        self.assertEqual(self.stock(), (2, 0))
+        self.assertEqual(self.order.stock_reservations.filter(status='held').count(), 2)
+
+    def test_reserve_rejects_oversell(self):
+        with self.assertRaises(InsufficientStockError):
+            reserve_stock(self.order, [(self.product.pk, self.variant.pk, 3)])
+        self.assertEqual(self.stock(), (5, 2))
+
+    def test_release_restores_stock_once(self):
+        reserve_stock(self.order, [(self.product.pk, None, 3)])
+        self.assertEqual(release_reservations(self.order), 1)
+        self.assertEqual(release_reservations(self.order), 0)
+        self.assertEqual(self.stock(), (5, 2))
+
+    def test_commit_keeps_stock_taken(self):
+        reserve_stock(self.order, [(self.product.pk, None, 3)])
+        commit_reservations(self.order)
+        self.assertEqual(release_reservations(self.order), 0)
+        self.assertEqual(self.stock(), (2, 2))
+
+    def test_commit_after_expiry_retakes_stock(self):
+        reserve_stock(self.order, [(self.product.pk, None, 3)], ttl=timedelta(seconds=-1))
+        release_expired_reservations()
+        self.assertEqual(self.stock(), (5, 2))
+        commit_reservations(self.order)
+        self.assertEqual(self.stock(), (2, 2))
+        self.assertEqual(self.order.stock_reservations.get().status, 'committed')
+
+    def test_sweeper_releases_only_expired_holds(self):
+        other = Order.objects.create(user=self.user)
+        reserve_stock(self.order, [(self.product.pk, None, 1)], ttl=timedelta(seconds=-1))
+        reserve_stock(other, [(self.product.pk, None, 1)])
+
+        out = StringIO()
+        call_command('release_expired_reservations', '--batch-size=1', stdout=out)
+
+        self.assertIn('Released 1 expired reservations', out.getvalue())
+        self.assertEqual(self.stock(), (4, 2))
+        self.assertEqual(other.stock_reservations.get().status, 'held')
+
+
+class CreateOrderFromCartTest(OrderTestMixin, TestCase):
+    """Test order creation from cart contents."""
+
+    def setUp(self):
+        self.user = self.create_user()
+        self.product = self.create_product(stock=3)
+        self.cart = Cart.objects.create(user=self.user)
+        CartItem.objects.add_quantity(self.cart, self.product, None, 2)
+
+    def test_order_reserves_stock(self):
+        order = create_order_from_cart(self.cart, self.checkout_data(), self.user)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 1)
+        self.assertEqual(order.stock_reservations.get().quantity, 2)
+
+    def test_oversold_cart_rolls_back_order(self):
+        Product.objects.filter(pk=self.product.pk).update(stock=1)
+        with self.assertRaises(InsufficientStockError):
+            create_order_from_cart(self.cart, self.checkout_data(), self.user)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_order_lines_are_bulk_inserted(self):
+        def queries_for(line_count):
+            cart = Cart.objects.create(user=self.create_user(f'bulk{line_count}@example.com'))
+            for i in range(line_count):
+                product = self.create_product(sku=f'BULK-{line_count}-{i}')
+                CartItem.objects.add_quantity(cart, product, None, 1)
+            with CaptureQueriesContext(connection) as context:
+                create_order_from_cart(cart, self.checkout_data(), cart.user)
+            return len(context.captured_queries)
+        
+        # Each extra line adds exactly one query: its conditional stock decrement
+        self.assertEqual(queries_for(6) - queries_for(1), 5)
+
+
+class CheckoutViewTest(OrderTestMixin, TestCase):
+    """Test the checkout page and its single-pass validation."""
+
+    def setUp(self):
+        self.user = self.create_user()
+        self.client.force_login(self.user)
+        self.cart = Cart.objects.create(user=self.user)
+        self.products = [self.create_product(sku=f'CHECKOUT-{i}', stock=2) for i in range(3)]
+        for product in self.products:
+            CartItem.objects.add_quantity(self.cart, product, None, 1)
+
+    def test_checkout_creates_order_and_clears_cart(self):
+        response = self.client.post(reverse('orders:checkout'), self.checkout_data())
+        order = Order.objects.get(user=self.user)
+        self.assertRedirects(
+            response, reverse('payments:initiate', args=[order.id]), fetch_redirect_response=False
+        )
+        self.assertEqual(order.items.count(), 3)
+        self.assertEqual(order.subtotal, Decimal('3600.00'))
+        self.assertFalse(self.cart.items.exists())
+
+    def test_out_of_stock_line_redirects_to_cart(self):
+        Product.objects.filter(pk=self.products[1].pk).update(stock=0)
+        response = self.client.post(reverse('orders:checkout'), self.checkout_data())
+        self.assertRedirects(response, reverse('cart:cart'), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+
+    def test_retried_checkout_replays_first_response(self):
+        data = self.checkout_data(idempotency_key='checkout-key-1')
+        first = self.client.post(reverse('orders:checkout'), data)
+        retry = self.client.post(reverse('orders:checkout'), data)
+
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(retry.status_code, first.status_code)
+        self.assertEqual(retry['Location'], first['Location'])
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+
+    def test_reused_key_with_different_payload_is_rejected(self):
+        self.client.post(reverse('orders:checkout'), self.checkout_data(idempotency_key='checkout-key-2'))
+        response = self.client.post(
+            reverse('orders:checkout'),
+            self.checkout_data(idempotency_key='checkout-key-2', recipient_name='李大華'),
+        )
+        self.assertEqual(response.status_code, 422)
+
+    def test_expired_keys_are_purged(self):
+        self.client.post(reverse('orders:checkout'), self.checkout_data(idempotency_key='checkout-key-3'))
+        self.assertEqual(purge_expired_keys(), 0)
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(purge_expired_keys(), 1)
+
+
+class OrderNumberTest(OrderTestMixin, TestCase):
+    """Test block-leased, check-digited order numbers."""
+
+    def test_numbers_are_sequential_and_valid(self):
+        user = self.create_user()
+        numbers = [Order.objects.create(user=user).order_number for _ in range(3)]
+
+        self.assertTrue(all(is_valid_order_number(number) for number in numbers))
+        sequences = [int(number.split('-')[2][:-1]) for number in numbers]
+        self.assertEqual(sequences, list(range(sequences[0], sequences[0] + 3)))
+        self.assertTrue(numbers[0].startswith(f"ES-{timezone.localdate():%Y%m%d}-"))
+
+    def test_check_digit_catches_typos(self):
+        number = format_order_number(timezone.localdate(), 123)
+        self.assertTrue(is_valid_order_number(number))
+        self.assertFalse(is_valid_order_number(number[:-2] + '9' + number[-1]))
+        self.assertFalse(is_valid_order_number('ES-20240101-ABCDE'))
+
+    def test_counter_never_reissues_a_value(self):
+        numbers = {next_order_number() for _ in range(50)}
+        self.assertEqual(len(numbers), 50)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Needs a server connection that can be killed')
+class OrderNumberReconnectTest(TransactionTestCase):
+    """Test that a lease survives a connection dropped by the server."""
+
+    def test_lease_reopens_a_dropped_connection(self):
+        connection.ensure_connection()
+        pid = connection.connection.info.backend_pid
+        killer = connections.create_connection('default')
+        try:
+            with killer.cursor() as cursor:
+                cursor.execute('SELECT pg_terminate_backend(%s)', [pid])
+        finally:
+            killer.close()
+
+        first, last = lease_block(timezone.localdate(), 5)
+        self.assertEqual(last - first, 4)
+
+
+class OrderItemSnapshotTest(OrderTestMixin, TestCase):
+    """Test that order lines render from their purchase-time snapshot."""
+
+    def setUp(self):
+        self.user = self.create_user()
+        self.client.force_login(self.user)
+        self.product = self.create_product(name_en='Angus Ribeye')
+        ProductImage.objects.create(product=self.product, image='products/ribeye.jpg', display_order=1)
+        ProductImage.objects.create(product=self.product, image='products/ribeye-main.jpg', is_primary=True, display_order=2)
+        self.variant = ProductVariant.objects.create(
+            product=self.product, name='500g', sku='ANGUS-001-500G', stock=5
+        )
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.add_quantity(cart, self.product, self.variant, 1)
+        self.order = create_order_from_cart(cart, self.checkout_data(), self.user)
+
+    def test_snapshot_fields_are_populated(self):
+        item = self.order.items.get()
+        self.assertEqual(item.product_name_en, 'Angus Ribeye')
+        self.assertEqual(item.variant_name, '500g')
+        self.assertEqual(item.product_image.name, 'products/ribeye-main.jpg')
+
+    def test_detail_survives_catalog_deletion_without_catalog_queries(self):
+        self.product.delete()
+        url = reverse('orders:order_detail', args=[self.order.id])
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertContains(response, 'products/ribeye-main.jpg')
+        self.assertContains(response, '500g')
+        
+        item_queries = [q['sql'] for q in context.captured_queries if 'orders_orderitem' in q['sql']]
+        self.assertEqual(len(item_queries), 1)
+        self.assertFalse(any(
+            'products_product' in q['sql'] or 'products_productimage' in q['sql']
+            for q in context.captured_queries
+        ))
+
+
+class OrderHistoryTest(OrderTestMixin, TestCase):
+    """Test keyset-paginated order history and the per-user summary."""
+
+    def setUp(self):
+        self.user = self.create_user()
+        self.client.force_login(self.user)
+
+    def create_orders(self, count):
+        orders = []
+        for i in range(count):
+            order = Order.objects.create(user=self.user, total_amount=Decimal('1000'))
+            OrderItem.objects.create(
+                order=order, product_name=f'商品 {i}', quantity=2, price_at_purchase=Decimal('500')
+            )
+            orders.append(order)
+        return orders
+
+    def test_cursor_pages_cover_every_order_once(self):
+        orders = self.create_orders(5)
+        # Same timestamp for several orders exercises the id tie-breaker
+        Order.objects.filter(pk__in=[o.pk for o in orders[:3]]).update(created_at=orders[0].created_at)
+
+        seen, cursor = [], None
+        while True:
+            page, cursor = get_order_page(self.user, cursor=cursor, page_size=2)
+            seen.extend(order.pk for order in page)
+            if cursor is None:
+                break
+
+        self.assertEqual(sorted(seen), sorted(o.pk for o in orders))
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(page[-1].item_count, 2)
+
+    def test_summary_tracks_new_and_paid_orders(self):
+        first, second = self.create_orders(2)
+        second.payment_status = 'paid'
+        second.save(update_fields=['payment_status'])
+
+        summary = OrderSummary.objects.get(user=self.user)
+        self.assertEqual(summary.order_count, 2)
+        self.assertEqual(summary.lifetime_spend, Decimal('1000'))
+        self.assertEqual(summary.last_order_at, second.created_at)
+
+        second.payment_status = 'refunded'
+        second.save(update_fields=['payment_status'])
+        self.assertEqual(get_order_summary(self.user)['lifetime_spend'], Decimal('0'))
+
+    def test_missing_summary_is_rebuilt_from_orders(self):
+        self.create_orders(3)
+        OrderSummary.objects.all().delete()
+        self.create_orders(1)
+        self.assertEqual(OrderSummary.objects.get(user=self.user).order_count, 4)
+
+    def test_order_list_page_renders(self):
+        self.create_orders(12)
+        response = self.client.get(reverse('orders:order_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['orders']), 10)
+        self.assertIsNotNone(response.context['next_cursor'])
+
+        response = self.client.get(reverse('orders:order_list'), {'cursor': response.context['next_cursor']})
+        self.assertEqual(len(response.context['orders']), 2)
+        self.assertIsNone(response.context['next_cursor'])
+
+
+class OrderStateMachineTest(OrderTestMixin, TestCase):
+    """Test validated bulk transitions and the order event log."""
+
+    def setUp(self):
+        self.user = self.create_user()
+        self.orders = [Order.objects.create(user=self.user) for _ in range(3)]
+
+    def test_bulk_transition_skips_disallowed_orders(self):
+        Order.objects.filter(pk=self.orders[2].pk).update(status='delivered')
+
+        with CaptureQueriesContext(connection) as queries:
+            changed, skipped = transition_orders(
+                Order.objects.filter(pk__in=[o.pk for o in self.orders]), 'shipped'
+            )
+
+        self.assertEqual((changed, skipped), (0, 3))
+        changed, skipped = transition_orders(Order.objects.all(), 'processing', actor=self.user)
+        self.assertEqual((changed, skipped), (2, 1))
+        self.assertEqual(
+            list(Order.objects.order_by('id').values_list('status', flat=True)),
+            ['processing', 'processing', 'delivered'],
+        )
+        # Only processing can reach shipped, so one UPDATE and no event insert
+        updates = [q for q in queries.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+
+    def test_transitions_are_logged(self):
+        transition_orders(Order.objects.filter(pk=self.orders[0].pk), 'processing', actor=self.user, note='picked')
+
+        event = OrderEvent.objects.filter(order=self.orders[0], from_value='pending').get()
+        self.assertEqual((event.field, event.to_value, event.actor, event.note),
+                         ('status', 'processing', self.user, 'picked'))
+        with self.assertRaises(ValueError):
+            event.save()
+
+    def test_transition_order_rejects_invalid_change(self):
+        transition_order(self.orders[0], 'cancelled')
+        with self.assertRaises(InvalidTransitionError):
+            transition_order(self.orders[0], 'processing')
+
+    def test_cancelling_releases_stock(self):
+        product = self.create_product(stock=5)
+        reserve_stock(self.orders[0], [(product.id, None, 2)])
+
+        transition_orders(Order.objects.filter(pk=self.orders[0].pk), 'cancelled')
+
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 5)
+
+    def test_payment_status_changes_are_logged(self):
+        order = self.orders[0]
+        order.payment_status = 'paid'
+        order.save(update_fields=['payment_status'])
+
+        self.assertTrue(OrderEvent.objects.filter(
+            order=order, field='payment_status', from_value='pending', to_value='paid'
+        ).exists())
+
+
+@override_settings(SALES_ROLLUP_LAG_SECONDS=0)
+class SalesRollupTest(OrderTestMixin, TestCase):
+    """Test incremental daily sales rollups and the dashboard."""
+
+    def setUp(self):
+        self.user = self.create_user()
+        self.product = self.create_product(price='500.00')
+
+    def create_paid_order(self, quantity=2, **kwargs):
+        order = Order.objects.create(user=self.user, payment_status='paid', **kwargs)
+        OrderItem.objects.create(
+            order=order, product=self.product, product_name=self.product.name,
+            quantity=quantity, price_at_purchase=self.product.price,
+        )
+        return order
+
+    def test_rollup_aggregates_paid_orders(self):
+        self.create_paid_order(quantity=2)
+        self.create_paid_order(quantity=1, payment_method='atm')
+        Order.objects.create(user=self.user)  # unpaid
+
+        days, rows = update_sales_rollups()
+
+        self.assertEqual((days, rows), (1, 2))
+        card = DailySalesRollup.objects.get(payment_method='credit_card')
+        self.assertEqual((card.order_count, card.quantity, card.revenue), (1, 2, Decimal('1000.00')))
+        self.assertEqual(card.category, self.product.category)
+
+    def test_only_changed_days_are_rebuilt(self):
+        order = self.create_paid_order()
+        update_sales_rollups()
+        self.assertEqual(update_sales_rollups(), (0, 0))
+
+        order.status = 'cancelled'
+        order.save(update_fields=['status'])
+        days, rows = update_sales_rollups()
+
+        self.assertEqual((days, rows), (1, 0))
+        self.assertFalse(DailySalesRollup.objects.exists())
+
+    @override_settings(SALES_ROLLUP_LAG_SECONDS=120)
+    def test_recent_changes_wait_for_the_lag(self):
+        self.create_paid_order()
+        self.assertEqual(update_sales_rollups(), (0, 0))
+
+    def test_dashboard_renders_from_rollups(self):
+        self.create_paid_order()
+        update_sales_rollups()
+        admin = get_user_model().objects.create_superuser(email='admin@example.com', password='testpass123')
+        self.client.force_login(admin)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:orders_dailysalesrollup_changelist'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['dashboard']['revenue'], Decimal('1000.00'))
+        tables = ' '.join(q['sql'] for q in queries.captured_queries)
+        self.assertNotIn('"orders_orderitem"', tables)
+
+
+class ArchivingTest(OrderTestMixin, TestCase):
+    """Test moving old rows to archive tables on unpartitioned backends."""
+
+    def setUp(self):
+        self.user = self.create_user()
+        self.old = timezone.now() - timedelta(days=365 * 4)
+        self.specs = {spec.label: spec for spec in ARCHIVE_SPECS}
+
+    def archived_count(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {table}_archive')
+            return cursor.fetchone()[0]
+
+    def create_order(self, status, created_at=None):
+        from payments.models import Payment, PaymentLog
+        order = Order.objects.create(user=self.user, status=status)
+        OrderItem.objects.create(order=order, product_name='安格斯', quantity=1, price_at_purchase=Decimal('100'))
+        payment = Payment.objects.create(order=order, user=self.user, payment_method='credit_card', amount=Decimal('100'))
+        PaymentLog.objects.create(payment=payment, message='created')
+        if created_at:
+            Order.objects.filter(pk=order.pk).update(created_at=created_at)
+        return order
+
+    def test_old_finished_orders_move_with_their_rows(self):
+        old_delivered = self.create_order('delivered', created_at=self.old)
+        old_pending = self.create_order('pending', created_at=self.old)
+        recent = self.create_order('delivered')
+
+        result = archive_model(self.specs['orders.Order'], batch_size=1)
+
+        self.assertEqual(result['rows_archived'], 1)
+        self.assertEqual(
+            set(Order.objects.values_list('pk', flat=True)), {old_pending.pk, recent.pk}
+        )
+        self.assertFalse(OrderItem.objects.filter(order_id=old_delivered.pk).exists())
+        self.assertEqual(self.archived_count('orders_order'), 1)
+        self.assertEqual(self.archived_count('orders_orderitem'), 1)
+        self.assertEqual(self.archived_count('payments_payment'), 1)
+        self.assertEqual(self.archived_count('payments_paymentlog'), 1)
+        # Creation events go too
+        self.assertEqual(self.archived_count('orders_orderevent'), 1)
+
+    def test_login_attempts_are_archived_in_batches(self):
+        from authentication.models import LoginAttempt
+        for _ in range(3):
+            LoginAttempt.objects.create(email='a@example.com', ip_address='127.0.0.1')
+        LoginAttempt.objects.update(attempted_at=self.old)
+        LoginAttempt.objects.create(email='a@example.com', ip_address='127.0.0.1')
+
+        result = archive_model(self.specs['authentication.LoginAttempt'], batch_size=2)
+
+        self.assertEqual(result['rows_archived'], 3)
+        self.assertEqual(LoginAttempt.objects.count(), 1)
+        self.assertEqual(self.archived_count('authentication_loginattempt'), 3)
+
+    def test_exported_table_reads_back_from_gzip(self):
+        self.create_order('delivered')
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+
+        total, path = export_table(connection, 'payments_paymentlog', directory)
+
+        self.assertEqual((total, os.path.basename(path)), (1, 'payments_paymentlog.jsonl.gz'))
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            [row] = [json.loads(line) for line in f]
+        self.assertEqual(row['message'], 'created')
+        # A second export of the same table never overwrites the first
+        with self.assertRaises(FileExistsError):
+            export_table(connection, 'payments_paymentlog', directory)
+
+
+class ShippingRateTest(OrderTestMixin, TestCase):
+    """Test the compiled shipping rate table and its callers."""
+
+    def setUp(self):
+        invalidate_rate_table()
+        self.addCleanup(invalidate_rate_table)
+        self.user = self.create_user()
+        self.cart = Cart.objects.create(user=self.user)
+
+    def add_line(self, quantity=1, **product_kwargs):
+        product = self.create_product(sku=f'SKU-{CartItem.objects.count()}', **product_kwargs)
+        return CartItem.objects.create(cart=self.cart, product=product, quantity=quantity)
+
+    def test_weight_bands_and_threshold(self):
+        self.add_line(quantity=3, price='400.00', weight=Decimal('2000'))
+
+        subtotal, quotes = quote_cart(list(self.cart.items.select_related('product')))
+
+        self.assertEqual(subtotal, Decimal('1200.00'))
+        self.assertEqual(quotes['home_delivery'].fee, Decimal('60'))
+        self.assertEqual(quotes['home_delivery'].remaining, Decimal('300.00'))
+        # 6 kg is over the convenience-store limit
+        self.assertIsNone(quotes['seven_eleven'].fee)
+
+    def test_free_shipping_over_threshold(self):
+        self.add_line(quantity=2, price='800.00')
+        _, quotes = quote_cart(list(self.cart.items.select_related('product')))
+        self.assertEqual(quotes['family_mart'].fee, Decimal('0'))
+
+    def test_table_is_compiled_once(self):
+        get_rate_table()
+        with self.assertNumQueries(0):
+            get_rate_table()
+        ShippingRate.objects.filter(shipping_method='home_delivery', max_weight=10000).update(fee=Decimal('80'))
+        invalidate_rate_table()
+        self.assertEqual(get_rate_table().quote('home_delivery', Decimal('100'), 0).fee, Decimal('80'))
+
+    def test_order_uses_selected_method(self):
+        self.add_line(quantity=1, price='500.00', weight=Decimal('6000'))
+        items = list(self.cart.items.select_related('product', 'variant'))
+
+        with self.assertRaises(ShippingUnavailableError):
+            create_order_from_cart(self.cart, self.checkout_data(shipping_method='seven_eleven'), self.user, items)
+
+        order = create_order_from_cart(self.cart, self.checkout_data(), self.user, items)
+        self.assertEqual((order.shipping_fee, order.total_amount), (Decimal('60'), Decimal('560.00')))
+
+    def test_checkout_page_quotes_each_method(self):
+        self.add_line(quantity=1, price='500.00')
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('orders:checkout'))
+
+        fees = {choice.data['value']: quote.fee for choice, quote in response.context['shipping_choices']}
+        self.assertEqual(fees['home_delivery'], Decimal('60'))
+        self.assertEqual(response.context['total'], Decimal('560.00'))
+
+
+class PostalCodeTest(OrderTestMixin, TestCase):
+    """Test the offline postal code index and checkout validation."""
+
+    def test_lookup_normalizes_names(self):
+        index = get_index()
+        self.assertEqual(index.lookup('台北市', '中正區').postal_code, '100')
+        self.assertTrue(index.is_valid('100012', '臺北市', '中正區'))
+        self.assertFalse(index.is_valid('200', '臺北市', '中正區'))
+        # Shared codes map to every district that uses them
+        self.assertEqual(len(index.districts_for_code('300')), 3)
+
+    def test_search_by_code_and_name(self):
+        index = get_index()
+        self.assertEqual([d.district for d in index.search('10')][:2], ['中正區', '大同區'])
+        self.assertEqual(
+            {(d.city, d.postal_code) for d in index.search('中正')},
+            {('臺北市', '100'), ('基隆市', '202')},
+        )
+        self.assertEqual([d.postal_code for d in index.search('台中市北屯')], ['406'])
+
+    def test_checkout_form_checks_combination(self):
+        user = self.create_user()
+        form = CheckoutForm(self.checkout_data(postal_code='10048'), user=user)
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.cleaned_data['city'], '臺北市')
+
+        form = CheckoutForm(self.checkout_data(postal_code='220'), user=user)
+        self.assertIn('postal_code', form.errors)
+        form = CheckoutForm(self.checkout_data(district='不存在區'), user=user)
+        self.assertIn('district', form.errors)
+
+    def test_lookup_endpoint(self):
+        response = self.client.get(reverse('orders:postal_code_lookup'), {'q': '106'})
+        self.assertEqual(
+            response.json()['results'],
+            [{'postal_code': '106', 'city': '臺北市', 'district': '大安區'}],
+        )
+
+
+class PickupStoreTest(OrderTestMixin, TestCase):
+    """Test the pickup store import, locator index and checkout selection."""
+
+    CSV = (
+        'chain,store_id,name,address,city,district,latitude,longitude\n'
+        'seven_eleven,100001,台大門市,臺北市大安區羅斯福路四段1號,臺北市,大安區,25.017340,121.539752\n'
+        'seven_eleven,100002,公館門市,臺北市中正區羅斯福路四段74號,臺北市,中正區,25.014800,121.534000\n'
+        'seven_eleven,100003,信義門市,臺北市信義區松仁路100號,臺北市,信義區,25.033000,121.567000\n'
+        'seven_eleven,200001,高雄門市,高雄市前金區中正四路1號,高雄市,前金區,22.627000,120.296000\n'
+        'family_mart,900001,全家台大店,臺北市大安區新生南路三段1號,臺北市,大安區,25.018000,121.533000\n'
+        'seven_eleven,bad,缺座標門市,臺北市,臺北市,中正區,,\n'
+    )
+
+    def setUp(self):
+        invalidate_store_index()
+        self.addCleanup(invalidate_store_index)
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'stores.csv')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.CSV)
+        self.out = StringIO()
+        call_command('import_pickup_stores', path, stdout=self.out, stderr=StringIO())
+
+    def test_import_upserts_and_skips_bad_rows(self):
+        self.assertIn('Imported 5 stores', self.out.getvalue())
+        self.assertIn('skipped 1', self.out.getvalue())
+        self.assertEqual(PickupStore.objects.count(), 5)
+
+    def test_nearest_stores_by_point_and_district(self):
+        index = get_store_index()
+        nearest = index.nearest('seven_eleven', 25.0173, 121.5397, limit=2)
+        self.assertEqual([store.store_id for store, km in nearest], ['100001', '100002'])
+        self.assertLess(nearest[0][1], 0.1)
+        # Far-away stores are beyond the search radius
+        self.assertNotIn('200001', [s.store_id for s, km in index.nearest('seven_eleven', 25.0, 121.5, limit=10)])
+        self.assertEqual(index.near_district('family_mart', '台北市', '大安區', limit=1)[0][0].store_id, '900001')
+
+    def test_text_search(self):
+        index = get_store_index()
+        self.assertEqual([s.store_id for s in index.search('羅斯福')], ['100001', '100002'])
+        self.assertEqual([s.store_id for s in index.search('台大', chain='family_mart')], ['900001'])
+        self.assertEqual(index.search('不存在'), [])
+
+    def test_search_endpoint(self):
+        response = self.client.get(
+            reverse('orders:pickup_store_search'), {'chain': 'seven_eleven', 'lat': '25.033', 'lng': '121.567', 'limit': '1'}
+        )
+        self.assertEqual(response.json()['results'][0]['store_id'], '100003')
+        self.assertEqual(self.client.get(reverse('orders:pickup_store_search')).status_code, 400)
+
+    def test_checkout_stores_chosen_store(self):
+        user = self.create_user()
+        form = CheckoutForm(self.checkout_data(shipping_method='seven_eleven'), user=user)
+        self.assertIn('pickup_store_id', form.errors)
+
+        form = CheckoutForm(self.checkout_data(shipping_method='seven_eleven', pickup_store_id='100002'), user=user)
+        self.assertTrue(form.is_valid(), form.errors)
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, product=self.create_product(), quantity=1)
+        order = create_order_from_cart(cart, form.cleaned_data, user)
+        self.assertEqual((order.pickup_store_id, order.pickup_store_name), ('100002', '公館門市'))
@@ -8,6 +8,8 @@ urlpatterns = [
     path('checkout/', views.checkout_view, name='checkout'),
     path('checkout/confirm/', views.checkout_confirm, name='checkout_confirm'),
     path('checkout/success/', views.checkout_success, name='checkout_success'),
+    path('postal-codes/', views.postal_code_lookup, name='postal_code_lookup'),
+    path('pickup-stores/', views.pickup_store_search, name='pickup_store_search'),
     
     # Order management / 訂單管理
     path('', views.order_list, name='order_list'),
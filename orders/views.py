@@ -13,11 +13,19 @@ from django.db import transaction
 from decimal import Decimal
 
 from cart.models import Cart
+from products.flash_sale import FlashSaleTokenError, missing_tokens, use_tokens
 from .models import Order, OrderItem
 from .forms import CheckoutForm
+from .history import get_order_page, get_order_summary
+from .idempotency import idempotent, new_key
+from .inventory import InsufficientStockError, reserve_stock
+from .pickup_stores import get_store_index, serialize_store
+from .postal_codes import get_index
+from .shipping import ShippingUnavailableError, get_shipping_fee, quote_cart
 
 
 @login_required
+@idempotent('checkout')
 def checkout_view(request):
     """
     Checkout page view - creates order from cart and redirects to payment.
@@ -30,26 +38,45 @@ def checkout_view(request):
         messages.error(request, _('購物車是空的 / Your cart is empty'))
         return redirect('cart:cart')
     
+    # Load every line with its product and variant once; validation, order
+    # creation and the page all work from this list
+    cart_items = get_checkout_items(cart)
+    
     # Check if cart has items
-    if not cart.items.exists():
+    if not cart_items:
         messages.error(request, _('購物車是空的 / Your cart is empty'))
         return redirect('cart:cart')
     
     # Check stock availability for all items
-    unavailable_items = []
-    for item in cart.items.all():
-        if not item.is_available or not item.has_sufficient_stock:
-            unavailable_items.append(item)
+    unavailable_items = [
+        item for item in cart_items
+        if not item.is_available or not item.has_sufficient_stock
+    ]
     
     if unavailable_items:
         messages.error(request, _('購物車中有商品缺貨或庫存不足 / Some items in your cart are out of stock'))
         return redirect('cart:cart')
     
+    # Only flash-sale token holders may proceed to checkout
+    if missing_tokens(request.user, {item.product_id for item in cart_items}):
+        messages.error(request, _('限時搶購名額已失效，請重新加入購物車 / Your flash-sale slot has expired, please add the item again'))
+        return redirect('cart:cart')
+    
     if request.method == 'POST':
         form = CheckoutForm(request.POST, user=request.user)
         if form.is_valid():
             # Create order from cart
-            order = create_order_from_cart(cart, form.cleaned_data, request.user)
+            try:
+                order = create_order_from_cart(cart, form.cleaned_data, request.user, cart_items=cart_items)
+            except InsufficientStockError:
+                messages.error(request, _('購物車中有商品缺貨或庫存不足 / Some items in your cart are out of stock'))
+                return redirect('cart:cart')
+            except FlashSaleTokenError:
+                messages.error(request, _('限時搶購名額已失效，請重新加入購物車 / Your flash-sale slot has expired, please add the item again'))
+                return redirect('cart:cart')
+            except ShippingUnavailableError as e:
+                form.add_error('shipping_method', str(e))
+                order = None
             
             if order:
                 # Clear cart after successful order creation
@@ -57,39 +84,70 @@ def checkout_view(request):
                 
                 # Redirect to payment initiation
                 return redirect('payments:initiate', order_id=order.id)
-            else:
+            elif not form.errors:
                 messages.error(request, _('訂單建立失敗，請重試 / Order creation failed, please try again'))
     else:
         form = CheckoutForm(user=request.user)
     
-    # Calculate totals
-    subtotal = cart.get_subtotal()
-    shipping_fee = calculate_shipping_fee(subtotal)
+    # Quote every shipping method; the summary shows the selected one
+    subtotal, quotes = quote_cart(cart_items)
+    selected = quotes.get(form['shipping_method'].value())
+    shipping_fee = selected.fee if selected and selected.fee is not None else Decimal('0')
     total = subtotal + shipping_fee
     
     context = {
         'cart': cart,
-        'cart_items': cart.items.all(),
+        'cart_items': cart_items,
         'form': form,
+        # (radio, Quote) pairs in choice order
+        'shipping_choices': [
+            (choice, quotes.get(choice.data['value'])) for choice in form['shipping_method']
+        ],
         'subtotal': subtotal,
         'shipping_fee': shipping_fee,
         'total': total,
-        'item_count': cart.get_items_count(),
+        'item_count': sum(item.quantity for item in cart_items),
+        'idempotency_key': new_key(),
     }
     
     return render(request, 'orders/checkout.html', context)
 
 
-def create_order_from_cart(cart, form_data, user):
+def get_checkout_items(cart):
+    """
+    Load cart lines for checkout with product, variant and images in a
+    fixed number of queries.
+    """
+    return list(
+        cart.items.select_related('product', 'variant')
+        .prefetch_related('product__images')
+        .order_by('id')
+    )
+
+
+def create_order_from_cart(cart, form_data, user, cart_items=None):
     """
     Create order from cart data.
     從購物車資料建立訂單
+    
+    Order lines are inserted with one bulk_create; only the conditional
+    stock decrements (one per product or variant) scale with the cart.
+    
+    Args:
+        cart: Cart to check out
+        form_data: Cleaned checkout form data
+        user: Ordering user
+        cart_items: Lines already loaded by get_checkout_items (optional)
     """
+    if cart_items is None:
+        cart_items = get_checkout_items(cart)
+    
     try:
         with transaction.atomic():
-            # Calculate totals
-            subtotal = cart.get_subtotal()
-            shipping_fee = calculate_shipping_fee(subtotal)
+            # Calculate totals; raises if the method cannot carry the cart
+            subtotal, shipping_fee = get_shipping_fee(
+                cart_items, form_data.get('shipping_method', 'home_delivery')
+            )
             total = subtotal + shipping_fee
             
             # Create order
@@ -105,44 +163,111 @@ def create_order_from_cart(cart, form_data, user):
                 shipping_city=form_data.get('city', ''),
                 shipping_district=form_data.get('district', ''),
                 shipping_address=form_data.get('address', ''),
+                **pickup_store_fields(form_data.get('pickup_store')),
                 subtotal=subtotal,
                 shipping_fee=shipping_fee,
                 total_amount=total,
                 customer_notes=form_data.get('notes', '')
             )
             
-            # Create order items from cart items
-            for cart_item in cart.items.all():
-                OrderItem.objects.create(
+            # Create order items from cart items in one INSERT
+            OrderItem.objects.bulk_create([
+                OrderItem(
                     order=order,
                     product=cart_item.product,
                     variant=cart_item.variant,
                     product_name=cart_item.product.name,
-                    product_sku=cart_item.product.sku if hasattr(cart_item.product, 'sku') else '',
+                    product_name_en=cart_item.product.name_en,
+                    product_sku=cart_item.product.sku,
+                    variant_name=cart_item.variant.name if cart_item.variant else '',
+                    product_image=OrderItem.snapshot_image(cart_item.product),
                     quantity=cart_item.quantity,
                     price_at_purchase=cart_item.get_price()
                 )
+                for cart_item in cart_items
+            ])
+            
+            # Spend flash-sale tokens; only committed orders use them up
+            use_tokens(user, {item.product_id for item in cart_items})
+            
+            # Hold stock until payment; rolls the order back if anything is short
+            reserve_stock(order, [
+                (item.product_id, item.variant_id, item.quantity) for item in cart_items
+            ])
             
             return order
             
+    except (InsufficientStockError, FlashSaleTokenError, ShippingUnavailableError):
+        raise
     except Exception as e:
         # Log error in production
         print(f"Order creation error: {str(e)}")
         return None
 
 
-def calculate_shipping_fee(subtotal):
+def pickup_store_fields(store):
+    """Order fields recording the chosen pickup store."""
+    if store is None:
+        return {}
+    return {
+        'pickup_store_id': store.store_id,
+        'pickup_store_name': store.name,
+        'pickup_store_address': store.address,
+    }
+
+
+def pickup_store_search(request):
     """
-    Calculate shipping fee based on subtotal.
-    根據小計計算運費
+    Find pickup stores of one chain.
+    搜尋超商取貨門市
+
+    GET parameters: chain (required) and one of
+    q (name or address text), lat + lng (nearest to a point), or
+    city + district (nearest to the district); limit (default 10, max 50).
     """
-    # Taiwan shipping fee logic
-    FREE_SHIPPING_THRESHOLD = Decimal('1500')  # NT$1,500 for free shipping
-    STANDARD_SHIPPING_FEE = Decimal('60')      # NT$60 standard shipping
+    chain = request.GET.get('chain', '')
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1), 50)
+    except ValueError:
+        limit = 10
+    index = get_store_index()
     
-    if subtotal >= FREE_SHIPPING_THRESHOLD:
-        return Decimal('0')
-    return STANDARD_SHIPPING_FEE
+    if request.GET.get('q'):
+        results = [serialize_store(store) for store in index.search(request.GET['q'], chain=chain, limit=limit)]
+    elif request.GET.get('lat') and request.GET.get('lng'):
+        try:
+            lat, lng = float(request.GET['lat']), float(request.GET['lng'])
+        except ValueError:
+            return JsonResponse({'success': False, 'error': 'Invalid coordinates'}, status=400)
+        results = [serialize_store(store, km) for store, km in index.nearest(chain, lat, lng, limit=limit)]
+    elif request.GET.get('district'):
+        results = [
+            serialize_store(store, km)
+            for store, km in index.near_district(
+                chain, request.GET.get('city', ''), request.GET['district'], limit=limit
+            )
+        ]
+    else:
+        return JsonResponse({'success': False, 'error': 'Give q, lat and lng, or district'}, status=400)
+    
+    return JsonResponse({'success': True, 'results': results})
+
+
+def postal_code_lookup(request):
+    """
+    Autocomplete postal code, city and district from the offline index.
+    郵遞區號與縣市區域自動完成
+
+    GET ?q= takes a postal code prefix (e.g. 10, 100, 100012) or a city
+    or district name prefix (e.g. 台北, 中正).
+    """
+    results = get_index().search(request.GET.get('q', ''))
+    return JsonResponse({
+        'results': [
+            {'postal_code': d.postal_code, 'city': d.city, 'district': d.district}
+            for d in results
+        ]
+    })
 
 
 def checkout_confirm(request):
@@ -169,11 +294,17 @@ def order_list(request):
     """
     User's order list.
     用戶訂單列表
+    
+    Pages with a keyset cursor (?cursor=...) rather than OFFSET, so long
+    order histories stay fast.
     """
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
+    orders, next_cursor = get_order_page(request.user, cursor=request.GET.get('cursor'))
     
     context = {
         'orders': orders,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('cursor'),
+        'summary': get_order_summary(request.user),
     }
     
     return render(request, 'orders/order_list.html', context)
@@ -185,7 +316,10 @@ def order_detail(request, order_id):
     Order detail view.
     訂單詳情視圖
     """
-    order = get_object_or_404(Order, id=order_id, user=request.user)
+    # Lines render from their purchase-time snapshot; no catalog joins needed
+    order = get_object_or_404(
+        Order.objects.prefetch_related('items'), id=order_id, user=request.user
+    )
     
     context = {
         'order': order,
@@ -200,7 +334,9 @@ def order_invoice(request, order_id):
     Order invoice view - to be implemented
     訂單發票視圖 - 待實作
     """
-    order = get_object_or_404(Order, id=order_id, user=request.user)
+    order = get_object_or_404(
+        Order.objects.prefetch_related('items'), id=order_id, user=request.user
+    )
     
     context = {
         'order': order,
@@ -5,7 +5,8 @@ Admin configuration for payments app.
 from django.contrib import admin
 from django.utils.html import format_html
 from django.utils.translation import gettext_lazy as _
-from .models import Payment, PaymentLog, RefundRecord
+from django.utils import timezone
+from .models import CallbackInbox, Payment, PaymentLog, RefundRecord
 
 
 @admin.register(Payment)
@@ -55,6 +56,7 @@ class PaymentAdmin(admin.ModelAdmin):
         'created_at',
         'updated_at',
         'paid_at',
+        'reconciled_at',
     ]
     
     fieldsets = [
@@ -102,6 +104,7 @@ class PaymentAdmin(admin.ModelAdmin):
                 'created_at',
                 'updated_at',
                 'paid_at',
+                'reconciled_at',
             ]
         }),
     ]
@@ -185,10 +188,21 @@ class PaymentLogAdmin(admin.ModelAdmin):
         'request_data',
         'response_data',
         'ip_address',
-        'user_agent',
+        'user_agent_text',
         'created_at',
     ]
     
+    exclude = ['user_agent', 'agent']
+    
+    list_select_related = ['payment']
+    
+    # Counting the whole log table on every changelist page is slow
+    show_full_result_count = False
+    
+    def user_agent_text(self, obj):
+        return obj.user_agent_text
+    user_agent_text.short_description = _('用戶代理 / User Agent')
+    
     def payment_link(self, obj):
         """Create link to payment admin."""
         return format_html(
@@ -317,3 +331,58 @@ class RefundRecordAdmin(admin.ModelAdmin):
         """Display amount with currency."""
         return f"NT$ {obj.amount:,.0f}"
     amount_display.short_description = _('金額 / Amount')
+
+
+@admin.register(CallbackInbox)
+class CallbackInboxAdmin(admin.ModelAdmin):
+    """
+    Admin interface for queued ECPay callbacks.
+    """
+    
+    list_display = [
+        'merchant_trade_no',
+        'trade_no',
+        'rtn_code',
+        'status',
+        'attempts',
+        'received_at',
+        'processed_at',
+    ]
+    
+    list_filter = [
+        'status',
+        'received_at',
+    ]
+    
+    search_fields = [
+        'merchant_trade_no',
+        'trade_no',
+    ]
+    
+    readonly_fields = [
+        'merchant_trade_no',
+        'trade_no',
+        'rtn_code',
+        'payload',
+        'status',
+        'attempts',
+        'last_error',
+        'ip_address',
+        'user_agent',
+        'received_at',
+        'available_at',
+        'processed_at',
+    ]
+    
+    actions = ['retry_callbacks']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    @admin.action(description=_('重新處理 / Retry processing'))
+    def retry_callbacks(self, request, queryset):
+        """Put failed or delayed callbacks back in the queue."""
+        updated = queryset.exclude(status='done').update(
+            status='pending', attempts=0, available_at=timezone.now()
+        )
+        self.message_user(request, _('已重新排入 %(count)d 筆 / Requeued %(count)d callbacks') % {'count': updated})
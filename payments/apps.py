@@ -5,3 +5,9 @@ class PaymentsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "payments"
     verbose_name = "付款系統 / Payment System"
+
+    def ready(self):
+        from django.core.signals import request_finished
+        from .payment_logs import flush_if_due
+
+        request_finished.connect(flush_if_due, dispatch_uid='payments.flush_payment_logs')
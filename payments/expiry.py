@@ -0,0 +1,98 @@
+"""
+Expiry of unpaid ATM, CVS and BARCODE payments.
+逾期未付款處理
+
+These payments carry the deadline of their payment code in
+payment_deadline. expire_payments_batch() takes pending payments whose
+deadline passed more than PAYMENT_EXPIRY_GRACE_MINUTES ago (banks can
+notify ECPay a little late) along the (status, payment_deadline) index,
+one batch per transaction:
+
+- the batch is claimed with SELECT ... FOR UPDATE SKIP LOCKED, so a
+  callback working on one of them or a second sweeper is never waited on;
+- payments move to failed, and their orders' payment status with them,
+  in one UPDATE each guarded by the old status;
+- orders still pending are cancelled through transition_orders, which
+  releases their stock reservations;
+- the PaymentLog and OrderEvent rows are written with bulk_create.
+
+When nothing has expired a run is one indexed query, so the
+expire_payments command can run every minute.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from orders.models import Order, OrderEvent
+from orders.state_machine import transition_orders
+from .models import Payment, PaymentLog
+from .status_events import notify_status_changes
+
+EXPIRED_NOTE = 'Payment deadline passed'
+
+
+def get_grace_period():
+    """Return how long after its deadline an unpaid payment expires."""
+    return timedelta(minutes=getattr(settings, 'PAYMENT_EXPIRY_GRACE_MINUTES', 30))
+
+
+def expired_payments(now=None):
+    """Pending payments past their deadline and the grace period."""
+    now = now or timezone.now()
+    return Payment.objects.filter(status='pending', payment_deadline__lt=now - get_grace_period())
+
+
+def expire_payments_batch(batch_size=500, now=None):
+    """
+    Fail one batch of expired payments and cancel their orders.
+    處理一批逾期未付款的付款記錄
+
+    Returns:
+        tuple: (payments expired, orders cancelled) in this batch
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        rows = list(
+            expired_payments(now)
+            .order_by('payment_deadline')
+            .select_for_update(skip_locked=True)
+            .values_list('pk', 'payment_id', 'order_id', 'payment_deadline')[:batch_size]
+        )
+        if not rows:
+            return 0, 0
+
+        payment_pks = [row[0] for row in rows]
+        order_ids = [row[2] for row in rows]
+        Payment.objects.filter(pk__in=payment_pks, status='pending').update(status='failed', updated_at=now)
+
+        unpaid_orders = list(
+            Order.objects.filter(pk__in=order_ids, payment_status='pending').values_list('pk', flat=True)
+        )
+        Order.objects.filter(pk__in=unpaid_orders, payment_status='pending').update(
+            payment_status='failed', updated_at=now
+        )
+        OrderEvent.objects.bulk_create(
+            OrderEvent(
+                order_id=order_id, field='payment_status', from_value='pending', to_value='failed',
+                note=EXPIRED_NOTE,
+            )
+            for order_id in unpaid_orders
+        )
+        cancelled, _skipped = transition_orders(
+            Order.objects.filter(pk__in=order_ids, status='pending'), 'cancelled', note=EXPIRED_NOTE
+        )
+
+        PaymentLog.objects.bulk_create(
+            PaymentLog(
+                payment_id=pk,
+                log_type='info',
+                message=f"Payment expired unpaid, deadline {timezone.localtime(deadline):%Y-%m-%d %H:%M}",
+            )
+            for pk, _payment_id, _order_id, deadline in rows
+        )
+        notify_status_changes(row[1] for row in rows)
+
+    return len(rows), cancelled
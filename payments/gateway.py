@@ -0,0 +1,259 @@
+"""
+Shared HTTP client for server-to-server ECPay calls.
+綠界 API 連線管理
+
+Each process keeps one requests.Session per ECPay host, so queries and
+refunds reuse pooled keep-alive connections instead of opening a new TLS
+connection every time. On top of the session:
+
+- separate connect and read timeouts (ECPAY_CONNECT_TIMEOUT,
+  ECPAY_READ_TIMEOUT);
+- bounded retries with full-jitter exponential backoff. Idempotent calls
+  (trade queries) retry on connection errors, timeouts and 5xx responses;
+  other calls (refunds) only retry when the connection could not be
+  opened, since the request never reached ECPay;
+- a circuit breaker: after ECPAY_CIRCUIT_FAILURES consecutive failures
+  calls fail fast with CircuitOpenError for ECPAY_CIRCUIT_RESET_SECONDS,
+  then one trial call decides whether to close it again;
+- per-endpoint latency and error counters, read with get_gateway_stats().
+"""
+
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from django.conf import settings
+
+# Latency samples kept per endpoint for percentiles
+LATENCY_SAMPLES = 500
+
+RETRY_STATUSES = frozenset({500, 502, 503, 504})
+
+
+class GatewayError(Exception):
+    """Raised when an ECPay call fails after all retries."""
+
+
+class CircuitOpenError(GatewayError):
+    """Raised without calling ECPay while the circuit breaker is open."""
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _not_sent(error):
+    """Return True if a requests error happened before the request was sent."""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker (closed, open, half-open)."""
+
+    def __init__(self, failure_threshold, reset_timeout, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        """Return True if a call may go through now."""
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self.trial_running:
+                # Let exactly one trial call through
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+            self.trial_running = False
+
+
+class EndpointMetrics:
+    """Call counters and recent latencies for one endpoint."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+
+    def record(self, seconds, error=False):
+        with self._lock:
+            self.calls += 1
+            self.errors += error
+            self.latencies.append(seconds)
+
+    def count(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def snapshot(self):
+        with self._lock:
+            samples = sorted(self.latencies)
+            calls, errors, retries, rejected = self.calls, self.errors, self.retries, self.rejected
+
+        def percentile(p):
+            if not samples:
+                return None
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 1)
+
+        return {
+            'calls': calls,
+            'errors': errors,
+            'error_rate': round(errors / calls, 4) if calls else 0.0,
+            'retries': retries,
+            'rejected': rejected,
+            'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95),
+            'max_ms': round(samples[-1] * 1000, 1) if samples else None,
+        }
+
+
+class ECPayClient:
+    """Pooled, retrying HTTP client for one ECPay host."""
+
+    def __init__(self, host, connect_timeout=3.05, read_timeout=20, max_retries=2,
+                 backoff=0.5, failure_threshold=5, reset_timeout=30, pool_size=10,
+                 sleep=time.sleep):
+        self.host = host.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.sleep = sleep
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.metrics = {}
+        self._metrics_lock = threading.Lock()
+
+        self.session = requests.Session()
+        # Retries are handled here, not by urllib3, so they are counted and jittered
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _metrics(self, path):
+        with self._metrics_lock:
+            return self.metrics.setdefault(path, EndpointMetrics())
+
+    def _backoff_delay(self, attempt):
+        # Full jitter: uniform between 0 and the exponential cap
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    def post(self, path, data, idempotent=False):
+        """
+        POST form data to an ECPay endpoint and return the response.
+
+        Raises:
+            CircuitOpenError: If ECPay is failing and the breaker is open
+            GatewayError: If the call still fails after the allowed retries
+        """
+        metrics = self._metrics(path)
+        if not self.breaker.allow():
+            metrics.count('rejected')
+            raise CircuitOpenError(f'ECPay circuit open, {path} not called')
+
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            error = None
+            try:
+                response = self.session.post(f'{self.host}{path}', data=data, timeout=self.timeout)
+            except requests.RequestException as e:
+                error, retryable = e, idempotent or _not_sent(e)
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    metrics.record(time.monotonic() - started)
+                    self.breaker.record_success()
+                    return response
+                error = GatewayError(f'ECPay returned HTTP {response.status_code}')
+                retryable = idempotent
+
+            metrics.record(time.monotonic() - started, error=True)
+            self.breaker.record_failure()
+            if not retryable or attempt >= self.max_retries or not self.breaker.allow():
+                if isinstance(error, GatewayError):
+                    raise error
+                raise GatewayError(str(error)) from error
+            metrics.count('retries')
+            self.sleep(self._backoff_delay(attempt))
+            attempt += 1
+
+    def stats(self):
+        with self._metrics_lock:
+            endpoints = {path: m.snapshot() for path, m in self.metrics.items()}
+        return {'host': self.host, 'circuit': self.breaker.state, 'endpoints': endpoints}
+
+
+_lock = threading.Lock()
+_clients = {}
+
+
+def get_client(host):
+    """Return this process's shared client for an ECPay host."""
+    with _lock:
+        client = _clients.get(host)
+        if client is None:
+            client = ECPayClient(
+                host,
+                connect_timeout=_setting('ECPAY_CONNECT_TIMEOUT', 3.05),
+                read_timeout=_setting('ECPAY_READ_TIMEOUT', 20),
+                max_retries=_setting('ECPAY_MAX_RETRIES', 2),
+                backoff=_setting('ECPAY_RETRY_BACKOFF', 0.5),
+                failure_threshold=_setting('ECPAY_CIRCUIT_FAILURES', 5),
+                reset_timeout=_setting('ECPAY_CIRCUIT_RESET_SECONDS', 30),
+                pool_size=_setting('ECPAY_POOL_SIZE', 10),
+            )
+            _clients[host] = client
+        return client
+
+
+def reset_clients():
+    """Close and forget every shared client (after settings change, and in tests)."""
+    with _lock:
+        for client in _clients.values():
+            client.session.close()
+        _clients.clear()
+
+
+def get_gateway_stats():
+    """Return latency, error and circuit state for every ECPay host used."""
+    with _lock:
+        clients = list(_clients.values())
+    return [client.stats() for client in clients]
@@ -0,0 +1,102 @@
+"""
+Inbox for ECPay callbacks: store on arrival, process in a worker.
+綠界回調佇列
+
+The callback view only verifies the CheckMacValue and inserts the raw
+payload here, then answers 1|OK. ECPay resends a notification until it
+is acknowledged; the resends carry the same MerchantTradeNo, TradeNo and
+RtnCode, so they hit the unique constraint and are dropped at insert.
+
+process_callbacks drains the inbox. Each batch is claimed with
+SELECT ... FOR UPDATE SKIP LOCKED, so several workers (threads or
+processes) can run side by side without taking the same row, and every
+row is handled in its own savepoint by PaymentService.handle_callback,
+which ignores notifications for payments already settled. A row that
+raises is retried later with a growing delay, up to MAX_ATTEMPTS.
+"""
+
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import CallbackInbox
+from .services import PaymentService
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+
+# Delay before retry n is RETRY_DELAY * 2 ** (n - 1)
+RETRY_DELAY = timedelta(seconds=30)
+
+
+def enqueue_callback(callback_data, ip_address=None, user_agent=''):
+    """Store a verified callback payload; a resend of a queued notification is dropped."""
+    entry = CallbackInbox(
+        merchant_trade_no=callback_data.get('MerchantTradeNo', '')[:20],
+        trade_no=callback_data.get('TradeNo', '')[:20],
+        rtn_code=callback_data.get('RtnCode', '')[:20],
+        payload=callback_data,
+        ip_address=ip_address,
+        user_agent=user_agent or '',
+    )
+    # INSERT ... ON CONFLICT DO NOTHING, so a resend costs one statement and no error
+    CallbackInbox.objects.bulk_create([entry], ignore_conflicts=True)
+
+
+def process_batch(batch_size=50, now=None):
+    """
+    Claim and process one batch of pending callbacks.
+    處理一批回調
+
+    Returns:
+        tuple: (rows claimed, rows that failed)
+    """
+    now = now or timezone.now()
+    service = PaymentService()
+    failed = 0
+    with transaction.atomic():
+        rows = list(
+            CallbackInbox.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', available_at__lte=now)
+            .order_by('id')[:batch_size]
+        )
+        for row in rows:
+            row.attempts += 1
+            try:
+                with transaction.atomic():
+                    service.handle_callback(
+                        row.payload, ip_address=row.ip_address, user_agent=row.user_agent
+                    )
+            except Exception as e:
+                failed += 1
+                logger.exception(f"Callback {row.pk} for {row.merchant_trade_no} failed")
+                row.last_error = str(e)[:1000]
+                if row.attempts >= MAX_ATTEMPTS:
+                    row.status = 'failed'
+                else:
+                    row.available_at = now + RETRY_DELAY * 2 ** (row.attempts - 1)
+            else:
+                row.status = 'done'
+                row.processed_at = timezone.now()
+            row.save(update_fields=['attempts', 'status', 'last_error', 'available_at', 'processed_at'])
+    return len(rows), failed
+
+
+def drain(batch_size=50):
+    """
+    Process batches until no pending callback is left for this worker.
+
+    Returns:
+        tuple: (rows processed, rows that failed)
+    """
+    total = failures = 0
+    while True:
+        claimed, failed = process_batch(batch_size)
+        total += claimed
+        failures += failed
+        # A short batch means the inbox is drained (or the rest is locked by another worker)
+        if claimed < batch_size:
+            return total, failures
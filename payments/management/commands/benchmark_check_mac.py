@@ -0,0 +1,103 @@
+"""
+Management command to benchmark the CheckMacValue encoder.
+
+Times the reference algorithm and CheckMacEncoder on typical payment and
+callback payloads, after checking that both give the same value for each.
+"""
+
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from payments.checkmac import CheckMacEncoder, reference_check_mac_value
+
+HASH_KEY = 'pwFHCqoQZGmho4w6'
+HASH_IV = 'EkRm7iFT261dpevs'
+
+PAYLOADS = {
+    'payment form': {
+        'MerchantID': '3002607',
+        'MerchantTradeNo': 'ES20261019120000AB',
+        'MerchantTradeDate': '2026/10/19 12:00:00',
+        'PaymentType': 'aio',
+        'TotalAmount': 3980,
+        'TradeDesc': '訂單 ORD-20261019-00042',
+        'ItemName': '和牛 A5 雪花牛排 500g#伊比利豬梅花 300g 等3項商品',
+        'ReturnURL': 'https://shop.example.com/payments/ecpay/callback/',
+        'ChoosePayment': 'Credit',
+        'ClientBackURL': 'https://shop.example.com/orders/42/',
+        'OrderResultURL': 'https://shop.example.com/payments/result/',
+        'NeedExtraPaidInfo': 'Y',
+        'InvoiceMark': 'N',
+    },
+    'callback': {
+        'MerchantID': '3002607',
+        'MerchantTradeNo': 'ES20261019120000AB',
+        'RtnCode': '1',
+        'RtnMsg': 'Succeeded',
+        'TradeNo': '2310191200001234',
+        'TradeAmt': '3980',
+        'PaymentDate': '2026/10/19 12:00:30',
+        'PaymentType': 'Credit_CreditCard',
+        'PaymentTypeChargeFee': '80',
+        'TradeDate': '2026/10/19 12:00:00',
+        'SimulatePaid': '0',
+        'CheckMacValue': '0' * 64,
+    },
+}
+
+
+def random_payload(rng):
+    """A payload with random printable ASCII and CJK values, for parity checks."""
+    alphabet = string.printable + '中文測試商品訂單（）。，'
+    return {
+        ''.join(rng.choices(string.ascii_letters, k=rng.randint(3, 20))):
+            ''.join(rng.choices(alphabet, k=rng.randint(0, 40)))
+        for _ in range(rng.randint(1, 20))
+    }
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the CheckMacValue encoder against the reference algorithm'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=20000,
+            help='Calls timed per payload and implementation (default: 20000)',
+        )
+        parser.add_argument(
+            '--fuzz',
+            type=int,
+            default=1000,
+            help='Random payloads checked for identical output first (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        encoder = CheckMacEncoder(HASH_KEY, HASH_IV)
+        rng = random.Random(0)
+        samples = list(PAYLOADS.values()) + [random_payload(rng) for _ in range(options['fuzz'])]
+        for payload in samples:
+            if encoder(payload) != reference_check_mac_value(payload, HASH_KEY, HASH_IV):
+                raise CommandError(f'Output differs from the reference for {payload!r}')
+        self.stdout.write(f'Identical output on {len(samples)} payloads')
+
+        iterations = options['iterations']
+        for name, payload in PAYLOADS.items():
+            timings = {}
+            for label, func in (
+                ('reference', lambda: reference_check_mac_value(payload, HASH_KEY, HASH_IV)),
+                ('encoder', lambda: encoder(payload)),
+            ):
+                started = time.perf_counter()
+                for _ in range(iterations):
+                    func()
+                timings[label] = (time.perf_counter() - started) / iterations
+            self.stdout.write(
+                f"{name:<14} reference {timings['reference'] * 1e6:7.2f} µs  "
+                f"encoder {timings['encoder'] * 1e6:7.2f} µs  "
+                f"speedup {timings['reference'] / timings['encoder']:.2f}x"
+            )
+        self.stdout.write(self.style.SUCCESS('Benchmark complete'))
@@ -0,0 +1,84 @@
+"""
+Management command to run a local ECPay gateway simulator.
+
+Start it, then run the shop with ECPAY_API_HOST pointing at it, e.g.
+ECPAY_API_HOST=http://127.0.0.1:8001. Payment forms, callbacks, trade
+queries and refunds then go through the simulator instead of ECPay.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from payments.simulator import ECPaySimulator, SimulatorConfig
+
+
+def rate(value):
+    value = float(value)
+    if not 0 <= value <= 1:
+        raise ValueError(value)
+    return value
+
+
+class Command(BaseCommand):
+    help = 'Run a local ECPay gateway simulator for end-to-end and load tests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1)')
+        parser.add_argument('--port', type=int, default=8001, help='Port to listen on (default: 8001)')
+        parser.add_argument(
+            '--latency',
+            type=float,
+            nargs=2,
+            default=(0.0, 0.0),
+            metavar=('MIN', 'MAX'),
+            help='Seconds of random delay added to every response (default: 0 0)',
+        )
+        parser.add_argument('--failure-rate', type=rate, default=0.0,
+                            help='Share of payments that fail (default: 0)')
+        parser.add_argument('--error-rate', type=rate, default=0.0,
+                            help='Share of query and refund calls answered with HTTP 503 (default: 0)')
+        parser.add_argument('--duplicate-rate', type=rate, default=0.0,
+                            help='Share of trades with a notification delivered twice (default: 0)')
+        parser.add_argument('--out-of-order-rate', type=rate, default=0.0,
+                            help='Share of trades whose notifications arrive last-first (default: 0)')
+        parser.add_argument('--callback-delay', type=float, default=1.0,
+                            help='Seconds before each payment notification is sent (default: 1)')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed, to repeat a run')
+        parser.add_argument('--hash-key', default=None, help='HashKey (default: ECPAY_HASH_KEY)')
+        parser.add_argument('--hash-iv', default=None, help='HashIV (default: ECPAY_HASH_IV)')
+
+    def handle(self, *args, **options):
+        hash_key = options['hash_key'] or settings.ECPAY_HASH_KEY
+        hash_iv = options['hash_iv'] or settings.ECPAY_HASH_IV
+        if not hash_key or not hash_iv:
+            raise CommandError('Set ECPAY_HASH_KEY and ECPAY_HASH_IV, or pass --hash-key and --hash-iv')
+
+        config = SimulatorConfig(
+            hash_key=hash_key,
+            hash_iv=hash_iv,
+            merchant_id=settings.ECPAY_MERCHANT_ID,
+            latency=tuple(options['latency']),
+            failure_rate=options['failure_rate'],
+            error_rate=options['error_rate'],
+            duplicate_rate=options['duplicate_rate'],
+            out_of_order_rate=options['out_of_order_rate'],
+            callback_delay=options['callback_delay'],
+            seed=options['seed'],
+        )
+        simulator = ECPaySimulator(config, host=options['host'], port=options['port'])
+        self.stdout.write(f'ECPay simulator listening on {simulator.url}')
+        self.stdout.write(f'Run the shop with ECPAY_API_HOST={simulator.url}')
+
+        start_time = time.time()
+        try:
+            simulator.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            simulator.close()
+
+        stats = ', '.join(f'{name} {count}' for name, count in simulator.stats.items())
+        self.stdout.write(self.style.SUCCESS(
+            f'Simulator stopped after {time.time() - start_time:.0f}s: {stats}'
+        ))
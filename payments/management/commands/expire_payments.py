@@ -0,0 +1,45 @@
+"""
+Management command to expire unpaid ATM, CVS and BARCODE payments.
+
+Cheap when there is nothing to do; meant to run every minute.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from payments.expiry import expire_payments_batch
+
+
+class Command(BaseCommand):
+    help = 'Fail payments past their ATM/CVS/BARCODE deadline and cancel their orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Payments expired per transaction (default: 500)',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            self.stderr.write(self.style.ERROR('--batch-size must be at least 1'))
+            return
+
+        started = time.monotonic()
+        expired = cancelled = 0
+        while True:
+            batch, orders = expire_payments_batch(batch_size=batch_size)
+            expired += batch
+            cancelled += orders
+            # A short batch means the backlog is drained (or the rest is locked elsewhere)
+            if batch < batch_size:
+                break
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Expired {expired} payments, cancelled {cancelled} orders ({elapsed:.2f}s)'
+            )
+        )
@@ -0,0 +1,81 @@
+"""
+Management command to process queued ECPay callbacks.
+"""
+
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from payments.inbox import drain
+
+
+class Command(BaseCommand):
+    help = 'Process ECPay callbacks queued in the callback inbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help='Callbacks claimed per transaction (default: 50)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Worker threads draining the inbox in parallel (default: 1)',
+        )
+        parser.add_argument(
+            '--forever',
+            action='store_true',
+            help='Keep polling the inbox instead of exiting once it is empty',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help='Seconds to wait between polls with --forever (default: 1)',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1 or options['workers'] < 1:
+            self.stderr.write(self.style.ERROR('--batch-size and --workers must be at least 1'))
+            return
+
+        totals = {'processed': 0, 'failed': 0}
+        lock = threading.Lock()
+
+        def work():
+            while True:
+                processed, failed = drain(batch_size)
+                with lock:
+                    totals['processed'] += processed
+                    totals['failed'] += failed
+                if not options['forever']:
+                    return
+                if not processed:
+                    time.sleep(options['poll_interval'])
+
+        def thread_work():
+            try:
+                work()
+            finally:
+                # Each thread opened its own database connection
+                connection.close()
+
+        started = time.monotonic()
+        if options['workers'] == 1:
+            work()
+        else:
+            threads = [threading.Thread(target=thread_work) for _ in range(options['workers'])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {totals['processed']} callbacks, {totals['failed']} failed ({elapsed:.2f}s)"
+        ))
@@ -0,0 +1,81 @@
+"""
+Management command to reconcile unfinished payments with ECPay.
+"""
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from payments.reconciliation import reconcile_payments
+
+
+class Command(BaseCommand):
+    help = 'Query ECPay for pending payments whose callback never arrived and sync their status'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Payments queried and applied per transaction (default: 100)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Concurrent ECPay queries (default: 4)',
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=5.0,
+            help='Maximum ECPay queries per second across all workers (default: 5)',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            help='Stop after this many payments',
+        )
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=15,
+            help='Skip payments created in the last N minutes (default: 15)',
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=10,
+            help='Skip payments reconciled in the last N minutes, so a rerun resumes (default: 10)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report mismatches without changing any payment',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['workers'] < 1 or options['rate'] <= 0:
+            self.stderr.write(self.style.ERROR('--batch-size, --workers and --rate must be positive'))
+            return
+
+        stats = reconcile_payments(
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            rate=options['rate'],
+            limit=options['limit'],
+            dry_run=options['dry_run'],
+            min_age=timedelta(minutes=options['min_age']),
+            interval=timedelta(minutes=options['interval']),
+        )
+
+        for payment_id, reason in stats.mismatches:
+            self.stdout.write(f'{payment_id}: {reason}')
+
+        prefix = '[dry run] ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}Checked {stats.checked} payments: {stats.paid} paid, {stats.failed} failed, '
+            f'{stats.unchanged} unchanged, {stats.errors} query errors, '
+            f'{len(stats.mismatches)} mismatches ({stats.elapsed:.2f}s, {stats.rate:.1f}/s)'
+        ))
+        if stats.last_id is not None:
+            self.stdout.write(f'Last payment id: {stats.last_id}')
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.24 on 2026-10-19 11:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='reconciled_at',
+            field=models.DateTimeField(blank=True, help_text='最後一次向ECPay查詢交易狀態的時間 / Last time the trade status was queried from ECPay', null=True, verbose_name='最後對帳時間 / Last Reconciled At'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.24 on 2026-10-19 11:11
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0002_payment_reconciled_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CallbackInbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('merchant_trade_no', models.CharField(max_length=20, verbose_name='ECPay商店交易編號 / ECPay Merchant Trade No')),
+                ('trade_no', models.CharField(blank=True, max_length=20, verbose_name='ECPay交易編號 / ECPay Trade No')),
+                ('rtn_code', models.CharField(blank=True, max_length=20, verbose_name='回傳代碼 / Return Code')),
+                ('payload', models.JSONField(verbose_name='回調資料 / Callback Payload')),
+                ('status', models.CharField(choices=[('pending', '待處理 / Pending'), ('done', '已處理 / Done'), ('failed', '處理失敗 / Failed')], default='pending', max_length=20, verbose_name='處理狀態 / Status')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='處理次數 / Attempts')),
+                ('last_error', models.TextField(blank=True, verbose_name='最後錯誤 / Last Error')),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True, verbose_name='IP地址 / IP Address')),
+                ('user_agent', models.TextField(blank=True, verbose_name='用戶代理 / User Agent')),
+                ('received_at', models.DateTimeField(auto_now_add=True, verbose_name='接收時間 / Received At')),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, help_text='失敗後延後重試的時間 / When a failed row may be retried', verbose_name='可處理時間 / Available At')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='處理時間 / Processed At')),
+            ],
+            options={
+                'verbose_name': '回調佇列 / Callback Inbox',
+                'verbose_name_plural': '回調佇列 / Callback Inbox',
+                'ordering': ['-received_at'],
+                'indexes': [models.Index(fields=['status', 'available_at'], name='payments_ca_status_42eb28_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='callbackinbox',
+            constraint=models.UniqueConstraint(fields=('merchant_trade_no', 'trade_no', 'rtn_code'), name='unique_callback_notification'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.24 on 2026-10-19 11:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0003_callback_inbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserAgent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(help_text='用戶代理字串的SHA-256 / SHA-256 of the user agent string', max_length=64, unique=True, verbose_name='雜湊值 / Digest')),
+                ('text', models.TextField(verbose_name='用戶代理 / User Agent')),
+            ],
+            options={
+                'verbose_name': '用戶代理 / User Agent',
+                'verbose_name_plural': '用戶代理 / User Agents',
+            },
+        ),
+        migrations.AddField(
+            model_name='paymentlog',
+            name='agent',
+            field=models.ForeignKey(blank=True, help_text='新日誌的用戶代理存於共用表 / New logs store the user agent in a shared table', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='payments.useragent', verbose_name='用戶代理 / User Agent'),
+        ),
+    ]
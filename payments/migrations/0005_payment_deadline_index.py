@@ -0,0 +1,17 @@
+# Generated by Django 4.2.24 on 2026-10-19 11:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0004_payment_log_user_agents'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['status', 'payment_deadline'], name='payments_pa_status_c60e0d_idx'),
+        ),
+    ]
@@ -10,6 +10,8 @@ from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from orders.models import Order
+from orders.inventory import commit_reservations, release_reservations
+from .status_events import notify_status_change
 
 User = get_user_model()
 
@@ -230,6 +232,13 @@ class Payment(models.Model):
         blank=True
     )
     
+    reconciled_at = models.DateTimeField(
+        _('最後對帳時間 / Last Reconciled At'),
+        null=True,
+        blank=True,
+        help_text=_('最後一次向ECPay查詢交易狀態的時間 / Last time the trade status was queried from ECPay')
+    )
+    
     class Meta:
         verbose_name = _('付款記錄 / Payment')
         verbose_name_plural = _('付款記錄 / Payments')
@@ -241,6 +250,7 @@ class Payment(models.Model):
             models.Index(fields=['ecpay_trade_no']),
             models.Index(fields=['status']),
             models.Index(fields=['user', '-created_at']),
+            models.Index(fields=['status', 'payment_deadline']),
         ]
     
     def __str__(self):
@@ -280,6 +290,11 @@ class Payment(models.Model):
         self.order.save(update_fields=['payment_status'])
         
         self.save()
+        
+        # Held stock now belongs to the order
+        commit_reservations(self.order)
+        
+        notify_status_change(self)
     
     def mark_as_failed(self, reason=''):
         """Mark payment as failed."""
@@ -290,6 +305,11 @@ class Payment(models.Model):
         self.order.save(update_fields=['payment_status'])
         
         self.save()
+        
+        # Return held stock to the shelf
+        release_reservations(self.order)
+        
+        notify_status_change(self)
     
     def can_refund(self):
         """Check if payment can be refunded."""
@@ -303,6 +323,30 @@ class Payment(models.Model):
         return self.amount - self.refund_amount
 
 
+class UserAgent(models.Model):
+    """
+    Distinct user agent strings, stored once and referenced by payment logs.
+    """
+    
+    digest = models.CharField(
+        _('雜湊值 / Digest'),
+        max_length=64,
+        unique=True,
+        help_text=_('用戶代理字串的SHA-256 / SHA-256 of the user agent string')
+    )
+    
+    text = models.TextField(
+        _('用戶代理 / User Agent')
+    )
+    
+    class Meta:
+        verbose_name = _('用戶代理 / User Agent')
+        verbose_name_plural = _('用戶代理 / User Agents')
+    
+    def __str__(self):
+        return self.text[:80]
+
+
 class PaymentLog(models.Model):
     """
     Detailed logs of payment transactions and ECPay communications.
@@ -363,6 +407,16 @@ class PaymentLog(models.Model):
         help_text=_('瀏覽器用戶代理字符串 / Browser user agent string')
     )
     
+    agent = models.ForeignKey(
+        UserAgent,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name=_('用戶代理 / User Agent'),
+        help_text=_('新日誌的用戶代理存於共用表 / New logs store the user agent in a shared table')
+    )
+    
     created_at = models.DateTimeField(
         _('建立時間 / Created At'),
         auto_now_add=True
@@ -380,6 +434,11 @@ class PaymentLog(models.Model):
     
     def __str__(self):
         return f"{self.payment.payment_id} - {self.log_type} - {self.created_at}"
+    
+    @property
+    def user_agent_text(self):
+        """User agent of the request, from the shared table or the legacy column."""
+        return self.agent.text if self.agent_id else self.user_agent
 
 
 class RefundRecord(models.Model):
@@ -477,3 +536,99 @@ class RefundRecord(models.Model):
             self.refund_id = f"REF-{timestamp}-{random_suffix}"
         
         super().save(*args, **kwargs)
+
+
+class CallbackInbox(models.Model):
+    """
+    ECPay callbacks stored on arrival and processed later by a worker.
+    ECPay retries of the same notification map to the same row.
+    """
+    
+    STATUS_CHOICES = [
+        ('pending', _('待處理 / Pending')),
+        ('done', _('已處理 / Done')),
+        ('failed', _('處理失敗 / Failed')),
+    ]
+    
+    merchant_trade_no = models.CharField(
+        _('ECPay商店交易編號 / ECPay Merchant Trade No'),
+        max_length=20
+    )
+    
+    trade_no = models.CharField(
+        _('ECPay交易編號 / ECPay Trade No'),
+        max_length=20,
+        blank=True
+    )
+    
+    rtn_code = models.CharField(
+        _('回傳代碼 / Return Code'),
+        max_length=20,
+        blank=True
+    )
+    
+    payload = models.JSONField(
+        _('回調資料 / Callback Payload')
+    )
+    
+    status = models.CharField(
+        _('處理狀態 / Status'),
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='pending'
+    )
+    
+    attempts = models.PositiveIntegerField(
+        _('處理次數 / Attempts'),
+        default=0
+    )
+    
+    last_error = models.TextField(
+        _('最後錯誤 / Last Error'),
+        blank=True
+    )
+    
+    ip_address = models.GenericIPAddressField(
+        _('IP地址 / IP Address'),
+        null=True,
+        blank=True
+    )
+    
+    user_agent = models.TextField(
+        _('用戶代理 / User Agent'),
+        blank=True
+    )
+    
+    received_at = models.DateTimeField(
+        _('接收時間 / Received At'),
+        auto_now_add=True
+    )
+    
+    available_at = models.DateTimeField(
+        _('可處理時間 / Available At'),
+        default=timezone.now,
+        help_text=_('失敗後延後重試的時間 / When a failed row may be retried')
+    )
+    
+    processed_at = models.DateTimeField(
+        _('處理時間 / Processed At'),
+        null=True,
+        blank=True
+    )
+    
+    class Meta:
+        verbose_name = _('回調佇列 / Callback Inbox')
+        verbose_name_plural = _('回調佇列 / Callback Inbox')
+        ordering = ['-received_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['merchant_trade_no', 'trade_no', 'rtn_code'],
+                name='unique_callback_notification',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'available_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.merchant_trade_no} - {self.rtn_code} - {self.status}"
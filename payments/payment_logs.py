@@ -0,0 +1,185 @@
+"""
+PaymentLog writer with buffering, payload compaction and shared user agents.
+付款日誌寫入
+
+log_payment() is the one way payment code records a PaymentLog:
+
+- callback and error rows are written at once; they are the audit trail
+  of money moving. request, response and info rows join a per-process
+  buffer when their transaction commits, and are written with one
+  bulk_create when the buffer holds PAYMENT_LOG_BUFFER_SIZE rows, when a
+  request finishes and the oldest row is PAYMENT_LOG_FLUSH_SECONDS old,
+  or on flush(). Their created_at is the flush time;
+- payloads are compacted before storage: MerchantID (always ours),
+  CheckMacValue (already verified) and empty values are dropped;
+- user agent strings are stored once in UserAgent and referenced by id.
+
+Old rows are archived with the other log tables by orders.archiving
+(archive_tables), after ARCHIVE_RETENTION_MONTHS['payments.PaymentLog'].
+
+Buffered rows live in memory until flushed, so a process killed outright
+can lose its last few non-critical rows.
+"""
+
+import atexit
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .models import PaymentLog, UserAgent
+
+logger = logging.getLogger(__name__)
+
+# Written immediately, never buffered
+CRITICAL_LOG_TYPES = frozenset({'callback', 'error'})
+
+# Payload keys that carry nothing worth keeping per row
+REDUNDANT_KEYS = frozenset({'MerchantID', 'CheckMacValue'})
+
+# User agent ids kept in memory per process
+AGENT_CACHE_SIZE = 1000
+
+
+def compact_payload(data):
+    """Drop redundant keys and empty values from a request or response payload."""
+    if not isinstance(data, dict):
+        return data
+    return {
+        key: value for key, value in data.items()
+        if key not in REDUNDANT_KEYS and value not in ('', None)
+    }
+
+
+_agent_lock = threading.Lock()
+_agent_ids = {}
+
+
+def get_agent_id(text):
+    """Return the UserAgent id for a user agent string, creating it if needed."""
+    if not text:
+        return None
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    with _agent_lock:
+        agent_id = _agent_ids.get(digest)
+    if agent_id is not None:
+        return agent_id
+
+    UserAgent.objects.bulk_create([UserAgent(digest=digest, text=text)], ignore_conflicts=True)
+    agent_id = UserAgent.objects.filter(digest=digest).values_list('id', flat=True).first()
+    with _agent_lock:
+        if len(_agent_ids) >= AGENT_CACHE_SIZE:
+            _agent_ids.clear()
+        _agent_ids[digest] = agent_id
+    return agent_id
+
+
+def clear_agent_cache():
+    """Forget cached user agent ids (tests, after purging UserAgent)."""
+    with _agent_lock:
+        _agent_ids.clear()
+
+
+class LogBuffer:
+    """Process-wide buffer of PaymentLog rows waiting for bulk_create."""
+
+    def __init__(self):
+        self.rows = []
+        self.oldest = None
+        self._lock = threading.Lock()
+
+    def add(self, row):
+        with self._lock:
+            if not self.rows:
+                self.oldest = time.monotonic()
+            self.rows.append(row)
+            full = len(self.rows) >= get_buffer_size()
+        if full:
+            self.flush()
+
+    def is_due(self):
+        with self._lock:
+            return bool(self.rows) and time.monotonic() - self.oldest >= get_flush_seconds()
+
+    def flush(self):
+        """Write every buffered row. Returns the number written."""
+        with self._lock:
+            rows, self.rows, self.oldest = self.rows, [], None
+        if not rows:
+            return 0
+        try:
+            with transaction.atomic():
+                PaymentLog.objects.bulk_create(rows)
+            return len(rows)
+        except IntegrityError:
+            # A row points at a payment that was rolled back; save the rest one by one
+            written = 0
+            for row in rows:
+                try:
+                    with transaction.atomic():
+                        row.save()
+                    written += 1
+                except IntegrityError:
+                    logger.warning(f"Dropped payment log for missing payment {row.payment_id}")
+            return written
+
+
+def get_buffer_size():
+    return max(1, getattr(settings, 'PAYMENT_LOG_BUFFER_SIZE', 50))
+
+
+def get_flush_seconds():
+    return getattr(settings, 'PAYMENT_LOG_FLUSH_SECONDS', 5)
+
+
+_buffer = LogBuffer()
+
+
+def log_payment(payment, log_type, message, request_data=None, response_data=None,
+                ip_address=None, user_agent=''):
+    """
+    Record a PaymentLog row, buffered unless the log type is critical.
+    記錄付款日誌
+
+    Returns:
+        PaymentLog: The row (not yet saved if it was buffered)
+    """
+    row = PaymentLog(
+        payment=payment,
+        log_type=log_type,
+        message=message,
+        request_data=compact_payload(request_data),
+        response_data=compact_payload(response_data),
+        ip_address=ip_address,
+        agent_id=get_agent_id(user_agent),
+    )
+    if log_type in CRITICAL_LOG_TYPES:
+        row.save()
+    else:
+        # Buffer only once the payment it points at is committed
+        transaction.on_commit(lambda: _buffer.add(row))
+    return row
+
+
+def flush():
+    """Write buffered rows now. Returns the number written."""
+    return _buffer.flush()
+
+
+def flush_if_due(**kwargs):
+    """request_finished receiver: flush once the oldest buffered row is old enough."""
+    if _buffer.is_due():
+        _buffer.flush()
+
+
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        logger.exception("Could not flush payment logs at exit")
+
+
+atexit.register(_flush_at_exit)
@@ -0,0 +1,195 @@
+"""
+Batch reconciliation of unfinished payments against ECPay.
+付款對帳
+
+Payments still pending or processing after a grace period (the customer
+may still be on the ECPay page) are read in id order, one chunk at a time.
+Each chunk is queried with QueryTradeInfo from a bounded thread pool; the
+worker threads only do HTTP, and a shared token bucket caps the request
+rate across all of them. The answers are then applied in one transaction
+per chunk through PaymentService.apply_result, the same path a callback
+takes, after re-checking each row under a lock in case its callback
+arrived meanwhile.
+
+Every payment ECPay answered for gets reconciled_at stamped, and a run
+skips payments reconciled within the last interval, so an interrupted run
+can simply be started again. Payments whose query failed are left
+unstamped and are tried again on the next run.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Payment
+from .payment_logs import flush as flush_payment_logs
+from .services import PaymentService
+
+RECONCILE_STATUSES = ('pending', 'processing')
+
+# QueryTradeInfo TradeStatus values
+TRADE_UNPAID = '0'
+TRADE_PAID = '1'
+TRADE_NOT_FOUND = '10200047'
+
+
+class RateLimiter:
+    """Thread-safe token bucket allowing rate calls per second."""
+
+    def __init__(self, rate, burst=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, rate))
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a call may be made."""
+        while True:
+            with self._lock:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+
+class ReconcileStats:
+    """Counters and mismatches of one reconciliation run."""
+
+    def __init__(self):
+        self.checked = 0
+        self.paid = 0
+        self.failed = 0
+        self.unchanged = 0
+        self.errors = 0
+        self.mismatches = []
+        self.last_id = None
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        return self.checked / self.elapsed if self.elapsed else 0.0
+
+
+def payments_to_reconcile(now=None, min_age=timedelta(minutes=15), interval=timedelta(minutes=10)):
+    """Return unfinished payments old enough to check and not checked recently."""
+    now = now or timezone.now()
+    queryset = Payment.objects.filter(
+        status__in=RECONCILE_STATUSES, created_at__lte=now - min_age
+    )
+    recent = now - interval
+    return queryset.exclude(reconciled_at__gt=recent).order_by('id')
+
+
+def classify(payment, result):
+    """
+    Decide what a query result means for a payment.
+
+    Returns:
+        tuple: (action, reason) where action is 'paid', 'failed' or None
+        and reason explains a mismatch or skip (empty when none)
+    """
+    if not result['verified']:
+        return None, 'CheckMacValue mismatch'
+    status = result['trade_status']
+    if status == TRADE_NOT_FOUND or not status:
+        return None, 'not found at ECPay'
+    if status == TRADE_UNPAID:
+        return None, ''
+    if status == TRADE_PAID:
+        try:
+            amount = Decimal(result['trade_amt'])
+        except ArithmeticError:
+            amount = None
+        # Payments are sent to ECPay as whole dollars
+        if amount != int(payment.amount):
+            return None, f"amount {result['trade_amt']} != {payment.amount}"
+        return 'paid', 'paid at ECPay'
+    return 'failed', f'trade status {status}'
+
+
+def _apply_chunk(service, chunk, answers, stats, dry_run, now):
+    with transaction.atomic():
+        locked = {
+            p.id: p for p in Payment.objects.select_for_update()
+            .select_related('order').filter(id__in=[p.id for p in chunk])
+        }
+        for payment in chunk:
+            data = answers.get(payment.id)
+            stats.checked += 1
+            if data is None:
+                stats.errors += 1
+                continue
+            result = service.ecpay.process_query_result(data)
+            action, reason = classify(payment, result)
+            if reason and action is None:
+                stats.mismatches.append((payment.payment_id, reason))
+            current = locked.get(payment.id)
+            if action is None or current is None or current.status not in RECONCILE_STATUSES:
+                stats.unchanged += 1
+                continue
+            stats.mismatches.append((payment.payment_id, f'{current.status} locally, {reason}'))
+            if not dry_run:
+                result['success'] = action == 'paid'
+                service.apply_result(
+                    current, result,
+                    log_type='response',
+                    message=f'Reconciled with ECPay QueryTradeInfo - {reason}',
+                    request_data={'MerchantTradeNo': payment.ecpay_merchant_trade_no},
+                )
+            setattr(stats, action, getattr(stats, action) + 1)
+        if not dry_run:
+            # Failed queries were never checked, so the next run picks them up again
+            answered = [p.id for p in chunk if answers.get(p.id) is not None]
+            Payment.objects.filter(id__in=answered).update(reconciled_at=now)
+
+
+def reconcile_payments(batch_size=100, workers=4, rate=5.0, limit=None, dry_run=False,
+                       min_age=timedelta(minutes=15), interval=timedelta(minutes=10), now=None):
+    """
+    Reconcile unfinished payments with ECPay.
+    向綠界查詢未完成付款並同步狀態
+
+    Returns:
+        ReconcileStats: Counts, mismatches (payment_id, reason) and throughput
+    """
+    now = now or timezone.now()
+    service = PaymentService()
+    limiter = RateLimiter(rate)
+    stats = ReconcileStats()
+    queryset = payments_to_reconcile(now, min_age=min_age, interval=interval)
+
+    def query(merchant_trade_no):
+        limiter.acquire()
+        return service.ecpay.query_trade_info(merchant_trade_no)
+
+    last_id = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while limit is None or stats.checked < limit:
+            size = batch_size if limit is None else min(batch_size, limit - stats.checked)
+            chunk = list(queryset.filter(id__gt=last_id)[:size])
+            if not chunk:
+                break
+            answers = dict(zip(
+                (p.id for p in chunk),
+                pool.map(query, [p.ecpay_merchant_trade_no for p in chunk]),
+            ))
+            _apply_chunk(service, chunk, answers, stats, dry_run, now)
+            flush_payment_logs()
+            last_id = stats.last_id = chunk[-1].id
+    return stats
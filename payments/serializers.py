@@ -77,6 +77,7 @@ class PaymentLogSerializer(serializers.ModelSerializer):
     
     payment_id = serializers.CharField(source='payment.payment_id', read_only=True)
     log_type_display = serializers.CharField(source='get_log_type_display', read_only=True)
+    user_agent = serializers.CharField(source='user_agent_text', read_only=True)
     
     class Meta:
         model = PaymentLog
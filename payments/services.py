@@ -3,20 +3,22 @@ ECPay payment service for Taiwan e-commerce platform.
 Handles ECPay API integration, payment processing, and callback verification.
 """
 
-import hashlib
 import urllib.parse
 from datetime import datetime, timedelta
 from decimal import Decimal
 from typing import Dict, Any, Optional
-import requests
 import logging
 from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 from django.urls import reverse
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import pad, unpad
 import base64
 
+from .checkmac import get_encoder
+from .gateway import CircuitOpenError, GatewayError, get_client
+
 logger = logging.getLogger(__name__)
 
 
@@ -43,6 +45,8 @@ class ECPayService:
         self.sandbox = getattr(settings, 'ECPAY_SANDBOX', True)
         
         self.host = self.SANDBOX_HOST if self.sandbox else self.PRODUCTION_HOST
+        # Point everything at another host, e.g. the ecpay_simulator command
+        self.host = getattr(settings, 'ECPAY_API_HOST', '') or self.host
         
         if not all([self.merchant_id, self.hash_key, self.hash_iv]):
             raise ValueError("ECPay credentials not properly configured")
@@ -51,30 +55,9 @@ class ECPayService:
         """
         Generate CheckMacValue for ECPay API requests.
         This is ECPay's security mechanism to verify request integrity.
+        See payments.checkmac for the algorithm.
         """
-        # Remove CheckMacValue if exists
-        params = {k: v for k, v in parameters.items() if k != 'CheckMacValue'}
-        
-        # Sort parameters by key
-        sorted_params = sorted(params.items())
-        
-        # Create query string
-        query_string = '&'.join([f"{k}={v}" for k, v in sorted_params])
-        
-        # Add HashKey and HashIV
-        raw_string = f"HashKey={self.hash_key}&{query_string}&HashIV={self.hash_iv}"
-        
-        # URL encode
-        encoded_string = urllib.parse.quote_plus(raw_string, safe='')
-        
-        # Convert to lowercase
-        encoded_string = encoded_string.lower()
-        
-        # Generate SHA256 hash
-        hash_value = hashlib.sha256(encoded_string.encode('utf-8')).hexdigest()
-        
-        # Convert to uppercase
-        return hash_value.upper()
+        return get_encoder(self.hash_key, self.hash_iv)(parameters)
     
     def verify_callback_mac(self, callback_data: Dict[str, Any]) -> bool:
         """
@@ -114,6 +97,8 @@ class ECPayService:
             'IgnorePayment': payment_data.get('ignore_payment', ''),
             'PlatformID': payment_data.get('platform_id', ''),
             'InvoiceMark': 'N',  # 不開發票
+            'ExpireDate': payment_data.get('expire_date', ''),
+            'StoreExpireDate': payment_data.get('store_expire_date', ''),
             'CustomField1': payment_data.get('custom_field_1', ''),
             'CustomField2': payment_data.get('custom_field_2', ''),
             'CustomField3': payment_data.get('custom_field_3', ''),
@@ -129,6 +114,27 @@ class ECPayService:
         
         return form_data
     
+    def get_payment_expiry(self, payment_method: str, start: datetime):
+        """
+        How long an ATM, CVS or BARCODE payment code stays valid.
+        
+        Returns:
+            tuple: (payment_data fields asking ECPay for that period, deadline),
+            or ({}, None) for methods paid on the spot
+        """
+        if payment_method == 'ATM':
+            # ATM codes are valid to the end of the last day
+            days = getattr(settings, 'ECPAY_ATM_EXPIRE_DAYS', 3)
+            deadline = timezone.localtime(start) + timedelta(days=days)
+            return {'expire_date': days}, deadline.replace(hour=23, minute=59, second=59, microsecond=0)
+        if payment_method == 'CVS':
+            minutes = getattr(settings, 'ECPAY_CVS_EXPIRE_MINUTES', 10080)
+            return {'store_expire_date': minutes}, start + timedelta(minutes=minutes)
+        if payment_method == 'BARCODE':
+            days = getattr(settings, 'ECPAY_BARCODE_EXPIRE_DAYS', 7)
+            return {'store_expire_date': days}, start + timedelta(days=days)
+        return {}, None
+    
     def get_payment_url(self) -> str:
         """Get ECPay payment URL based on environment."""
         return f"{self.host}{self.CREATE_PAYMENT_ENDPOINT}"
@@ -149,10 +155,9 @@ class ECPayService:
         query_data['CheckMacValue'] = check_mac_value
         
         try:
-            response = requests.post(
-                f"{self.host}{self.QUERY_TRADE_ENDPOINT}",
-                data=query_data,
-                timeout=30
+            # Queries are read-only, so the client may retry them
+            response = get_client(self.host).post(
+                self.QUERY_TRADE_ENDPOINT, query_data, idempotent=True
             )
             
             if response.status_code == 200:
@@ -163,7 +168,10 @@ class ECPayService:
                 logger.error(f"ECPay query failed: {response.status_code} - {response.text}")
                 return None
                 
-        except requests.RequestException as e:
+        except CircuitOpenError as e:
+            logger.warning(f"ECPay query skipped: {str(e)}")
+            return None
+        except GatewayError as e:
             logger.error(f"ECPay query request failed: {str(e)}")
             return None
     
@@ -211,6 +219,29 @@ class ECPayService:
         
         return result
     
+    def process_query_result(self, query_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Normalize a QueryTradeInfo response into the same shape as process_callback.
+        TradeStatus '1' is paid and '0' is still waiting for payment.
+        """
+        result = {
+            'success': False,
+            'verified': self.verify_callback_mac(query_data),
+            'merchant_trade_no': query_data.get('MerchantTradeNo', ''),
+            'trade_no': query_data.get('TradeNo', ''),
+            'trade_status': query_data.get('TradeStatus', ''),
+            'rtn_code': query_data.get('TradeStatus', ''),
+            'rtn_msg': query_data.get('RtnMsg', ''),
+            'trade_date': query_data.get('TradeDate', ''),
+            'payment_date': query_data.get('PaymentDate', ''),
+            'payment_type': query_data.get('PaymentType', ''),
+            'payment_type_charge_fee': query_data.get('PaymentTypeChargeFee', '0'),
+            'trade_amt': query_data.get('TradeAmt', '0'),
+            'auth_code': query_data.get('AuthCode', ''),
+        }
+        result['success'] = result['verified'] and result['trade_status'] == '1'
+        return result
+    
     def create_refund_request(self, refund_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """
         Create refund request to ECPay.
@@ -231,11 +262,7 @@ class ECPayService:
         refund_request['CheckMacValue'] = check_mac_value
         
         try:
-            response = requests.post(
-                f"{self.host}{self.REFUND_ENDPOINT}",
-                data=refund_request,
-                timeout=30
-            )
+            response = get_client(self.host).post(self.REFUND_ENDPOINT, refund_request)
             
             if response.status_code == 200:
                 # Parse response
@@ -245,7 +272,10 @@ class ECPayService:
                 logger.error(f"ECPay refund request failed: {response.status_code} - {response.text}")
                 return None
                 
-        except requests.RequestException as e:
+        except CircuitOpenError as e:
+            logger.warning(f"ECPay refund skipped: {str(e)}")
+            return None
+        except GatewayError as e:
             logger.error(f"ECPay refund request failed: {str(e)}")
             return None
     
@@ -315,7 +345,16 @@ class PaymentService:
         Create a new payment for an order.
         Returns payment form data for frontend submission.
         """
-        from .models import Payment, PaymentLog
+        from orders.inventory import extend_reservations
+        from .expiry import get_grace_period
+        from .models import Payment
+        from .payment_logs import log_payment
+        
+        now = timezone.now()
+        expiry_fields, deadline = self.ecpay.get_payment_expiry(payment_method, now)
+        if deadline:
+            # Hold the stock for as long as the payment code can be paid
+            extend_reservations(order, deadline + get_grace_period())
         
         # Create payment record
         payment = Payment.objects.create(
@@ -323,13 +362,14 @@ class PaymentService:
             user=order.user,
             payment_method=payment_method,
             amount=order.total_amount,
-            currency='TWD'
+            currency='TWD',
+            payment_deadline=deadline,
         )
         
         # Prepare ECPay payment data
         payment_data = {
             'merchant_trade_no': payment.ecpay_merchant_trade_no,
-            'trade_date': timezone.now(),
+            'trade_date': now,
             'amount': payment.amount,
             'description': f"訂單 {order.order_number}",
             'item_name': self._get_order_items_name(order),
@@ -337,14 +377,15 @@ class PaymentService:
             'client_back_url': kwargs.get('client_back_url', ''),
             'payment_method': payment_method,
             'order_result_url': kwargs.get('order_result_url', ''),
+            **expiry_fields,
         }
         
         # Create ECPay form data
         form_data = self.ecpay.create_payment_form_data(payment_data)
         
         # Log the payment creation
-        PaymentLog.objects.create(
-            payment=payment,
+        log_payment(
+            payment,
             log_type='request',
             message='Payment created and ECPay form data generated',
             request_data=form_data,
@@ -364,26 +405,55 @@ class PaymentService:
         """
         Handle ECPay payment callback.
         Updates payment status and order status.
+        
+        Safe to repeat: a payment that is already paid, or already failed when
+        the callback reports a failure, is logged but left unchanged.
         """
-        from .models import Payment, PaymentLog
+        from .models import Payment
         
         # Process callback with ECPay service
         result = self.ecpay.process_callback(callback_data)
         
         # Find payment record
         merchant_trade_no = result.get('merchant_trade_no', '')
-        try:
-            payment = Payment.objects.get(ecpay_merchant_trade_no=merchant_trade_no)
-        except Payment.DoesNotExist:
-            logger.error(f"Payment not found for merchant_trade_no: {merchant_trade_no}")
-            return {'success': False, 'error': 'Payment not found'}
+        with transaction.atomic():
+            try:
+                payment = (
+                    Payment.objects.select_for_update()
+                    .select_related('order')
+                    .get(ecpay_merchant_trade_no=merchant_trade_no)
+                )
+            except Payment.DoesNotExist:
+                logger.error(f"Payment not found for merchant_trade_no: {merchant_trade_no}")
+                return {'success': False, 'error': 'Payment not found'}
+            
+            if payment.status == 'paid' or (payment.status == 'failed' and not result['success']):
+                result['duplicate'] = True
+                logger.info(f"Payment {payment.payment_id} already {payment.status}, callback ignored")
+                return result
+            
+            self.apply_result(
+                payment, result,
+                log_type='callback',
+                message=f"ECPay callback received - Success: {result['success']}",
+                request_data=callback_data,
+                **kwargs
+            )
         
-        # Log the callback
-        PaymentLog.objects.create(
-            payment=payment,
-            log_type='callback',
-            message=f"ECPay callback received - Success: {result['success']}",
-            request_data=callback_data,
+        return result
+    
+    def apply_result(self, payment, result, log_type, message, request_data=None, **kwargs):
+        """
+        Log a normalized ECPay result and update the payment and order.
+        Shared by callbacks and reconciliation so both change state the same way.
+        """
+        from .payment_logs import log_payment
+        
+        log_payment(
+            payment,
+            log_type=log_type,
+            message=message,
+            request_data=request_data,
             response_data=result,
             ip_address=kwargs.get('ip_address'),
             user_agent=kwargs.get('user_agent', '')
@@ -396,8 +466,6 @@ class PaymentService:
         else:
             payment.mark_as_failed(result.get('rtn_msg', ''))
             logger.warning(f"Payment {payment.payment_id} marked as failed: {result.get('rtn_msg', '')}")
-        
-        return result
     
     def query_payment_status(self, payment_id: str) -> Optional[Dict[str, Any]]:
         """
@@ -430,12 +498,6 @@ class PaymentService:
     
     def _build_return_url(self) -> str:
         """Build return URL for ECPay callbacks."""
-        from django.contrib.sites.models import Site
-        
-        try:
-            current_site = Site.objects.get_current()
-            domain = f"https://{current_site.domain}"
-        except:
-            domain = getattr(settings, 'SITE_URL', 'http://localhost:8000')
-        
+        # django.contrib.sites is not installed, so SITE_URL is the source of truth
+        domain = getattr(settings, 'SITE_URL', 'http://localhost:8000').rstrip('/')
         return f"{domain}{reverse('payments:ecpay_callback')}"
\ No newline at end of file
@@ -0,0 +1,307 @@
+"""
+Local stand-in for the ECPay gateway, for end-to-end and load tests.
+綠界金流模擬器
+
+ECPaySimulator serves the three endpoints this project uses:
+
+- Cashier/AioCheckOut/V5 accepts the payment form, checks its
+  CheckMacValue and decides the outcome (failure_rate). The payment
+  notification is then POSTed to the form's ReturnURL after
+  callback_delay, signed with the same key pair; anything but 1|OK is
+  retried like ECPay does. For ATM, CVS and BARCODE payments the "code
+  issued" notification (RtnCode 2 or 10100073) goes first, to the form's
+  PaymentInfoURL when it has one;
+- Cashier/QueryTradeInfo/V5 answers with the trade's current status;
+- CreditDetail/DoAction records refunds (Action R).
+
+Adverse conditions are configurable: latency on every response,
+error_rate (HTTP 503 from query and refund), duplicate_rate (a
+notification delivered twice) and out_of_order_rate (a trade's
+notifications delivered last-first). Randomness comes from a seeded
+Random, so a run can be repeated.
+
+Point the shop at it with ECPAY_API_HOST; the shop's ReturnURL comes from
+SITE_URL, which must be reachable from the simulator.
+"""
+
+import html
+import random
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from django.utils import timezone
+
+from .checkmac import CheckMacEncoder
+from .services import ECPayService
+
+# Payment methods that issue a code first and are paid later
+OFFLINE_METHODS = {'ATM': '2', 'CVS': '10100073', 'BARCODE': '10100073'}
+
+FAILED_RTN_CODE = '10100058'
+
+CALLBACK_ATTEMPTS = 4
+
+
+class SimulatorConfig:
+    """Knobs for ECPaySimulator."""
+
+    def __init__(self, hash_key, hash_iv, merchant_id='', latency=(0.0, 0.0), failure_rate=0.0,
+                 error_rate=0.0, duplicate_rate=0.0, out_of_order_rate=0.0, callback_delay=0.0,
+                 callback_workers=16, seed=None):
+        self.hash_key = hash_key
+        self.hash_iv = hash_iv
+        self.merchant_id = merchant_id
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.error_rate = error_rate
+        self.duplicate_rate = duplicate_rate
+        self.out_of_order_rate = out_of_order_rate
+        self.callback_delay = callback_delay
+        self.callback_workers = callback_workers
+        self.seed = seed
+
+
+class Trade:
+    """One simulated ECPay trade."""
+
+    def __init__(self, form, trade_no, paid):
+        self.merchant_trade_no = form['MerchantTradeNo']
+        self.trade_no = trade_no
+        self.amount = int(form['TotalAmount'])
+        self.payment_type = form.get('ChoosePayment', 'Credit')
+        self.return_url = form['ReturnURL']
+        self.payment_info_url = form.get('PaymentInfoURL', '')
+        self.trade_date = form.get('MerchantTradeDate', '')
+        self.paid = paid
+        self.refunded = 0
+
+
+class ECPaySimulator:
+    """Threaded HTTP server imitating ECPay."""
+
+    def __init__(self, config, host='127.0.0.1', port=0, send=None):
+        self.config = config
+        self.sign = CheckMacEncoder(config.hash_key, config.hash_iv)
+        self.random = random.Random(config.seed)
+        self.trades = {}
+        self.stats = {'checkouts': 0, 'callbacks': 0, 'callback_failures': 0, 'queries': 0,
+                      'refunds': 0, 'errors': 0, 'rejected': 0}
+        self._lock = threading.Lock()
+        self._send = send or self._post_callback
+        self._session = requests.Session()
+        self._pool = ThreadPoolExecutor(max_workers=config.callback_workers)
+        self._serving = False
+
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                form = dict(urllib.parse.parse_qsl(self.rfile.read(length).decode('utf-8')))
+                status, content_type, body = simulator.handle(urllib.parse.urlparse(self.path).path, form)
+                payload = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://{self.server.server_address[0]}:{self.server.server_address[1]}'
+
+    # Server lifecycle
+
+    def start(self):
+        """Serve in a background thread."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def serve_forever(self):
+        self._serving = True
+        self.server.serve_forever()
+
+    def close(self):
+        if self._serving:
+            self.server.shutdown()
+        self.server.server_close()
+        self._pool.shutdown(wait=True)
+        self._session.close()
+
+    # Helpers
+
+    def _chance(self, rate):
+        with self._lock:
+            return self.random.random() < rate
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _signed(self, data):
+        data = dict(data)
+        data['CheckMacValue'] = self.sign(data)
+        return data
+
+    def _valid(self, form):
+        return form.get('CheckMacValue') == self.sign(form)
+
+    def _delay(self):
+        low, high = self.config.latency
+        if high > 0:
+            with self._lock:
+                seconds = self.random.uniform(low, high)
+            time.sleep(seconds)
+
+    # Request handling
+
+    def handle(self, path, form):
+        """Return (HTTP status, content type, body) for one request."""
+        self._delay()
+        if path == ECPayService.CREATE_PAYMENT_ENDPOINT:
+            return self.checkout(form)
+        if path in (ECPayService.QUERY_TRADE_ENDPOINT, ECPayService.REFUND_ENDPOINT):
+            if self._chance(self.config.error_rate):
+                self._count('errors')
+                return 503, 'text/plain', 'Service Unavailable'
+            if not self._valid(form):
+                self._count('rejected')
+                return 200, 'text/plain', 'CheckMacValue Error'
+            if path == ECPayService.QUERY_TRADE_ENDPOINT:
+                return self.query(form)
+            return self.refund(form)
+        return 404, 'text/plain', 'Not Found'
+
+    def checkout(self, form):
+        if not self._valid(form) or 'ReturnURL' not in form or 'MerchantTradeNo' not in form:
+            self._count('rejected')
+            return 400, 'text/html; charset=utf-8', '<p>CheckMacValue Error</p>'
+        with self._lock:
+            if form['MerchantTradeNo'] in self.trades:
+                self.stats['rejected'] += 1
+                return 400, 'text/html; charset=utf-8', '<p>MerchantTradeNo duplicated</p>'
+            self.stats['checkouts'] += 1
+            trade_no = f"{timezone.now():%y%m%d%H%M}{len(self.trades):06d}"
+            paid = self.random.random() >= self.config.failure_rate
+            trade = self.trades[form['MerchantTradeNo']] = Trade(form, trade_no, paid)
+        self._pool.submit(self._notify, trade)
+
+        # Send the browser on like ECPay does after payment
+        target = form.get('OrderResultURL') or form.get('ClientBackURL')
+        if target:
+            page = (
+                f'<form id="f" method="post" action="{html.escape(target)}"></form>'
+                '<script>document.getElementById("f").submit()</script>'
+            )
+        else:
+            page = '<p>Simulated payment accepted</p>'
+        return 200, 'text/html; charset=utf-8', page
+
+    def query(self, form):
+        self._count('queries')
+        trade = self.trades.get(form.get('MerchantTradeNo', ''))
+        if trade is None:
+            data = {'MerchantTradeNo': form.get('MerchantTradeNo', ''), 'TradeStatus': '10200047'}
+        else:
+            data = {
+                'MerchantID': self.config.merchant_id,
+                'MerchantTradeNo': trade.merchant_trade_no,
+                'TradeNo': trade.trade_no,
+                'TradeAmt': str(trade.amount),
+                'TradeDate': trade.trade_date,
+                'PaymentType': self._payment_type(trade),
+                'TradeStatus': '1' if trade.paid else '10200095',
+            }
+        return 200, 'text/plain', urllib.parse.urlencode(self._signed(data))
+
+    def refund(self, form):
+        self._count('refunds')
+        trade = self.trades.get(form.get('MerchantTradeNo', ''))
+        amount = int(form.get('TotalAmount') or 0)
+        with self._lock:
+            if trade is None or not trade.paid or form.get('Action') != 'R' or amount > trade.amount - trade.refunded:
+                data = {'RtnCode': '0', 'RtnMsg': 'Refund rejected'}
+            else:
+                trade.refunded += amount
+                data = {'RtnCode': '1', 'RtnMsg': 'OK'}
+        data.update(MerchantID=self.config.merchant_id, MerchantTradeNo=form.get('MerchantTradeNo', ''),
+                    TradeNo=form.get('TradeNo', ''))
+        return 200, 'text/plain', urllib.parse.urlencode(data)
+
+    # Notifications
+
+    def _payment_type(self, trade):
+        return {'Credit': 'Credit_CreditCard', 'ATM': 'ATM_TAISHIN', 'CVS': 'CVS_CVS',
+                'BARCODE': 'BARCODE_BARCODE'}.get(trade.payment_type, trade.payment_type)
+
+    def notifications(self, trade):
+        """The (url, notification) pairs ECPay would send for a trade, in their real order."""
+        base = {
+            'MerchantID': self.config.merchant_id,
+            'MerchantTradeNo': trade.merchant_trade_no,
+            'TradeNo': trade.trade_no,
+            'TradeAmt': str(trade.amount),
+            'TradeDate': trade.trade_date,
+            'PaymentType': self._payment_type(trade),
+        }
+        messages = []
+        issued = OFFLINE_METHODS.get(trade.payment_type)
+        if issued and trade.payment_info_url:
+            expire = timezone.localtime() + timedelta(days=3)
+            if trade.payment_type == 'ATM':
+                code = {'BankCode': '812', 'vAccount': f'9103522{trade.trade_no[-7:]}',
+                        'ExpireDate': f'{expire:%Y/%m/%d}'}
+            else:
+                code = {'PaymentNo': f'LLL{trade.trade_no[-11:]}', 'ExpireDate': f'{expire:%Y/%m/%d %H:%M:%S}'}
+            messages.append((trade.payment_info_url, dict(
+                base, RtnCode=issued, RtnMsg='Get Payment Info Succeeded', **code,
+            )))
+        if trade.paid:
+            messages.append((trade.return_url, dict(
+                base, RtnCode='1', RtnMsg='Succeeded', TradeStatus='1', SimulatePaid='1',
+                PaymentDate=f'{timezone.localtime():%Y/%m/%d %H:%M:%S}',
+                PaymentTypeChargeFee=str(round(trade.amount * 0.0275)),
+            )))
+        else:
+            messages.append((trade.return_url, dict(
+                base, RtnCode=FAILED_RTN_CODE, RtnMsg='Transaction Failed', TradeStatus='0', SimulatePaid='1',
+            )))
+        return [(url, self._signed(message)) for url, message in messages]
+
+    def _notify(self, trade):
+        messages = self.notifications(trade)
+        if self._chance(self.config.out_of_order_rate):
+            messages.reverse()
+        if self._chance(self.config.duplicate_rate):
+            with self._lock:
+                messages.append(self.random.choice(messages))
+        for url, message in messages:
+            if self.config.callback_delay:
+                time.sleep(self.config.callback_delay)
+            self._deliver(url, message)
+
+    def _deliver(self, url, message):
+        for attempt in range(CALLBACK_ATTEMPTS):
+            self._count('callbacks')
+            try:
+                if self._send(url, message):
+                    return True
+            except Exception:
+                pass
+            self._count('callback_failures')
+            time.sleep(min(2 ** attempt * 0.1, 2))
+        return False
+
+    def _post_callback(self, url, message):
+        response = self._session.post(url, data=message, timeout=(3.05, 10))
+        return response.text.strip() == '1|OK'
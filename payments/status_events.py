@@ -0,0 +1,177 @@
+"""
+Payment status change notifications for the payment status page.
+付款狀態即時通知
+
+Payment.mark_as_paid and mark_as_failed call notify_status_change, which
+after commit:
+
+- sends NOTIFY payment_status, '<payment_id>' on PostgreSQL;
+- bumps a per-payment version key in the cache.
+
+Under ASGI the payment_events view holds one server-sent events stream per
+waiting customer and waits in wait_for_change:
+
+- on PostgreSQL, each process runs one listener thread with its own
+  connection doing LISTEN payment_status and wakes only the streams of the
+  payment named in a notification, so a waiting page costs one status
+  read per heartbeat interval instead of one per poll;
+- elsewhere, each stream polls the cache version every
+  PAYMENT_EVENTS_POLL_SECONDS and reads the status row only when the
+  version moved. With a cache that is not shared between processes (the
+  dummy cache) the version is always missing and it reads the row instead.
+"""
+
+import asyncio
+import logging
+import select
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'payment_status'
+
+# Statuses after which the page stops waiting
+FINAL_STATUSES = frozenset({'paid', 'failed', 'cancelled', 'refunded', 'partial_refund'})
+
+VERSION_KEY = 'payment_status_version:{}'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _send(payment_id):
+    key = VERSION_KEY.format(payment_id)
+    cache.set(key, time.time_ns(), timeout=_setting('PAYMENT_EVENTS_TIMEOUT', 55) * 2)
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [CHANNEL, payment_id])
+
+
+def notify_status_change(payment):
+    """Tell waiting status pages that a payment changed, once the change commits."""
+    payment_id = payment.payment_id
+    transaction.on_commit(lambda: _send(payment_id))
+
+
+def notify_status_changes(payment_ids):
+    """notify_status_change for payments changed in bulk."""
+    payment_ids = list(payment_ids)
+
+    def send_all():
+        for payment_id in payment_ids:
+            _send(payment_id)
+
+    transaction.on_commit(send_all)
+
+
+class PostgresListener:
+    """One LISTEN connection per process, waking the streams it concerns."""
+
+    def __init__(self):
+        self.waiters = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self, payment_id):
+        """Return an asyncio.Event set when payment_id is notified."""
+        event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self.waiters.setdefault(payment_id, set()).add((loop, event))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='payment-status-listener', daemon=True)
+                self._thread.start()
+        return event
+
+    def unsubscribe(self, payment_id, event):
+        with self._lock:
+            waiters = self.waiters.get(payment_id, set())
+            waiters.difference_update({w for w in waiters if w[1] is event})
+            if not waiters:
+                self.waiters.pop(payment_id, None)
+
+    def _wake(self, payment_id):
+        with self._lock:
+            waiters = list(self.waiters.get(payment_id, ()))
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def _run(self):
+        db = connections['default']
+        while True:
+            try:
+                conn = db.get_new_connection(db.get_connection_params())
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN {CHANNEL}')
+                while True:
+                    if select.select([conn], [], [], 30) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._wake(conn.notifies.pop(0).payload)
+            except Exception:
+                logger.exception('Payment status listener lost its connection; reconnecting')
+                # Streams fall back to their timeout; wake everyone so they re-read once
+                with self._lock:
+                    payment_ids = list(self.waiters)
+                for payment_id in payment_ids:
+                    self._wake(payment_id)
+                time.sleep(5)
+
+
+_listener = PostgresListener()
+
+
+def _read_status(payment_id):
+    from .models import Payment
+    return Payment.objects.filter(payment_id=payment_id).values_list('status', flat=True).first()
+
+
+async def wait_for_change(payment_id, status, timeout):
+    """
+    Wait up to timeout seconds for a payment to leave status.
+
+    Returns:
+        str or None: The new status, or None if it did not change in time
+    """
+    deadline = time.monotonic() + timeout
+    if connection.vendor == 'postgresql':
+        event = _listener.subscribe(payment_id)
+        try:
+            # Catch a change that committed before the subscription was in place
+            current = await sync_to_async(_read_status)(payment_id)
+            while current == status:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                try:
+                    await asyncio.wait_for(event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    return None
+                event.clear()
+                current = await sync_to_async(_read_status)(payment_id)
+            return current
+        finally:
+            _listener.unsubscribe(payment_id, event)
+
+    key = VERSION_KEY.format(payment_id)
+    version = await sync_to_async(cache.get)(key)
+    interval = _setting('PAYMENT_EVENTS_POLL_SECONDS', 2)
+    while time.monotonic() < deadline:
+        await asyncio.sleep(min(interval, max(0, deadline - time.monotonic())))
+        latest = await sync_to_async(cache.get)(key)
+        if latest is not None and latest == version:
+            continue
+        version = latest
+        current = await sync_to_async(_read_status)(payment_id)
+        if current != status:
+            return current
+    return None
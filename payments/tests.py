@@ -1,3 +1,588 @@
-from django.test import TestCase
+"""
+Tests for payment creation and ECPay integration.
+"""
 
-# Create your tests here.
+import json
+import threading
+import urllib.parse
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from asgiref.sync import sync_to_async
+from django.test import AsyncClient, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from orders.inventory import release_expired_reservations, reserve_stock
+from orders.models import Order
+from products.models import Category, Product
+from .expiry import expire_payments_batch
+from .checkmac import CheckMacEncoder, reference_check_mac_value
+from .gateway import CircuitOpenError, ECPayClient, GatewayError, get_gateway_stats, reset_clients
+from .models import CallbackInbox, Payment, PaymentLog, UserAgent
+from .payment_logs import clear_agent_cache, flush, log_payment
+from .reconciliation import RateLimiter, reconcile_payments
+from .services import ECPayService, PaymentService
+from .simulator import ECPaySimulator, SimulatorConfig
+
+
+@override_settings(ECPAY_MERCHANT_ID='3002607', ECPAY_HASH_KEY='pwFHCqoQZGmho4w6', ECPAY_HASH_IV='EkRm7iFT261dpevs')
+class CreatePaymentIdempotencyTest(TestCase):
+    """Test that retried payment creation never creates a second payment."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='payer@example.com', password='testpass123', is_active=True
+        )
+        self.client.force_login(self.user)
+        self.order = Order.objects.create(
+            user=self.user, subtotal=Decimal('1200'), total_amount=Decimal('1200')
+        )
+
+    def post_api(self, key, **data):
+        data.setdefault('order_id', self.order.id)
+        return self.client.post(
+            reverse('payments:api_create'), data, content_type='application/json',
+            HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_api_retry_returns_same_payment(self):
+        first = self.post_api('pay-key-1')
+        retry = self.post_api('pay-key-1')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(retry.json()['payment_id'], first.json()['payment_id'])
+        self.assertEqual(Payment.objects.filter(order=self.order).count(), 1)
+
+    def test_initiation_form_retry_replays_redirect_page(self):
+        url = reverse('payments:initiate', args=[self.order.id])
+        data = {'payment_method': 'Credit', 'idempotency_key': 'pay-key-2'}
+        first = self.client.post(url, data)
+        retry = self.client.post(url, data)
+
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(Payment.objects.filter(order=self.order).count(), 1)
+
+
+class StandInECPay:
+    """Local HTTP server answering ECPay calls with scripted status codes."""
+
+    def __init__(self, statuses, respond=None):
+        self.statuses = list(statuses)
+        self.respond = respond
+        self.requests = []
+        self.ports = set()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                stand_in.requests.append((self.path, body.decode()))
+                stand_in.ports.add(self.client_address[1])
+                code = stand_in.statuses.pop(0) if stand_in.statuses else 200
+                if code != 200:
+                    reply = b'error'
+                elif stand_in.respond:
+                    reply = stand_in.respond(dict(urllib.parse.parse_qsl(body.decode()))).encode()
+                else:
+                    reply = b'MerchantTradeNo=T1&TradeStatus=1'
+                self.send_response(code)
+                self.send_header('Content-Length', str(len(reply)))
+                self.end_headers()
+                self.wfile.write(reply)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@override_settings(
+    ECPAY_MERCHANT_ID='3002607', ECPAY_HASH_KEY='pwFHCqoQZGmho4w6', ECPAY_HASH_IV='EkRm7iFT261dpevs',
+    ECPAY_RETRY_BACKOFF=0,
+)
+class ECPayGatewayTest(TestCase):
+    """Test the pooled ECPay client against a local stand-in server."""
+
+    def start_server(self, *statuses):
+        server = StandInECPay(statuses)
+        self.addCleanup(server.close)
+        return server
+
+    def setUp(self):
+        reset_clients()
+        self.addCleanup(reset_clients)
+
+    def test_query_reuses_connection_and_retries_server_errors(self):
+        server = self.start_server(503, 200, 200)
+        with self.settings(ECPAY_API_HOST=server.url):
+            service = ECPayService()
+            self.assertEqual(service.query_trade_info('T1')['TradeStatus'], '1')
+            self.assertEqual(service.query_trade_info('T1')['MerchantTradeNo'], 'T1')
+
+        self.assertEqual(len(server.requests), 3)
+        # The 503 reply kept the connection open, so every call used one socket
+        self.assertEqual(len(server.ports), 1)
+        stats = get_gateway_stats()[0]['endpoints'][ECPayService.QUERY_TRADE_ENDPOINT]
+        self.assertEqual((stats['calls'], stats['errors'], stats['retries']), (3, 1, 1))
+
+    def test_refund_is_not_retried_after_it_was_sent(self):
+        server = self.start_server(503, 200)
+        with self.settings(ECPAY_API_HOST=server.url):
+            result = ECPayService().create_refund_request(
+                {'merchant_trade_no': 'T1', 'trade_no': '2301', 'amount': 100}
+            )
+        self.assertIsNone(result)
+        self.assertEqual(len(server.requests), 1)
+
+    def test_circuit_opens_and_recovers(self):
+        server = self.start_server(500, 500, 200)
+        now = [0.0]
+        client = ECPayClient(server.url, max_retries=0, failure_threshold=2, reset_timeout=30, sleep=lambda s: None)
+        client.breaker.clock = lambda: now[0]
+
+        for _ in range(2):
+            with self.assertRaises(GatewayError):
+                client.post('/q', {}, idempotent=True)
+        with self.assertRaises(CircuitOpenError):
+            client.post('/q', {}, idempotent=True)
+        self.assertEqual(len(server.requests), 2)
+
+        now[0] = 31.0
+        self.assertEqual(client.post('/q', {}, idempotent=True).status_code, 200)
+        self.assertEqual(client.breaker.state, 'closed')
+        self.assertEqual(client.stats()['endpoints']['/q']['rejected'], 1)
+
+
+@override_settings(
+    ECPAY_MERCHANT_ID='3002607', ECPAY_HASH_KEY='pwFHCqoQZGmho4w6', ECPAY_HASH_IV='EkRm7iFT261dpevs',
+    ECPAY_RETRY_BACKOFF=0,
+)
+class ReconcilePaymentsTest(TestCase):
+    """Test batch reconciliation against a stand-in QueryTradeInfo."""
+
+    def setUp(self):
+        reset_clients()
+        self.addCleanup(reset_clients)
+        self.user = get_user_model().objects.create_user(
+            email='payer@example.com', password='testpass123', is_active=True
+        )
+        # merchant_trade_no -> (TradeStatus, TradeAmt)
+        self.trades = {}
+        server = StandInECPay([], respond=self.respond)
+        self.addCleanup(server.close)
+        self.enterContext(self.settings(ECPAY_API_HOST=server.url))
+        self.server = server
+
+    def respond(self, query):
+        status, amount = self.trades.get(query['MerchantTradeNo'], ('10200047', '0'))
+        data = {'MerchantTradeNo': query['MerchantTradeNo'], 'TradeStatus': status, 'TradeAmt': amount, 'TradeNo': '2301'}
+        data['CheckMacValue'] = ECPayService().generate_check_mac_value(data)
+        return urllib.parse.urlencode(data)
+
+    def create_payment(self, trade=None, amount='1200'):
+        order = Order.objects.create(user=self.user, subtotal=Decimal(amount), total_amount=Decimal(amount))
+        payment = Payment.objects.create(order=order, user=self.user, amount=Decimal(amount))
+        Payment.objects.filter(pk=payment.pk).update(created_at=timezone.now() - timedelta(hours=1))
+        if trade:
+            self.trades[payment.ecpay_merchant_trade_no] = trade
+        return payment
+
+    def test_reconcile_applies_ecpay_state(self):
+        paid = self.create_payment(('1', '1200'))
+        failed = self.create_payment(('10200095', '1200'))
+        waiting = self.create_payment(('0', '1200'))
+        wrong_amount = self.create_payment(('1', '999'))
+        missing = self.create_payment()
+        Payment.objects.create(order=Order.objects.create(user=self.user, subtotal=1, total_amount=1), amount=1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = reconcile_payments(batch_size=2, workers=3, rate=100)
+        flush()
+
+        self.assertEqual((stats.checked, stats.paid, stats.failed), (5, 1, 1))
+        statuses = dict(Payment.objects.values_list('id', 'status'))
+        self.assertEqual(statuses[paid.id], 'paid')
+        self.assertEqual(statuses[failed.id], 'failed')
+        for payment in (waiting, wrong_amount, missing):
+            self.assertEqual(statuses[payment.id], 'pending')
+        paid.order.refresh_from_db()
+        self.assertEqual(paid.order.payment_status, 'paid')
+        self.assertTrue(PaymentLog.objects.filter(payment=paid, log_type='response').exists())
+        reasons = dict(stats.mismatches)
+        self.assertIn('amount', reasons[wrong_amount.payment_id])
+        self.assertIn('not found', reasons[missing.payment_id])
+
+        # Everything just checked is skipped by a rerun within the interval
+        self.assertEqual(reconcile_payments(rate=100).checked, 0)
+
+    @override_settings(ECPAY_MAX_RETRIES=0)
+    def test_failed_query_is_retried_next_run(self):
+        payment = self.create_payment(('1', '1200'))
+        self.server.statuses = [503]
+
+        stats = reconcile_payments(workers=1, rate=100)
+        payment.refresh_from_db()
+        self.assertEqual((stats.errors, payment.reconciled_at), (1, None))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(reconcile_payments(workers=1, rate=100).paid, 1)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'paid')
+        self.assertIsNotNone(payment.reconciled_at)
+
+    def test_command_dry_run_changes_nothing(self):
+        payment = self.create_payment(('1', '1200'))
+        out = StringIO()
+        call_command('reconcile_payments', '--dry-run', '--rate', '100', stdout=out)
+
+        self.assertIn('1 paid', out.getvalue())
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.reconciled_at), ('pending', None))
+
+    def test_rate_limiter_spaces_calls(self):
+        now, slept = [0.0], []
+
+        def sleep(seconds):
+            slept.append(seconds)
+            now[0] += seconds
+
+        limiter = RateLimiter(2, clock=lambda: now[0], sleep=sleep)
+        for _ in range(4):
+            limiter.acquire()
+        self.assertAlmostEqual(now[0], 1.0)
+
+
+@override_settings(ECPAY_MERCHANT_ID='3002607', ECPAY_HASH_KEY='pwFHCqoQZGmho4w6', ECPAY_HASH_IV='EkRm7iFT261dpevs')
+class CallbackInboxTest(TestCase):
+    """Test that callbacks are acked at once and applied by the worker."""
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(
+            email='payer@example.com', password='testpass123', is_active=True
+        )
+        order = Order.objects.create(user=user, subtotal=Decimal('1200'), total_amount=Decimal('1200'))
+        self.payment = Payment.objects.create(order=order, user=user, amount=Decimal('1200'))
+
+    def callback(self, rtn_code='1', **extra):
+        data = {
+            'MerchantID': '3002607', 'MerchantTradeNo': self.payment.ecpay_merchant_trade_no,
+            'TradeNo': '2301', 'RtnCode': rtn_code, 'TradeStatus': rtn_code, 'RtnMsg': 'OK', **extra,
+        }
+        data['CheckMacValue'] = ECPayService().generate_check_mac_value(data)
+        return self.client.post(reverse('payments:ecpay_callback'), data)
+
+    def test_callback_is_queued_once_and_processed_by_worker(self):
+        self.assertEqual(self.callback().content, b'1|OK')
+        self.assertEqual(self.callback().content, b'1|OK')  # ECPay resend
+        self.assertEqual(CallbackInbox.objects.count(), 1)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'pending')
+
+        out = StringIO()
+        call_command('process_callbacks', stdout=out)
+        self.assertIn('Processed 1 callbacks', out.getvalue())
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'paid')
+        self.assertEqual(CallbackInbox.objects.get().status, 'done')
+
+    def test_late_failure_does_not_undo_payment(self):
+        self.callback()
+        self.callback(rtn_code='10100058')
+        call_command('process_callbacks', '--batch-size', '1', stdout=StringIO())
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'paid')
+        self.assertEqual(PaymentLog.objects.filter(payment=self.payment, log_type='callback').count(), 1)
+
+    def test_bad_mac_is_rejected(self):
+        response = self.client.post(reverse('payments:ecpay_callback'), {
+            'MerchantTradeNo': self.payment.ecpay_merchant_trade_no, 'RtnCode': '1', 'CheckMacValue': 'BAD',
+        })
+        self.assertEqual(response.content, b'0|Failed')
+        self.assertFalse(CallbackInbox.objects.exists())
+
+
+class CheckMacValueTest(TestCase):
+    """Test the CheckMacValue encoder against golden vectors and the reference algorithm."""
+
+    HASH_KEY = 'pwFHCqoQZGmho4w6'
+    HASH_IV = 'EkRm7iFT261dpevs'
+
+    # (parameters, CheckMacValue); the first is the example from ECPay's documentation
+    GOLDEN = [
+        ({
+            'ChoosePayment': 'ALL', 'EncryptType': 1, 'ItemName': 'Apple iphone 15', 'MerchantID': '3002607',
+            'MerchantTradeDate': '2023/03/12 15:30:23', 'MerchantTradeNo': 'ecpay20230312153023',
+            'PaymentType': 'aio', 'ReturnURL': 'https://www.ecpay.com.tw/receive.php', 'TotalAmount': 30000,
+            'TradeDesc': '促銷方案',
+        }, '6C51C9E6888DE861FD62FB1DD17029FC742634498FD813DC43D4243B5685B840'),
+        ({}, '21D0570F881771E427B46B103B01596A6A66E457CF0E69AB1B37E009D8B2D2BA'),
+        ({
+            'MerchantID': '3002607', 'MerchantTradeNo': 'ES20261019120000AB', 'RtnCode': '1', 'RtnMsg': '交易成功',
+            'TradeAmt': '1200', 'TradeNo': '2310191200001234', 'PaymentDate': '2026/10/19 12:00:30',
+            'SimulatePaid': '0', 'CheckMacValue': 'IGNORED',
+        }, '21982564F81D5DF0CD9E152E96BB29F249D59BB8D22AF874160712CCAF762EC8'),
+        ({
+            'ItemName': '和牛 A5 (500g)#雪花牛*2 ~特價! 100%', 'Remark': 'a+b c&d=e/f?g\'h"i<j>k', 'TotalAmount': 3980,
+        }, '77BBA3F158A59F5505925944DE1EDF28FDD4DEBB6D3A81F06E1297EED4871272'),
+        ({'CustomField1': 'Mixed Case ÄÖÜ é', 'TradeDesc': 'tab\tnew\nline'},
+         '3FE98B0E1A42A142C354A7DB05355A08B98036596A10D4226B50DB66C38EDBDD'),
+    ]
+
+    def test_golden_vectors(self):
+        encoder = CheckMacEncoder(self.HASH_KEY, self.HASH_IV)
+        for parameters, expected in self.GOLDEN:
+            self.assertEqual(encoder(parameters), expected)
+            self.assertEqual(reference_check_mac_value(parameters, self.HASH_KEY, self.HASH_IV), expected)
+
+    def test_benchmark_command_checks_parity(self):
+        out = StringIO()
+        call_command('benchmark_check_mac', '--iterations', '10', '--fuzz', '300', stdout=out)
+        self.assertIn('Identical output on 302 payloads', out.getvalue())
+        self.assertIn('speedup', out.getvalue())
+
+
+class PaymentLogWriterTest(TestCase):
+    """Test buffered, compacted payment logging and log archiving."""
+
+    def setUp(self):
+        clear_agent_cache()
+        self.addCleanup(clear_agent_cache)
+        user = get_user_model().objects.create_user(
+            email='payer@example.com', password='testpass123', is_active=True
+        )
+        order = Order.objects.create(user=user, subtotal=Decimal('1200'), total_amount=Decimal('1200'))
+        self.payment = Payment.objects.create(order=order, user=user, amount=Decimal('1200'))
+
+    def test_non_critical_logs_are_buffered_until_flush(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            log_payment(self.payment, 'request', 'created', request_data={
+                'MerchantID': '3002607', 'CheckMacValue': 'ABC', 'TotalAmount': 1200, 'Remark': '',
+            }, user_agent='Mozilla/5.0')
+            log_payment(self.payment, 'info', 'again', user_agent='Mozilla/5.0')
+        self.assertFalse(PaymentLog.objects.exists())
+
+        self.assertEqual(flush(), 2)
+        first = PaymentLog.objects.get(log_type='request')
+        self.assertEqual(first.request_data, {'TotalAmount': 1200})
+        self.assertEqual(first.user_agent_text, 'Mozilla/5.0')
+        self.assertEqual(UserAgent.objects.count(), 1)
+
+    def test_callback_logs_are_written_at_once(self):
+        log_payment(self.payment, 'callback', 'paid', response_data={'RtnCode': '1'})
+        self.assertTrue(PaymentLog.objects.filter(log_type='callback').exists())
+
+
+@override_settings(PAYMENT_EVENTS_POLL_SECONDS=0.01, PAYMENT_EVENTS_HEARTBEAT=0.05, PAYMENT_EVENTS_TIMEOUT=5)
+class PaymentEventsTest(TestCase):
+    """Test the payment status event stream."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='payer@example.com', password='testpass123', is_active=True
+        )
+        order = Order.objects.create(user=self.user, subtotal=Decimal('1200'), total_amount=Decimal('1200'))
+        self.payment = Payment.objects.create(order=order, user=self.user, amount=Decimal('1200'))
+        self.url = reverse('payments:api_events', args=[self.payment.payment_id])
+
+    def test_wsgi_sends_status_once(self):
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join(response.streaming_content).decode()
+        self.assertTrue(body.startswith('retry: 15000\n'))
+        self.assertIn('"status": "pending"', body)
+
+    async def test_asgi_stream_pushes_the_change(self):
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(self.user)
+        response = await client.get(self.url)
+        chunks = aiter(response.streaming_content)
+
+        self.assertIn(b'"status": "pending"', await anext(chunks))
+        self.assertEqual(await anext(chunks), b': keep-alive\n\n')
+        await sync_to_async(self.payment.mark_as_paid)()
+        while b'"status": "paid"' not in (chunk := await anext(chunks)):
+            self.assertEqual(chunk, b': keep-alive\n\n')
+        # A final status ends the stream
+        with self.assertRaises(StopAsyncIteration):
+            await anext(chunks)
+
+    def test_other_users_payment_is_hidden(self):
+        other = get_user_model().objects.create_user(email='other@example.com', password='x', is_active=True)
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+@override_settings(
+    ECPAY_MERCHANT_ID='3002607', ECPAY_HASH_KEY='pwFHCqoQZGmho4w6', ECPAY_HASH_IV='EkRm7iFT261dpevs',
+    ECPAY_RETRY_BACKOFF=0,
+)
+class ECPaySimulatorTest(TestCase):
+    """Test the local ECPay simulator end to end against the shop's services."""
+
+    def setUp(self):
+        reset_clients()
+        self.addCleanup(reset_clients)
+        self.user = get_user_model().objects.create_user(
+            email='payer@example.com', password='testpass123', is_active=True
+        )
+        self.sent = []
+        self.all_sent = threading.Condition()
+
+    def start(self, **options):
+        config = SimulatorConfig('pwFHCqoQZGmho4w6', 'EkRm7iFT261dpevs', merchant_id='3002607', seed=1, **options)
+        simulator = ECPaySimulator(config, send=self.collect).start()
+        self.addCleanup(simulator.close)
+        self.enterContext(self.settings(ECPAY_API_HOST=simulator.url))
+        return simulator
+
+    def collect(self, url, message):
+        with self.all_sent:
+            self.sent.append((url, message))
+            self.all_sent.notify_all()
+        return True
+
+    def wait_for_callbacks(self, count):
+        with self.all_sent:
+            self.assertTrue(self.all_sent.wait_for(lambda: len(self.sent) >= count, timeout=5))
+        return [message for url, message in self.sent]
+
+    def checkout(self, method='Credit'):
+        order = Order.objects.create(user=self.user, subtotal=Decimal('1200'), total_amount=Decimal('1200'))
+        created = PaymentService().create_payment(order, method)
+        response = requests.post(created['action_url'], data=created['form_data'], timeout=5)
+        self.assertEqual(response.status_code, 200)
+        return created['payment']
+
+    def test_duplicate_out_of_order_callbacks_settle_once(self):
+        simulator = self.start(duplicate_rate=1, out_of_order_rate=1)
+        payment = self.checkout()
+        callbacks = self.wait_for_callbacks(2)
+
+        service = ECPayService()
+        self.assertTrue(all(service.verify_callback_mac(callback) for callback in callbacks))
+        for callback in callbacks:
+            self.assertEqual(self.client.post(reverse('payments:ecpay_callback'), callback).content, b'1|OK')
+        call_command('process_callbacks', stdout=StringIO())
+
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'paid')
+        self.assertEqual(PaymentLog.objects.filter(payment=payment, log_type='callback').count(), 1)
+        self.assertEqual(simulator.stats['checkouts'], 1)
+
+    def test_query_and_refund(self):
+        self.start()
+        paid = self.checkout()
+        self.wait_for_callbacks(1)
+
+        service = ECPayService()
+        self.assertEqual(service.query_trade_info(paid.ecpay_merchant_trade_no)['TradeStatus'], '1')
+        self.assertEqual(service.query_trade_info('ES00000000000000XX')['TradeStatus'], '10200047')
+        trade_no = self.sent[-1][1]['TradeNo']
+        refund = {'merchant_trade_no': paid.ecpay_merchant_trade_no, 'trade_no': trade_no, 'amount': 1000}
+        self.assertEqual(service.create_refund_request(refund)['RtnCode'], '1')
+        self.assertEqual(service.create_refund_request(refund)['RtnCode'], '0')  # Exceeds what is left
+
+    def test_forged_form_is_rejected(self):
+        simulator = self.start()
+        response = requests.post(
+            f'{simulator.url}{ECPayService.CREATE_PAYMENT_ENDPOINT}',
+            data={'MerchantTradeNo': 'X1', 'ReturnURL': 'http://shop/', 'TotalAmount': '1', 'CheckMacValue': 'BAD'},
+            timeout=5,
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(simulator.stats['rejected'], 1)
+
+
+@override_settings(
+    ECPAY_MERCHANT_ID='3002607', ECPAY_HASH_KEY='pwFHCqoQZGmho4w6', ECPAY_HASH_IV='EkRm7iFT261dpevs',
+    PAYMENT_EXPIRY_GRACE_MINUTES=30,
+)
+class ExpirePaymentsTest(TestCase):
+    """Test that unpaid ATM/CVS payments expire and release their orders."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='payer@example.com', password='testpass123', is_active=True
+        )
+        category = Category.objects.create(name='牛肉', slug='beef')
+        self.product = Product.objects.create(
+            name='安格斯', slug='angus', sku='ANGUS-001', category=category, description='測試商品',
+            price=Decimal('1200'), stock=10, status='active',
+        )
+
+    def create_payment(self, method, overdue, status='pending'):
+        order = Order.objects.create(user=self.user, subtotal=Decimal('1200'), total_amount=Decimal('1200'))
+        return Payment.objects.create(
+            order=order, user=self.user, amount=Decimal('1200'), payment_method=method, status=status,
+            payment_deadline=timezone.now() - overdue,
+            ecpay_merchant_trade_no=f'EXP{Payment.objects.count():05d}',
+        )
+
+    def test_creation_sets_deadline_and_asks_ecpay_for_it(self):
+        order = Order.objects.create(user=self.user, subtotal=Decimal('1200'), total_amount=Decimal('1200'))
+        created = PaymentService().create_payment(order, 'CVS')
+
+        self.assertEqual(created['form_data']['StoreExpireDate'], 10080)
+        deadline = created['payment'].payment_deadline - timezone.now()
+        self.assertAlmostEqual(deadline.total_seconds(), 7 * 86400, delta=60)
+        self.assertEqual(ECPayService().get_payment_expiry('Credit', timezone.now()), ({}, None))
+
+    def test_atm_order_paid_after_the_usual_hold_keeps_its_stock(self):
+        order = Order.objects.create(user=self.user, subtotal=Decimal('1200'), total_amount=Decimal('1200'))
+        reserve_stock(order, [(self.product.pk, None, 3)])
+        payment = PaymentService().create_payment(order, 'ATM')['payment']
+
+        later = timezone.now() + timedelta(minutes=31)
+        self.assertEqual(release_expired_reservations(now=later), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            payment.mark_as_paid()
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 7)
+        self.assertEqual(list(order.stock_reservations.values_list('status', flat=True)), ['committed'])
+
+    def test_sweeper_expires_only_overdue_unpaid_payments(self):
+        expired = self.create_payment('ATM', timedelta(hours=2))
+        reserve_stock(expired.order, [(self.product.pk, None, 3)])
+        in_grace = self.create_payment('CVS', timedelta(minutes=10))
+        paid = self.create_payment('ATM', timedelta(hours=2), status='paid')
+
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('expire_payments', '--batch-size', '1', stdout=out)
+        self.assertIn('Expired 1 payments, cancelled 1 orders', out.getvalue())
+
+        statuses = dict(Payment.objects.values_list('id', 'status'))
+        self.assertEqual(
+            (statuses[expired.id], statuses[in_grace.id], statuses[paid.id]), ('failed', 'pending', 'paid')
+        )
+        expired.order.refresh_from_db()
+        self.assertEqual((expired.order.status, expired.order.payment_status), ('cancelled', 'failed'))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 10)
+        self.assertEqual(
+            set(expired.order.events.values_list('field', 'to_value')),
+            {('status', 'pending'), ('payment_status', 'failed'), ('status', 'cancelled')},
+        )
+        self.assertTrue(PaymentLog.objects.filter(payment=expired, message__startswith='Payment expired').exists())
+
+        # Nothing left to do
+        self.assertEqual(expire_payments_batch(), (0, 0))
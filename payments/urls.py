@@ -18,7 +18,9 @@ urlpatterns = [
     
     # API Endpoints
     path('api/status/<str:payment_id>/', views.payment_status_api, name='api_status'),
+    path('api/events/<str:payment_id>/', views.payment_events, name='api_events'),
     path('api/query/<str:payment_id>/', views.query_payment_api, name='api_query'),
     path('api/methods/', views.payment_methods_api, name='api_methods'),
     path('api/create/', views.create_payment_api, name='api_create'),
+    path('api/gateway-stats/', views.gateway_stats_api, name='api_gateway_stats'),
 ]
\ No newline at end of file
@@ -3,10 +3,14 @@ Payment views for Taiwan e-commerce platform with ECPay integration.
 Handles payment initiation, callbacks, and status queries.
 """
 
+import asyncio
 import json
 import logging
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest
+from django.core.handlers.asgi import ASGIRequest
+from django.conf import settings
+from django.http import Http404, JsonResponse, HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods, require_POST
 from django.contrib.auth.decorators import login_required
@@ -16,15 +20,20 @@ from django.utils.translation import gettext as _
 from django.contrib import messages
 from django.urls import reverse
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAdminUser, IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework import status
 from django_ratelimit.decorators import ratelimit
+from django.db import IntegrityError
 
+from orders.idempotency import idempotent, new_key
 from orders.models import Order
 from .models import Payment, PaymentLog
+from .gateway import get_gateway_stats
+from .inbox import enqueue_callback
 from .services import PaymentService
 from .serializers import PaymentSerializer
+from .status_events import FINAL_STATUSES, wait_for_change
 
 logger = logging.getLogger(__name__)
 
@@ -56,10 +65,12 @@ class PaymentInitiationView(View):
         context = {
             'order': order,
             'payment_methods': payment_methods,
+            'idempotency_key': new_key(),
         }
         
         return render(request, 'payments/payment_selection.html', context)
     
+    @method_decorator(idempotent('payment_initiate'))
     def post(self, request, order_id):
         """Process payment initiation."""
         order = get_object_or_404(Order, id=order_id, user=request.user)
@@ -79,14 +90,20 @@ class PaymentInitiationView(View):
         
         # Create payment
         payment_service = PaymentService()
-        result = payment_service.create_payment(
-            order=order,
-            payment_method=payment_method,
-            client_back_url=request.build_absolute_uri(reverse('orders:order_detail', args=[order.id])),
-            order_result_url=request.build_absolute_uri(reverse('payments:result')),
-            ip_address=self._get_client_ip(request),
-            user_agent=request.META.get('HTTP_USER_AGENT', '')
-        )
+        try:
+            result = payment_service.create_payment(
+                order=order,
+                payment_method=payment_method,
+                client_back_url=request.build_absolute_uri(reverse('orders:order_detail', args=[order.id])),
+                order_result_url=request.build_absolute_uri(reverse('payments:result')),
+                ip_address=self._get_client_ip(request),
+                user_agent=request.META.get('HTTP_USER_AGENT', '')
+            )
+        except IntegrityError:
+            # A concurrent request created the payment first (Payment.order is unique)
+            payment = Payment.objects.get(order=order)
+            messages.warning(request, _('此訂單已有付款記錄 / Payment already exists for this order'))
+            return redirect('payments:status', payment_id=payment.payment_id)
         
         if result['success']:
             # Render ECPay form submission page
@@ -117,6 +134,9 @@ def ecpay_callback(request):
     """
     Handle ECPay payment callback.
     This endpoint receives POST data from ECPay when payment is completed.
+    
+    The payload is only verified and queued here so ECPay gets its 1|OK at
+    once; the process_callbacks worker updates the payment and order.
     """
     try:
         # Get callback data
@@ -124,20 +144,17 @@ def ecpay_callback(request):
         
         logger.info(f"ECPay callback received: {callback_data}")
         
-        # Process callback
         payment_service = PaymentService()
-        result = payment_service.handle_callback(
+        if not payment_service.ecpay.verify_callback_mac(callback_data):
+            logger.error(f"ECPay callback MAC verification failed: {callback_data.get('MerchantTradeNo', '')}")
+            return HttpResponse('0|Failed')
+        
+        enqueue_callback(
             callback_data,
             ip_address=request.META.get('REMOTE_ADDR'),
             user_agent=request.META.get('HTTP_USER_AGENT', '')
         )
-        
-        if result['success']:
-            logger.info(f"Payment callback processed successfully: {result['merchant_trade_no']}")
-            return HttpResponse('1|OK')  # ECPay expects '1|OK' for successful processing
-        else:
-            logger.error(f"Payment callback processing failed: {result}")
-            return HttpResponse('0|Failed')
+        return HttpResponse('1|OK')  # ECPay expects '1|OK' for successful processing
             
     except Exception as e:
         logger.error(f"ECPay callback error: {str(e)}")
@@ -178,6 +195,72 @@ def payment_result(request):
         return redirect('orders:order_list')
 
 
+def _status_event(payment_id, current):
+    """Format one server-sent event carrying a payment status."""
+    data = json.dumps({
+        'payment_id': payment_id,
+        'status': current,
+        'status_display': str(dict(Payment.STATUS_CHOICES).get(current, current)),
+    }, ensure_ascii=False)
+    return f'event: status\ndata: {data}\n\n'
+
+
+def _get_waiting_payment(request, payment_id):
+    """Return (payment_id, status) of the user's payment, or None."""
+    if not request.user.is_authenticated:
+        return None
+    return (
+        Payment.objects.filter(payment_id=payment_id, user=request.user)
+        .values_list('payment_id', 'status').first()
+    )
+
+
+async def payment_events(request, payment_id):
+    """
+    Server-sent events stream of a payment's status for the status page.
+    
+    Under ASGI the connection is held until the status becomes final or
+    PAYMENT_EVENTS_TIMEOUT passes, with a comment line every
+    PAYMENT_EVENTS_HEARTBEAT seconds to keep proxies from closing it.
+    Under WSGI holding a connection would tie up a worker, so the stream
+    sends the current status once and asks the browser to reconnect after
+    PAYMENT_EVENTS_RETRY_MS.
+    """
+    found = await sync_to_async(_get_waiting_payment)(request, payment_id)
+    if found is None:
+        raise Http404
+    payment_id, initial = found
+    
+    held = isinstance(request, ASGIRequest) and initial not in FINAL_STATUSES
+    retry = getattr(settings, 'PAYMENT_EVENTS_RETRY_MS', 15000)
+    first = f'retry: {retry}\n' + _status_event(payment_id, initial)
+    
+    async def stream():
+        current = initial
+        yield first
+        loop_deadline = asyncio.get_running_loop().time() + getattr(settings, 'PAYMENT_EVENTS_TIMEOUT', 55)
+        heartbeat = getattr(settings, 'PAYMENT_EVENTS_HEARTBEAT', 15)
+        while current not in FINAL_STATUSES:
+            remaining = loop_deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                return
+            changed = await wait_for_change(payment_id, current, min(heartbeat, remaining))
+            if changed is None:
+                yield ': keep-alive\n\n'
+                continue
+            current = changed
+            yield _status_event(payment_id, current)
+    
+    response = StreamingHttpResponse(
+        stream() if held else [first],
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx-style proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 # API Views for AJAX requests
 
 @api_view(['GET'])
@@ -249,6 +332,7 @@ def payment_methods_api(request):
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 @ratelimit(key='user', rate='10/5m', method='POST')
+@idempotent('payment_api')
 def create_payment_api(request):
     """
     API endpoint to create payment for an order.
@@ -281,14 +365,21 @@ def create_payment_api(request):
         
         # Create payment
         payment_service = PaymentService()
-        result = payment_service.create_payment(
-            order=order,
-            payment_method=payment_method,
-            client_back_url=request.build_absolute_uri(reverse('orders:order_detail', args=[order.id])),
-            order_result_url=request.build_absolute_uri(reverse('payments:result')),
-            ip_address=request.META.get('REMOTE_ADDR'),
-            user_agent=request.META.get('HTTP_USER_AGENT', '')
-        )
+        try:
+            result = payment_service.create_payment(
+                order=order,
+                payment_method=payment_method,
+                client_back_url=request.build_absolute_uri(reverse('orders:order_detail', args=[order.id])),
+                order_result_url=request.build_absolute_uri(reverse('payments:result')),
+                ip_address=request.META.get('REMOTE_ADDR'),
+                user_agent=request.META.get('HTTP_USER_AGENT', '')
+            )
+        except IntegrityError:
+            # A concurrent request created the payment first (Payment.order is unique)
+            return Response(
+                {'error': 'Payment already exists for this order'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         if result['success']:
             return Response({
@@ -310,3 +401,15 @@ def create_payment_api(request):
             {'error': 'Internal server error'}, 
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def gateway_stats_api(request):
+    """
+    Staff API endpoint with this process's ECPay latency, error rate and circuit state.
+    """
+    return Response({
+        'success': True,
+        'gateways': get_gateway_stats()
+    })
@@ -6,8 +6,9 @@ Follows Django best practices and EShop coding standards.
 from django.contrib import admin
 from django.utils.translation import gettext_lazy as _
 from django.utils.html import format_html
-from django.db.models import Sum, Count
-from .models import Category, Product, ProductImage, ProductVariant
+from django.db.models import Sum, Count, Q
+from .flash_sale import issue_tokens
+from .models import Category, FlashSale, Product, ProductImage, ProductVariant
 
 
 class ProductImageInline(admin.TabularInline):
@@ -475,4 +476,42 @@ class ProductVariantAdmin(admin.ModelAdmin):
             f"{base_price:,.0f}",
             f"{final_price:,.0f}"
         )
-    final_price_display.short_description = _('最終價格 / Final Price')
\ No newline at end of file
+    final_price_display.short_description = _('最終價格 / Final Price')
+
+@admin.register(FlashSale)
+class FlashSaleAdmin(admin.ModelAdmin):
+    """Admin interface for flash sales and their purchase tokens."""
+    
+    list_display = (
+        'product',
+        'starts_at',
+        'ends_at',
+        'admission_rate',
+        'token_summary',
+        'is_active'
+    )
+    list_filter = ('is_active', 'starts_at')
+    search_fields = ('product__name', 'product__sku')
+    raw_id_fields = ('product',)
+    readonly_fields = ('created_at', 'updated_at')
+    actions = ['issue_sale_tokens']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product').annotate(
+            token_total=Count('tokens'),
+            token_used=Count('tokens', filter=Q(tokens__used_at__isnull=False)),
+        )
+    
+    def token_summary(self, obj):
+        """Display used / issued token counts."""
+        return f"{obj.token_used} / {obj.token_total}"
+    token_summary.short_description = _('已使用 / 已發放名額 / Tokens Used / Issued')
+    
+    def issue_sale_tokens(self, request, queryset):
+        """Split current product stock into purchase tokens."""
+        issued = sum(issue_tokens(sale) for sale in queryset.select_related('product'))
+        self.message_user(
+            request,
+            _(f'已發放 {issued} 個搶購名額 / {issued} purchase tokens issued')
+        )
+    issue_sale_tokens.short_description = _('依庫存發放搶購名額 / Issue Tokens from Stock')
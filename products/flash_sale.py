@@ -0,0 +1,207 @@
+"""
+Flash-sale admission control for limited-stock products.
+限時搶購名額控管
+
+A sale's stock is pre-split into single-unit FlashSaleToken rows whose
+opens_at times are staggered by the sale's admission rate. Buyers claim a
+token before the product goes into their cart, and checkout only proceeds
+for lines covered by a held token. Claims update one token row each, and
+concurrent buyers take different rows (SELECT ... FOR UPDATE SKIP LOCKED,
+or a random pick among the first open tokens elsewhere), so they queue
+neither on the Product row nor on a single token. At most admission_rate
+buyers per second get through to checkout.
+
+A buyer holds at most one unused token per sale; the database enforces it
+(flash_sale_token_one_open_per_holder), so a double click or a second tab
+racing the first ends up with the token the first one won.
+"""
+
+import math
+import random
+from collections import namedtuple
+from datetime import timedelta
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from .models import FlashSale, FlashSaleToken
+
+ADMITTED = 'admitted'
+WAITING = 'waiting'
+SOLD_OUT = 'sold_out'
+LIMIT_REACHED = 'limit_reached'
+
+Admission = namedtuple('Admission', ['status', 'token', 'retry_after'])
+
+CLAIM_ATTEMPTS = 5
+
+# Open tokens a buyer picks from at random where SKIP LOCKED is unavailable
+CLAIM_SPREAD = 20
+
+
+class FlashSaleTokenError(Exception):
+    """Raised when checkout reaches a flash-sale line without a valid token."""
+
+    def __init__(self, product_ids):
+        self.product_ids = list(product_ids)
+        super().__init__('Missing flash-sale token for products %s' % self.product_ids)
+
+
+def get_running_sale(product_id, now=None):
+    """Return the running flash sale for a product, or None."""
+    now = now or timezone.now()
+    return FlashSale.objects.filter(
+        product_id=product_id, is_active=True, starts_at__lte=now, ends_at__gt=now
+    ).first()
+
+
+def issue_tokens(sale, quantity=None):
+    """
+    Split stock into purchase tokens for a sale.
+    將庫存切分為搶購名額
+
+    Unclaimed tokens are replaced; claimed and used tokens are kept.
+
+    Args:
+        sale: FlashSale to issue tokens for
+        quantity: Number of units on sale (defaults to the product's stock)
+
+    Returns:
+        int: Number of tokens issued
+    """
+    if quantity is None:
+        quantity = sale.product.stock
+    rate = sale.admission_rate
+    with transaction.atomic():
+        sale.tokens.filter(holder__isnull=True, used_at__isnull=True).delete()
+        FlashSaleToken.objects.bulk_create([
+            FlashSaleToken(sale=sale, opens_at=sale.starts_at + timedelta(seconds=i // rate))
+            for i in range(max(quantity, 0))
+        ], batch_size=1000)
+    return max(quantity, 0)
+
+
+def _claim(claimable, user, expires_at):
+    """
+    Give user one token from claimable. Returns its id, or None if none was won.
+
+    Raises:
+        IntegrityError: If another request already claimed a token for user
+    """
+    if connection.features.has_select_for_update_skip_locked:
+        # Concurrent buyers each lock a different row instead of racing for the first
+        with transaction.atomic():
+            token_id = (
+                claimable.order_by('opens_at', 'id')
+                .select_for_update(skip_locked=True)
+                .values_list('id', flat=True)
+                .first()
+            )
+            if token_id is not None and claimable.filter(pk=token_id).update(holder=user, expires_at=expires_at):
+                return token_id
+        return None
+
+    # Without SKIP LOCKED, spread buyers over the earliest open tokens in random order
+    token_ids = list(claimable.order_by('opens_at', 'id').values_list('id', flat=True)[:CLAIM_SPREAD])
+    random.shuffle(token_ids)
+    for token_id in token_ids:
+        # Conditional update so two buyers racing for the same row cannot both win
+        with transaction.atomic():
+            if claimable.filter(pk=token_id).update(holder=user, expires_at=expires_at):
+                return token_id
+    return None
+
+
+def claim_token(sale, user, now=None):
+    """
+    Admit a buyer to a flash sale.
+    領取搶購名額
+
+    Returns an Admission. WAITING carries the seconds until the next token
+    opens (or a held one lapses), for use as a Retry-After value.
+    """
+    now = now or timezone.now()
+    tokens = sale.tokens.all()
+
+    held = tokens.filter(holder=user, used_at__isnull=True, expires_at__gt=now).first()
+    if held:
+        return Admission(ADMITTED, held, 0)
+    if tokens.filter(holder=user, used_at__isnull=False).exists():
+        return Admission(LIMIT_REACHED, None, 0)
+    # A lapsed token goes back to the pool so the buyer queues like everyone else
+    tokens.filter(holder=user, used_at__isnull=True, expires_at__lte=now).update(holder=None, expires_at=None)
+
+    # Unclaimed open tokens, plus claimed ones whose holder never checked out
+    claimable = tokens.filter(used_at__isnull=True, opens_at__lte=now).filter(
+        Q(holder__isnull=True) | Q(expires_at__lte=now)
+    )
+    expires_at = now + timedelta(minutes=sale.token_ttl_minutes)
+    for _ in range(CLAIM_ATTEMPTS):
+        try:
+            token_id = _claim(claimable, user, expires_at)
+        except IntegrityError:
+            # A concurrent request from the same buyer won a token first
+            held = tokens.filter(holder=user, used_at__isnull=True, expires_at__gt=now).first()
+            if held:
+                return Admission(ADMITTED, held, 0)
+            continue
+        if token_id is not None:
+            return Admission(ADMITTED, tokens.get(pk=token_id), 0)
+        if not claimable.exists():
+            break
+    else:
+        # Open tokens are left, but other buyers had them locked on every try
+        return Admission(WAITING, None, 1)
+
+    next_at = tokens.filter(used_at__isnull=True).filter(
+        Q(holder__isnull=True, opens_at__gt=now) | Q(expires_at__gt=now)
+    ).aggregate(
+        next_open=Min('opens_at', filter=Q(holder__isnull=True)),
+        next_lapse=Min('expires_at'),
+    )
+    candidates = [value for value in next_at.values() if value is not None]
+    if not candidates:
+        return Admission(SOLD_OUT, None, 0)
+    return Admission(WAITING, None, max(1, math.ceil((min(candidates) - now).total_seconds())))
+
+
+def missing_tokens(user, product_ids, now=None):
+    """
+    Return the products in product_ids that are on a running flash sale but
+    have no valid token held by user.
+    """
+    now = now or timezone.now()
+    on_sale = set(
+        FlashSale.objects.filter(
+            product_id__in=product_ids, is_active=True, starts_at__lte=now, ends_at__gt=now
+        ).values_list('product_id', flat=True)
+    )
+    if not on_sale:
+        return set()
+    covered = set(
+        FlashSaleToken.objects.filter(
+            sale__product_id__in=on_sale, holder=user, used_at__isnull=True, expires_at__gt=now
+        ).values_list('sale__product_id', flat=True)
+    )
+    return on_sale - covered
+
+
+def use_tokens(user, product_ids, now=None):
+    """
+    Mark the user's tokens for product_ids as used.
+    標記搶購名額已使用
+
+    Call inside the order transaction so tokens are only spent if the order
+    commits.
+
+    Raises:
+        FlashSaleTokenError: If a flash-sale product has no valid token
+    """
+    now = now or timezone.now()
+    missing = missing_tokens(user, product_ids, now=now)
+    if missing:
+        raise FlashSaleTokenError(missing)
+    FlashSaleToken.objects.filter(
+        sale__product_id__in=product_ids, holder=user, used_at__isnull=True, expires_at__gt=now
+    ).update(used_at=now)
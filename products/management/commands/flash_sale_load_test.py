@@ -0,0 +1,202 @@
+"""
+Management command to load-test flash-sale admission against the database.
+
+Starts a real flash sale on a throwaway product and lets a crowd of buyers
+hit it from several threads at once, each thread on its own database
+connection. Every buyer claims a purchase token, retries while told to
+wait (capped at one second, so buyers keep pressing), and checks out
+(order + stock reservation) once admitted. Claims and checkouts commit
+like real requests; everything the run created is deleted at the end.
+
+Reports claim throughput, the admission rate against its ceiling, and
+whether any unit was oversold.
+"""
+
+import math
+import queue
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, transaction
+from django.utils import timezone
+
+from orders.inventory import InsufficientStockError, reserve_stock
+from orders.models import Order
+from products.flash_sale import ADMITTED, WAITING, claim_token, issue_tokens, use_tokens
+from products.models import Category, FlashSale, Product
+
+
+class Command(BaseCommand):
+    help = 'Run concurrent buyers against a flash sale and report admission throughput and oversell'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=1000, help='Number of buyers (default: 1000)')
+        parser.add_argument('--stock', type=int, default=100, help='Units on sale (default: 100)')
+        parser.add_argument('--rate', type=int, default=20, help='Admissions per second (default: 20)')
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=16,
+            help='Buyers claiming at the same time, one thread and connection each (default: 16)',
+        )
+        parser.add_argument(
+            '--timeout',
+            type=int,
+            default=120,
+            help='Give up after this many seconds (default: 120)',
+        )
+
+    def handle(self, *args, **options):
+        if min(options['buyers'], options['stock'], options['rate'], options['concurrency']) < 1:
+            self.stderr.write(self.style.ERROR('All options must be at least 1'))
+            return
+
+        sale, users = self.set_up(options['buyers'], options['stock'], options['rate'])
+        try:
+            report = self.run(sale, users, options['concurrency'], options['timeout'])
+            report.update(self.tally(sale, report['ahead'], options))
+        finally:
+            self.clean_up(sale, users)
+
+        self.stdout.write(
+            f"Buyers: {options['buyers']}  stock: {options['stock']}  rate: {options['rate']}/s  "
+            f"concurrency: {options['concurrency']}"
+        )
+        self.stdout.write(
+            f"Claim attempts: {report['attempts']} ({report['waiting']} told to wait, "
+            f"{report['errors']} database errors)  {report['claims_per_second']:.0f} claims/s"
+        )
+        self.stdout.write(f"Checkouts: {report['checkouts']}  rejected at checkout: {report['rejected']}")
+        self.stdout.write(
+            f"Peak admissions in one second: {report['peak']}  "
+            f"ahead of the rate ceiling: {report['ahead']}"
+        )
+        self.stdout.write(f"Stock left: {report['stock_left']}  oversold: {report['oversold']}")
+        style = self.style.SUCCESS if report['ok'] else self.style.ERROR
+        self.stdout.write(style(
+            f"{'PASS' if report['ok'] else 'FAIL'} (cleaned up, {report['elapsed']:.2f}s)"
+        ))
+
+    def set_up(self, buyers, stock, rate):
+        start = timezone.now()
+        slug = f'load-test-{start:%Y%m%d%H%M%S%f}'
+        category = Category.objects.create(name='壓力測試', slug=slug)
+        product = Product.objects.create(
+            name='壓力測試商品', slug=slug, sku=slug.upper(), category=category,
+            description='-', price=Decimal('999'), stock=stock, status='active',
+        )
+        sale = FlashSale.objects.create(
+            product=product, starts_at=start, ends_at=start + timedelta(hours=1), admission_rate=rate,
+        )
+        issue_tokens(sale)
+        User = get_user_model()
+        User.objects.bulk_create([
+            User(email=f'load-test-{i}@{slug}.invalid', password='!') for i in range(buyers)
+        ])
+        users = list(User.objects.filter(email__endswith=f'@{slug}.invalid').order_by('id'))
+        return sale, users
+
+    def run(self, sale, users, concurrency, timeout):
+        pending = queue.Queue()
+        for user in users:
+            pending.put(user)
+        deadline = time.monotonic() + timeout
+        lock = threading.Lock()
+        counts = Counter()
+        admitted_at = []
+
+        def count(name):
+            with lock:
+                counts[name] += 1
+
+        def buy(user):
+            while time.monotonic() < deadline:
+                count('attempts')
+                try:
+                    admission = claim_token(sale, user)
+                except OperationalError:
+                    # Lock timeouts and the like: the buyer just tries again
+                    count('errors')
+                    time.sleep(0.05)
+                    continue
+                if admission.status == WAITING:
+                    count('waiting')
+                    time.sleep(min(admission.retry_after, 1))
+                    continue
+                if admission.status != ADMITTED:
+                    return
+                with lock:
+                    admitted_at.append(timezone.now())
+                try:
+                    with transaction.atomic():
+                        order = Order.objects.create(user=user)
+                        use_tokens(user, [sale.product_id])
+                        reserve_stock(order, [(sale.product_id, None, 1)])
+                    count('checkouts')
+                except InsufficientStockError:
+                    count('rejected')
+                return
+
+        def worker():
+            try:
+                while True:
+                    try:
+                        user = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    buy(user)
+            finally:
+                connection.close()
+
+        started = time.monotonic()
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        # Tokens open at starts_at + i // rate, so by second k at most rate * (k + 1) may be in
+        per_second = Counter(int((at - sale.starts_at).total_seconds()) for at in admitted_at)
+        admitted, ahead = 0, 0
+        for second in range(max(per_second, default=-1) + 1):
+            admitted += per_second[second]
+            ahead = max(ahead, admitted - sale.admission_rate * (second + 1))
+        return {
+            'attempts': counts['attempts'],
+            'waiting': counts['waiting'],
+            'errors': counts['errors'],
+            'checkouts': counts['checkouts'],
+            'rejected': counts['rejected'],
+            'claims_per_second': counts['attempts'] / elapsed if elapsed else math.inf,
+            'peak': max(per_second.values(), default=0),
+            'ahead': ahead,
+            'elapsed': elapsed,
+        }
+
+    def tally(self, sale, ahead, options):
+        product = Product.objects.get(pk=sale.product_id)
+        orders = Order.objects.filter(stock_reservations__product=product).distinct().count()
+        oversold = max(0, -product.stock) + max(0, orders - options['stock'])
+        return {
+            'stock_left': product.stock,
+            'oversold': oversold,
+            'ok': (
+                oversold == 0 and ahead <= 0
+                and orders == min(options['stock'], options['buyers'])
+            ),
+        }
+
+    def clean_up(self, sale, users):
+        product = sale.product
+        with transaction.atomic():
+            Order.objects.filter(user__in=users).delete()
+            get_user_model().objects.filter(pk__in=[user.pk for user in users]).delete()
+            category = product.category
+            product.delete()
+            category.delete()
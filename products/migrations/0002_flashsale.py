@@ -0,0 +1,53 @@
+# Generated by Django 4.2.24 on 2026-10-19 10:39
+
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FlashSale',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('starts_at', models.DateTimeField(verbose_name='開始時間 / Starts At')),
+                ('ends_at', models.DateTimeField(verbose_name='結束時間 / Ends At')),
+                ('admission_rate', models.PositiveIntegerField(default=20, help_text='每秒開放的搶購名額數 / Purchase tokens opened per second', validators=[django.core.validators.MinValueValidator(1)], verbose_name='每秒放行人數 / Admissions per Second')),
+                ('token_ttl_minutes', models.PositiveIntegerField(default=10, help_text='未結帳的名額在此時間後釋出 / Unused tokens are reclaimed after this long', validators=[django.core.validators.MinValueValidator(1)], verbose_name='名額保留分鐘數 / Token Hold Minutes')),
+                ('is_active', models.BooleanField(default=True, verbose_name='啟用 / Active')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='創建時間 / Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新時間 / Updated At')),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='flash_sale', to='products.product', verbose_name='產品 / Product')),
+            ],
+            options={
+                'verbose_name': '限時搶購 / Flash Sale',
+                'verbose_name_plural': '限時搶購 / Flash Sales',
+                'ordering': ['-starts_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='FlashSaleToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('opens_at', models.DateTimeField(help_text='此名額可被領取的時間 / When this token can be claimed', verbose_name='開放時間 / Opens At')),
+                ('expires_at', models.DateTimeField(blank=True, null=True, verbose_name='到期時間 / Expires At')),
+                ('used_at', models.DateTimeField(blank=True, null=True, verbose_name='使用時間 / Used At')),
+                ('holder', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='flash_sale_tokens', to=settings.AUTH_USER_MODEL, verbose_name='持有者 / Holder')),
+                ('sale', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tokens', to='products.flashsale', verbose_name='限時搶購 / Flash Sale')),
+            ],
+            options={
+                'verbose_name': '搶購名額 / Flash Sale Token',
+                'verbose_name_plural': '搶購名額 / Flash Sale Tokens',
+                'ordering': ['opens_at', 'id'],
+                'indexes': [models.Index(fields=['sale', 'used_at', 'opens_at'], name='products_fl_sale_id_ef5f23_idx'), models.Index(fields=['sale', 'holder'], name='products_fl_sale_id_2b2fc3_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.24 on 2026-10-19 11:51
+
+from django.db import migrations, models
+
+
+def release_extra_tokens(apps, schema_editor):
+    """Keep each buyer's latest unused token per sale and return the rest to the pool."""
+    FlashSaleToken = apps.get_model('products', 'FlashSaleToken')
+    kept = set()
+    extra = []
+    unused = FlashSaleToken.objects.filter(holder__isnull=False, used_at__isnull=True)
+    for pk, sale_id, holder_id in unused.order_by('-expires_at', '-id').values_list('pk', 'sale_id', 'holder_id'):
+        if (sale_id, holder_id) in kept:
+            extra.append(pk)
+        else:
+            kept.add((sale_id, holder_id))
+    FlashSaleToken.objects.filter(pk__in=extra).update(holder=None, expires_at=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_flashsale'),
+    ]
+
+    operations = [
+        migrations.RunPython(release_extra_tokens, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='flashsaletoken',
+            constraint=models.UniqueConstraint(condition=models.Q(('used_at__isnull', True)), fields=('sale', 'holder'), name='flash_sale_token_one_open_per_holder'),
+        ),
+    ]
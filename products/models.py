@@ -3,6 +3,7 @@ Product models for Taiwan e-commerce platform.
 Includes categories, products, variants, and images with bilingual support.
 """
 
+from django.conf import settings
 from django.db import models
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
@@ -544,3 +545,127 @@ class ProductVariant(models.Model):
         """Check if variant is in stock."""
         return self.stock > 0
 
+
+
+class FlashSale(models.Model):
+    """
+    Flash-sale mode for a limited-stock product.
+    Stock is pre-split into single-unit purchase tokens that open at a fixed
+    rate, so only token holders reach checkout and throughput has a ceiling.
+    """
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='flash_sale',
+        verbose_name=_('產品 / Product')
+    )
+    
+    starts_at = models.DateTimeField(
+        _('開始時間 / Starts At')
+    )
+    
+    ends_at = models.DateTimeField(
+        _('結束時間 / Ends At')
+    )
+    
+    admission_rate = models.PositiveIntegerField(
+        _('每秒放行人數 / Admissions per Second'),
+        default=20,
+        validators=[MinValueValidator(1)],
+        help_text=_('每秒開放的搶購名額數 / Purchase tokens opened per second')
+    )
+    
+    token_ttl_minutes = models.PositiveIntegerField(
+        _('名額保留分鐘數 / Token Hold Minutes'),
+        default=10,
+        validators=[MinValueValidator(1)],
+        help_text=_('未結帳的名額在此時間後釋出 / Unused tokens are reclaimed after this long')
+    )
+    
+    is_active = models.BooleanField(
+        _('啟用 / Active'),
+        default=True
+    )
+    
+    created_at = models.DateTimeField(
+        _('創建時間 / Created At'),
+        auto_now_add=True
+    )
+    updated_at = models.DateTimeField(
+        _('更新時間 / Updated At'),
+        auto_now=True
+    )
+    
+    class Meta:
+        verbose_name = _('限時搶購 / Flash Sale')
+        verbose_name_plural = _('限時搶購 / Flash Sales')
+        ordering = ['-starts_at']
+    
+    def __str__(self):
+        return f"{self.product.name} ({self.starts_at:%Y-%m-%d %H:%M})"
+    
+    @property
+    def is_running(self):
+        """Check if the sale window is open."""
+        return self.is_active and self.starts_at <= timezone.now() < self.ends_at
+
+
+class FlashSaleToken(models.Model):
+    """
+    A single-unit purchase token for a flash sale.
+    """
+    sale = models.ForeignKey(
+        FlashSale,
+        on_delete=models.CASCADE,
+        related_name='tokens',
+        verbose_name=_('限時搶購 / Flash Sale')
+    )
+    
+    opens_at = models.DateTimeField(
+        _('開放時間 / Opens At'),
+        help_text=_('此名額可被領取的時間 / When this token can be claimed')
+    )
+    
+    holder = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='flash_sale_tokens',
+        verbose_name=_('持有者 / Holder')
+    )
+    
+    expires_at = models.DateTimeField(
+        _('到期時間 / Expires At'),
+        null=True,
+        blank=True
+    )
+    
+    used_at = models.DateTimeField(
+        _('使用時間 / Used At'),
+        null=True,
+        blank=True
+    )
+    
+    class Meta:
+        verbose_name = _('搶購名額 / Flash Sale Token')
+        verbose_name_plural = _('搶購名額 / Flash Sale Tokens')
+        ordering = ['opens_at', 'id']
+        indexes = [
+            models.Index(fields=['sale', 'used_at', 'opens_at']),
+            models.Index(fields=['sale', 'holder']),
+        ]
+        # One unused token per buyer and sale, so two tabs or a double click
+        # cannot both claim one. Used tokens are kept out so the buyer's
+        # purchase history stays intact.
+        # 每位買家每場搶購僅能持有一個未使用名額
+        constraints = [
+            models.UniqueConstraint(
+                fields=['sale', 'holder'],
+                condition=models.Q(used_at__isnull=True),
+                name='flash_sale_token_one_open_per_holder',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.sale_id} #{self.pk}"
@@ -1,3 +1,179 @@
-from django.test import TestCase
+"""
+Tests for products and flash-sale admission.
+"""
 
-# Create your tests here.
+import json
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from .flash_sale import (
+    ADMITTED, LIMIT_REACHED, SOLD_OUT, WAITING, FlashSaleTokenError,
+    claim_token, issue_tokens, missing_tokens, use_tokens,
+)
+from .models import Category, FlashSale, Product
+
+
+class FlashSaleTest(TestCase):
+    """Test token issuing, admission rate and checkout gating."""
+
+    def setUp(self):
+        self.now = timezone.now()
+        category = Category.objects.create(name='牛肉', slug='beef')
+        self.product = Product.objects.create(
+            name='安格斯限量', slug='angus-limited', sku='ANGUS-LTD', category=category,
+            description='測試商品', price=Decimal('1999.00'), stock=5, status='active',
+        )
+        self.sale = FlashSale.objects.create(
+            product=self.product, starts_at=self.now, ends_at=self.now + timedelta(hours=1),
+            admission_rate=2, token_ttl_minutes=10,
+        )
+        self.users = [
+            get_user_model().objects.create_user(
+                email=f'buyer{i}@example.com', password='testpass123', is_active=True
+            )
+            for i in range(7)
+        ]
+
+    def test_issue_tokens_staggers_by_rate(self):
+        self.assertEqual(issue_tokens(self.sale), 5)
+        offsets = [
+            (token.opens_at - self.now).total_seconds() for token in self.sale.tokens.all()
+        ]
+        self.assertEqual(offsets, [0, 0, 1, 1, 2])
+
+    def test_admission_rate_is_a_ceiling(self):
+        issue_tokens(self.sale)
+        statuses = [claim_token(self.sale, user, now=self.now).status for user in self.users[:3]]
+        self.assertEqual(statuses, [ADMITTED, ADMITTED, WAITING])
+
+        waiting = claim_token(self.sale, self.users[2], now=self.now)
+        self.assertEqual(waiting.retry_after, 1)
+        later = self.now + timedelta(seconds=1)
+        self.assertEqual(claim_token(self.sale, self.users[2], now=later).status, ADMITTED)
+
+    def test_never_admits_more_than_stock(self):
+        issue_tokens(self.sale)
+        later = self.now + timedelta(seconds=5)
+        statuses = [claim_token(self.sale, user, now=later).status for user in self.users]
+        self.assertEqual(statuses.count(ADMITTED), 5)
+        # Held tokens may still lapse, so the rest are told to wait rather than sold out
+        self.assertEqual(statuses[5:], [WAITING, WAITING])
+
+    def test_lapsed_token_is_reclaimed(self):
+        issue_tokens(self.sale, quantity=1)
+        claim_token(self.sale, self.users[0], now=self.now)
+        lapsed = self.now + timedelta(minutes=11)
+        self.assertEqual(claim_token(self.sale, self.users[1], now=lapsed).status, ADMITTED)
+        self.assertEqual(missing_tokens(self.users[0], [self.product.id], now=lapsed), {self.product.id})
+
+    def test_used_token_limits_buyer_and_sells_out(self):
+        issue_tokens(self.sale, quantity=1)
+        claim_token(self.sale, self.users[0], now=self.now)
+        use_tokens(self.users[0], [self.product.id], now=self.now)
+
+        self.assertEqual(claim_token(self.sale, self.users[0], now=self.now).status, LIMIT_REACHED)
+        self.assertEqual(claim_token(self.sale, self.users[1], now=self.now).status, SOLD_OUT)
+
+    def test_buyer_holds_one_open_token(self):
+        issue_tokens(self.sale)
+        claim_token(self.sale, self.users[0], now=self.now)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.sale.tokens.filter(holder__isnull=True).update(holder=self.users[0])
+
+    def test_buyer_with_lapsed_token_can_claim_again(self):
+        issue_tokens(self.sale)
+        claim_token(self.sale, self.users[0], now=self.now)
+        lapsed = self.now + timedelta(minutes=11)
+        admission = claim_token(self.sale, self.users[0], now=lapsed)
+        self.assertEqual(admission.status, ADMITTED)
+        self.assertEqual(self.sale.tokens.filter(holder=self.users[0]).count(), 1)
+
+    def test_use_tokens_requires_holder(self):
+        issue_tokens(self.sale)
+        with self.assertRaises(FlashSaleTokenError):
+            use_tokens(self.users[0], [self.product.id])
+
+    def test_add_to_cart_queues_buyers_past_the_rate(self):
+        issue_tokens(self.sale, quantity=1)
+        # Push the only token into the future so the buyer has to wait
+        self.sale.tokens.update(opens_at=timezone.now() + timedelta(seconds=30))
+        self.client.force_login(self.users[0])
+
+        response = self.client.post(
+            reverse('cart:add_to_cart'),
+            data=json.dumps({'product_id': self.product.id, 'quantity': 1}),
+            content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(response.json()['waiting'])
+        self.assertGreaterEqual(int(response['Retry-After']), 29)
+
+
+class FlashSaleSameBuyerTest(TransactionTestCase):
+    """Test one buyer claiming from several requests at once."""
+
+    def test_concurrent_claims_share_one_token(self):
+        category = Category.objects.create(name='牛肉', slug='beef')
+        product = Product.objects.create(
+            name='安格斯限量', slug='angus-limited', sku='ANGUS-LTD', category=category,
+            description='測試商品', price=Decimal('1999.00'), stock=10, status='active',
+        )
+        now = timezone.now()
+        sale = FlashSale.objects.create(
+            product=product, starts_at=now, ends_at=now + timedelta(hours=1), admission_rate=10,
+        )
+        issue_tokens(sale)
+        buyer = get_user_model().objects.create_user(email='buyer@example.com', password='testpass123')
+
+        requests = 6
+        start = threading.Barrier(requests)
+        admissions = []
+
+        def claim():
+            try:
+                start.wait()
+                while True:
+                    try:
+                        admissions.append(claim_token(sale, buyer))
+                        return
+                    except OperationalError:
+                        # SQLite locks the whole database while another thread writes
+                        continue
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=claim) for _ in range(requests)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([a.status for a in admissions], [ADMITTED] * requests)
+        self.assertEqual(len({a.token.pk for a in admissions}), 1)
+        self.assertEqual(sale.tokens.filter(holder=buyer).count(), 1)
+
+
+class FlashSaleLoadTest(TransactionTestCase):
+    """Test the concurrent flash-sale load test end to end."""
+
+    def test_load_test_command_passes(self):
+        # SQLite's in-memory test database serializes writers, so run concurrently only on PostgreSQL
+        concurrency = 8 if connection.vendor == 'postgresql' else 1
+        out = StringIO()
+        call_command(
+            'flash_sale_load_test', '--buyers=30', '--stock=10', '--rate=20',
+            f'--concurrency={concurrency}', stdout=out,
+        )
+        self.assertIn('oversold: 0', out.getvalue())
+        self.assertIn('PASS', out.getvalue())
+        self.assertFalse(Product.objects.filter(sku__startswith='LOAD-TEST').exists())
+        self.assertFalse(get_user_model().objects.filter(email__startswith='load-test-').exists())